@@ -1,4 +1,4 @@
-from comment.views import CommentCreate, CommentDelete, CommentLike
+from comment.views import CommentCreate, CommentDelete, CommentLike, CommentLikeBatch
 from django.conf.urls import url
 
 
@@ -8,5 +8,6 @@ urlpatterns = [
     url(r'^create/$', CommentCreate.as_view(), name='create'),
     url(r'^delete/$', CommentDelete.as_view(), name='delete'),
     url(r'^count/like/$', CommentLike.as_view(), name='setlike'),
-    url(r'^count/like/(?P<commentid>[0-9]+)/$', CommentLike.as_view(), name='getlike')
+    url(r'^count/like/(?P<commentid>[0-9]+)/$', CommentLike.as_view(), name='getlike'),
+    url(r'^count/like/batch/(?P<commentids>[0-9,]+)/$', CommentLikeBatch.as_view(), name='getlikebatch')
 ]
@@ -1,9 +1,9 @@
 import json
 from uuid import uuid4
-from user.models import Users
 from post.models import Posts
 from comment.models import Comments
-from lifesnap.util import JSONResponse
+from lifesnap.util import JSONResponse, parse_ids
+from lifesnap.profiles import USER_ID, resolve_user
 from django.views import View
 from django.http import HttpRequest
 from django.core.exceptions import ObjectDoesNotExist
@@ -32,7 +32,7 @@ class CommentCreate(View):
 
         try:
             post = Posts.objects.get(post_id__exact=req_json.get('postid'))
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='post {} or user {} was not found'.format(req_json.get('postid'), req_json.get('userid')))
 
@@ -44,8 +44,9 @@ class CommentCreate(View):
         comment.author_id = user.user_id
         comment.author_name = user.user_name
         comment.message = message
+        # set before the save, so the post_save signal knows the post (see lifesnap/versions.py)
+        comment.post = post
         comment.save()
-        post.comments_set.add(comment)
 
         return JSONResponse.new(code=200, message='success', commentid=comment.comment_id)
 
@@ -64,7 +65,7 @@ class CommentDelete(View):
            return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
             comment = Comments.objects.get(comment_id__exact=req_json.get('commentid'))
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user {} or comment {} is not found'.format(req_json.get('userid'), req_json.get('commentid')))
@@ -110,7 +111,7 @@ class CommentLike(View):
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = User.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
             comment = Comments.objects.get(comment_id__exact=req_json.get('commentid'))
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} or commentid {} is not found'.format(req_json.get('userid'), req_json.get('commentid')))
@@ -119,5 +120,28 @@ class CommentLike(View):
             return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
 
         comment.like_count += 1
-        comment.save()
+        comment.save(update_fields=['like_count'])
         return JSONResponse.new(code=200, message='success', count=comment.like_count)
+
+
+class CommentLikeBatch(View):
+    """ the like counts for a list of comment ids, in one query
+        GET: /count/like/batch/(commentids)/ commentids: up to BATCH_MAX_IDS ids separated by commas
+        returned json object {
+            'likes': {commentid: like count},
+            'missing': the commentids that were not found
+        }
+    """
+    def get(self, request: HttpRequest, commentids: str):
+        try:
+            commentids = parse_ids(commentids)
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        likes = dict(Comments.objects.filter(comment_id__in=commentids).values_list('comment_id', 'like_count'))
+        return JSONResponse.new(
+            code=200,
+            message='success',
+            likes=likes,
+            missing=[commentid for commentid in commentids if commentid not in likes]
+        )
@@ -0,0 +1,106 @@
+""" gunicorn settings for running lifesnap in production
+    gunicorn -c gunicorn.conf.py lifesnap.wsgi
+
+    Workers and threads are sized from the CPUs this process may use and WEB_IO_WAIT_RATIO, how long a
+    request waits on the database and network for every unit of CPU it uses (1.0 = as long waiting as
+    working). One worker process per CPU does the python work, the GIL keeps a process on one core, and
+    each worker gets 1 + WEB_IO_WAIT_RATIO threads to keep that core busy while requests wait.
+    posts/notify/ listeners hold a thread for as long as they wait (up to NOTIFY_STREAM_SECONDS), each
+    worker gets NOTIFY_THREADS more threads for them and the app lets no more than that many listen at
+    once (NOTIFY_MAX_LISTENERS), so listeners never take the threads the rest of the API needs.
+    WEB_CONCURRENCY and WEB_THREADS set the counts directly.
+
+    The app is loaded once in the master before the workers fork (preload_app), so the workers share its
+    memory copy on write. Workers are replaced after MAX_REQUESTS requests (plus up to MAX_REQUESTS_JITTER,
+    so they don't all restart at once), which keeps slow memory growth in check.
+
+    Reload:
+        kill -HUP <master pid>      new workers with the same code, in flight requests finish first
+        kill -USR2 <master pid>     start a new master with new code next to the old one, then
+        kill -TERM <old master pid> stop the old one once the new workers answer (zero downtime deploy)
+    With preload_app the code is loaded by the master, so only USR2 picks up new code.
+
+    Sessions and the profile cache have to be shared by the workers. A locmem cache is per process: a
+    logout in one worker would leave the session valid in the others, so gunicorn refuses to start more
+    than one worker unless MEMCACHED_LOCATION points the cache at memcached (see lifesnap/settings.py).
+
+    Every new worker starts the email outbox worker thread when emails are still waiting from before the
+    restart, nothing else would until the next email is queued (see lifesnap/outbox.py).
+"""
+import os
+import math
+import multiprocessing
+
+
+def cpu_count() -> int:
+    """ the CPUs this process may run on, which can be fewer than the machine has in a container """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+io_wait_ratio = float(os.environ.get('WEB_IO_WAIT_RATIO', '1.0'))
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, cpu_count())))
+notify_threads = int(os.environ.get('NOTIFY_THREADS', '8'))
+# read by lifesnap/settings.py, the config file runs before the app is loaded
+os.environ.setdefault('NOTIFY_MAX_LISTENERS', str(notify_threads))
+threads = int(os.environ.get('WEB_THREADS', math.ceil(1 + io_wait_ratio) + notify_threads))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+preload_app = True
+max_requests = int(os.environ.get('MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', '100'))
+
+timeout = int(os.environ.get('WEB_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# the worker heartbeat files go to memory, a container's overlay disk can stall them
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    if workers > 1:
+        check_shared_caches()
+
+
+def check_shared_caches():
+    """ raise RuntimeError when sessions or profiles would be cached per process, gunicorn prints it and exits """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lifesnap.settings')
+    from django.conf import settings
+
+    for alias in sorted({settings.SESSION_CACHE_ALIAS, settings.PROFILE_CACHE_ALIAS}):
+        backend = settings.CACHES[alias]['BACKEND']
+        if backend.endswith('.LocMemCache'):
+            raise RuntimeError(
+                'the {!r} cache is per process ({}) but {} workers would share sessions and profiles through it, '
+                'set MEMCACHED_LOCATION or WEB_CONCURRENCY=1'.format(alias, backend, workers))
+
+
+def when_ready(server):
+    server.log.info('%d workers x %d threads (%s), io wait ratio %.1f, %s notify listeners per worker',
+                    workers, threads, worker_class, io_wait_ratio, os.environ['NOTIFY_MAX_LISTENERS'])
+
+
+def pre_fork(server, worker):
+    # a connection opened while preloading must not be shared by the workers, they each open their own.
+    # the S3 clients reset themselves after a fork (lifesnap.aws.reset_clients)
+    from django.db import connections
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    from django.db import connection
+    from lifesnap.outbox import resume_pending
+
+    try:
+        resume_pending()
+    finally:
+        # the request threads open their own connections
+        connection.close()
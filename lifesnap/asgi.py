@@ -0,0 +1,25 @@
+"""
+ASGI config for lifesnap project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Django 1.11 has no async views, every view is a sync view that runs on a thread pool of the ASGI server,
+through asgiref's WsgiToAsgi adapter (asgiref is in requirements.txt). On Django 3.0 and later django's own
+ASGI handler is used. The slow storage work is already kept off the request threads: post images and
+profile pictures go through lifesnap/upload_queue.py, deletes through lifesnap.storage.release_later, and
+email goes through the outbox, so a request thread only waits on the database.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lifesnap.settings")
+
+if django.VERSION >= (3, 0):
+    from django.core.asgi import get_asgi_application
+    application = get_asgi_application()
+else:
+    from asgiref.wsgi import WsgiToAsgi
+    from django.core.wsgi import get_wsgi_application
+    application = WsgiToAsgi(get_wsgi_application())
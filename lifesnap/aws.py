@@ -1,8 +1,75 @@
-import base64
-import binascii
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from lifesnap.upload import decode_base64
+
+from django.conf import settings
+
+# S3 multipart parts have a 5MB minimum, so an upload holds at most max_concurrency parts in memory
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=5 * 1024 * 1024,
+    multipart_chunksize=5 * 1024 * 1024,
+    max_concurrency=2
+)
+
+# S3 takes at most 1000 keys per delete_objects request
+DELETE_BATCH_SIZE = 1000
+# per key delete errors worth retrying, anything else (AccessDenied...) won't go away on its own
+RETRY_DELETE_CODES = ('InternalError', 'ServiceUnavailable', 'SlowDown', 'RequestTimeout')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+_delete_executor = None
+_delete_executor_lock = threading.Lock()
+
+
+def _get_delete_executor() -> ThreadPoolExecutor:
+    global _delete_executor
+    if _delete_executor is None:
+        with _delete_executor_lock:
+            if _delete_executor is None:
+                _delete_executor = ThreadPoolExecutor(max_workers=settings.AWS_DELETE_WORKERS)
+    return _delete_executor
 
 
+def get_client(service_name: str = 's3'):
+    """ return the process wide client for an AWS service, it is created on first use
+        boto3 clients are thread safe, sharing one means credentials and endpoints are resolved once
+        and its connection pool (AWS_MAX_POOL_CONNECTIONS, kept alive) is reused across requests.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service_name)
+            if client is None:
+                config = Config(
+                    max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True
+                )
+                # sessions are not thread safe, each client gets its own
+                client = boto3.session.Session().client(service_name, config=config)
+                _clients[service_name] = client
+    return client
+
+
+def reset_clients():
+    """ forget the shared clients, the next get_client call creates new ones """
+    with _clients_lock:
+        _clients.clear()
+
+
+# a forked worker must not share the parents open connections
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_clients)
+
 
 class AWS(object):
     """ Handle AWS S3 functions """
@@ -10,7 +77,7 @@ class AWS(object):
     def __init__(self, bucket_name: str):
         super()
         self.bucket_name = bucket_name
-        self.s3 = boto3.client('s3')
+        self.s3 = get_client('s3')
 
     def upload_profile_image(self, key_name: str, b64_bytes: str) -> str:
         """ upload an image for the users profile picture to our S3 bucket
@@ -22,30 +89,18 @@ class AWS(object):
         if not b64_bytes:
             raise ValueError('b64_bytes byte size is 0')
 
-        try:
-            # is this part necessary?
-            b64_bytes = bytes(b64_bytes, encoding='utf-8')
-            image_bytes = base64.b64decode(b64_bytes)
-        except binascii.Error as err:
-            raise ValueError('b64 decode error {}'.format(err))
-
-        self.s3.put_object(
-            ACL='public-read',
-            Body=image_bytes,
-            Bucket=self.bucket_name,
-            Key='profilepic/{}'.format(key_name),
-            ContentType='image/*',
-            ServerSideEncryption='AES256'
-        )
+        with decode_base64(b64_bytes) as image_file:
+            return self.upload_profile_image_file(key_name, image_file)
 
-        url = self.s3.generate_presigned_url(
-            ClientMethod='get_object',
-            Params={
-                'Bucket': self.bucket_name,
-                'Key': 'profilepic/{}'.format(key_name)
-            }
-        )
-        return url[:url.find('?')]
+    def upload_profile_image_file(self, key_name: str, image_file) -> str:
+        """ upload an already decoded profile picture to our S3 bucket, large files are sent as a multipart upload
+            key_name: this is the key name for the image being uploaded. This can be thought of as the files name
+            image_file: a binary file object holding the image, see lifesnap.upload.read_json_upload
+
+            return value: a string representing a URL that can be used do download the image or placed inside <image> tags to view
+        """
+        self.upload_file('profilepic/{}'.format(key_name), image_file)
+        return self.image_url('profilepic/{}'.format(key_name))
 
     def upload_image(self, key_name: str, b64_bytes: str) -> str:
         """ upload an image to our S3 bucket
@@ -58,29 +113,119 @@ class AWS(object):
         if not b64_bytes:
             raise ValueError('b64_bytes byte size is 0')
 
-        try:
-            b64_bytes = bytes(b64_bytes, encoding='utf-8')
-            image_bytes = base64.b64decode(b64_bytes)
-        except binascii.Error as err:
-            raise ValueError('b64 decode error {}'.format(err))
+        with decode_base64(b64_bytes) as image_file:
+            return self.upload_image_file(key_name, image_file)
 
-        self.s3.put_object(
-            Body=image_bytes,
-            Bucket=self.bucket_name,
-            Key=key_name,
-            ACL='public-read',
-            ContentType='image/*',
-            ServerSideEncryption='AES256'
+    def upload_image_file(self, key_name: str, image_file) -> str:
+        """ upload an already decoded image to our S3 bucket, large files are sent as a multipart upload
+            key_name: this is the key name for the image being uploaded. This can be thought of as the files name
+            image_file: a binary file object holding the image, see lifesnap.upload.read_json_upload
+
+            return value: a string representing a URL that can be used do download the image or placed inside <image> tags to view
+        """
+        self.upload_file(key_name, image_file)
+        return self.image_url(key_name)
+
+    def upload_file(self, key_name: str, image_file):
+        """ upload a binary file object to our S3 bucket as a public image, large files are sent as a multipart upload
+            key_name: the full key of the image, including any prefix such as profilepic/
+        """
+        self.s3.upload_fileobj(
+            image_file,
+            self.bucket_name,
+            key_name,
+            ExtraArgs={
+                'ACL': 'public-read',
+                'ContentType': 'image/*',
+                'ServerSideEncryption': 'AES256'
+            },
+            Config=TRANSFER_CONFIG
         )
 
-        url = self.s3.generate_presigned_url(
+    def image_url(self, key_name: str) -> str:
+        """ return the public URL for an image in our S3 bucket, it is built locally, nothing is signed
+            key_name: the full key of the image, including any prefix such as profilepic/
+        """
+        return 'https://{}.s3.amazonaws.com/{}'.format(self.bucket_name, quote(key_name))
+
+    def signed_url(self, key_name: str, expires: int) -> str:
+        """ return a presigned download URL for an image in our S3 bucket
+            expires: number of seconds the URL is valid for
+        """
+        return self.s3.generate_presigned_url(
             ClientMethod='get_object',
             Params={
                 'Bucket': self.bucket_name,
                 'Key': key_name
+            },
+            ExpiresIn=expires
+        )
+
+    def presign_upload(self, key_name: str, method: str = 'post', expires: int = 300, max_bytes: int = 10485760) -> dict:
+        """ create a presigned request the frontend can use to upload an image straight to our S3 bucket,
+            the image bytes never go through our server.
+            key_name: the full key the image will be stored under
+            method: 'post' for a browser form upload, 'put' for a plain PUT of the raw bytes
+            expires: number of seconds the presigned request is valid for
+            max_bytes: largest upload S3 will accept, only enforced for 'post'
+
+            return value: dict {
+                'url': the URL to send the upload to,
+                'fields': form fields that must be sent with a 'post' upload,
+                'headers': headers that must be sent with a 'put' upload
             }
+        """
+        if method == 'put':
+            headers = {
+                'Content-Type': 'image/*',
+                'x-amz-acl': 'public-read',
+                'x-amz-server-side-encryption': 'AES256'
+            }
+            url = self.s3.generate_presigned_url(
+                ClientMethod='put_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': key_name,
+                    'ACL': 'public-read',
+                    'ContentType': 'image/*',
+                    'ServerSideEncryption': 'AES256'
+                },
+                ExpiresIn=expires,
+                HttpMethod='PUT'
+            )
+            return dict({'url': url, 'fields': {}, 'headers': headers})
+
+        if method != 'post':
+            raise ValueError('unknown upload method {}'.format(method))
+
+        fields = {
+            'acl': 'public-read',
+            'Content-Type': 'image/*',
+            'x-amz-server-side-encryption': 'AES256'
+        }
+        conditions = [{key: value} for (key, value) in fields.items()]
+        conditions.append(['content-length-range', 1, max_bytes])
+
+        resp = self.s3.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=key_name,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expires
         )
-        return url[:url.find('?')]
+        return dict({'url': resp['url'], 'fields': resp['fields'], 'headers': {}})
+
+    def image_exists(self, key_name: str) -> bool:
+        """ check if an image has been uploaded to our S3 bucket
+            key_name: the full key of the image, including any prefix such as profilepic/
+        """
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=key_name)
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
 
     def remove_image(self, key_name: str):
         """ remove an image from our AWS S3 bucket
@@ -96,23 +241,62 @@ class AWS(object):
         # deleting from a S3 bucket will always return a 204. no solid way of checking success
         self.s3.delete_object(Bucket=self.bucket_name, Key='profilepic/{}'.format(key_name))
 
-    def remove_images(self, key_names: [str]):
+    def remove_images(self, key_names: [str], retries: int = 3) -> dict:
         """ removes multiple images from our AWS S3 bucket
             key_names: list of the image names that need to be deleted.
+            retries: how many more times keys that failed with a temporary error are tried
+
+            the keys are sent DELETE_BATCH_SIZE at a time, batches run in parallel on AWS_DELETE_WORKERS threads
+            return value: dict {
+                'deleted': number of keys removed,
+                'failed': dict {key: error} for the keys that could not be removed
+            }
         """
-        if not key_names:
-            return
+        key_names = list(dict.fromkeys(key for key in key_names if key))
+        batches = [key_names[i:i + DELETE_BATCH_SIZE] for i in range(0, len(key_names), DELETE_BATCH_SIZE)]
 
-        objects = []
-        for key in key_names:
-            objects.append({
-                'Key': key
-            })
+        if len(batches) > 1:
+            results = _get_delete_executor().map(lambda batch: self._remove_batch(batch, retries), batches)
+        else:
+            results = [self._remove_batch(batch, retries) for batch in batches]
 
-        resp = self.s3.delete_objects(
-            Bucket=self.bucket_name,
-            Delete=dict({
-                'Objects': objects,
-            })
-        )
-        return resp
+        summary = dict({'deleted': 0, 'failed': {}})
+        for (deleted, failed) in results:
+            summary['deleted'] += deleted
+            summary['failed'].update(failed)
+        return summary
+
+    def _remove_batch(self, key_names: [str], retries: int) -> (int, dict):
+        """ one delete_objects request, retried for the keys that fail with a temporary error """
+        deleted = 0
+        failed = {}
+        pending = key_names
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(0.1 * 2 ** attempt)
+
+            try:
+                # quiet mode only lists the keys that failed
+                resp = self.s3.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete=dict({
+                        'Objects': [{'Key': key} for key in pending],
+                        'Quiet': True
+                    })
+                )
+            except ClientError as err:
+                # botocore already retried the request itself
+                failed.update((key, '{}'.format(err)) for key in pending)
+                break
+
+            errors = resp.get('Errors', [])
+            deleted += len(pending) - len(errors)
+            failed.update((error['Key'], '{}: {}'.format(error.get('Code'), error.get('Message'))) for error in errors)
+            pending = [error['Key'] for error in errors if error.get('Code') in RETRY_DELETE_CODES]
+            if not pending or attempt == retries:
+                break
+
+            # tried again, these keys only count as failed if the last attempt fails too
+            for key in pending:
+                del failed[key]
+        return (deleted, failed)
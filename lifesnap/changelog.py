@@ -0,0 +1,301 @@
+""" the change log behind user/changes/, what changed for a user since they last synced
+    Every change a feed, follow list or profile shows is logged as (user, kind, object id): model saves and
+    deletes through signals (connected in UserConfig.ready), queryset update() calls through log_posts()
+    and log_profiles(). A client keeps the version it was last sent and changes_since() reads the entries
+    from there on for the user and the users they follow with the (user_pk, txid) index, so a resync costs
+    the size of the change set and not the size of the feed.
+
+    Versions are positions in commit order, not entry ids. On Postgres ids are handed out at insert and
+    show at commit, so a client sent up to id 102 while 101 was still uncommitted would never get 101.
+    Every entry is stamped with the id of the transaction that wrote it (txid_current()) and a read only
+    returns entries of transactions older than the oldest one still running (the xmin of its snapshot),
+    all of which have committed or rolled back, then hands out that xmin as the next version. A change is
+    held back until the transactions before it finish, and sent exactly once. Other databases (sqlite in
+    development) commit one writer at a time, there the entry id is the position.
+
+    An object changed many times is sent once, with its current state. `manage.py compactchanges` keeps the
+    log small, it removes every entry but the newest for each object, and the entries older than
+    CHANGE_LOG_RETENTION_DAYS. A client whose version is older than the entries compaction removed by age
+    is told to reset and load everything again.
+"""
+from datetime import timedelta
+
+from lifesnap.serializers import FEED_FIELDS, serialize_posts
+from lifesnap.derivatives import variant_urls
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.utils import timezone
+
+
+def _by_txid() -> bool:
+    return connection.vendor == 'postgresql'
+
+
+def _position() -> str:
+    """ the Changes field versions are compared with, see the module docstring """
+    return 'txid' if _by_txid() else 'id'
+
+
+def _write(entries: [(int, str, int)]):
+    """ insert (user_pk, kind, object_id) entries, stamped with the id of the transaction that writes them """
+    from user.models import Changes
+
+    entries = list(entries)
+    if not entries:
+        return
+
+    # in one transaction with the insert, or the stamp would be the id of the select's own transaction
+    with transaction.atomic():
+        txid = 0
+        if _by_txid():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT txid_current()')
+                txid = cursor.fetchone()[0]
+        Changes.objects.bulk_create([
+            Changes(user_pk=user_pk, kind=kind, object_id=object_id, txid=txid) for (user_pk, kind, object_id) in entries
+        ])
+
+
+def log(user_pk: int, kind: str, object_ids):
+    """ log a change to each object of a user, kind is one of Changes.KINDS """
+    if user_pk is None:
+        return
+    _write((user_pk, kind, object_id) for object_id in set(object_ids))
+
+
+def log_posts(post_pks: [int]):
+    """ log a change to these posts, for writes made with a queryset update() """
+    from post.models import Posts
+
+    rows = Posts.objects.filter(pk__in=post_pks, user__isnull=False).values_list('user_id', 'post_id')
+    _write((user_pk, 'post', post_id) for (user_pk, post_id) in rows)
+
+
+def log_profiles(user_pks: [int]):
+    """ log a change to these users profiles, for writes made with a queryset update() """
+    from user.models import Users
+
+    rows = Users.objects.filter(pk__in=user_pks).values_list('pk', 'user_id')
+    _write((pk, 'profile', user_id) for (pk, user_id) in rows)
+
+
+def _only_likes(update_fields) -> bool:
+    return update_fields is not None and set(update_fields) == {'like_count'}
+
+
+def _post_saved(sender, instance, update_fields=None, **kwargs):
+    log(instance.user_id, 'like' if _only_likes(update_fields) else 'post', [instance.post_id])
+
+
+def _post_deleted(sender, instance, **kwargs):
+    log(instance.user_id, 'post', [instance.post_id])
+
+
+def _comment_changed(sender, instance, update_fields=None, **kwargs):
+    from post.models import Posts
+
+    if instance.post_id is None:
+        return
+    # gone when the whole post is being deleted, the post's own entry covers its comments
+    owner = Posts.objects.filter(pk=instance.post_id).values_list('user_id', flat=True).first()
+    log(owner, 'commentlike' if _only_likes(update_fields) else 'comment', [instance.comment_id])
+
+
+def _user_saved(sender, instance, **kwargs):
+    log(instance.pk, 'profile', [instance.user_id])
+
+
+def _user_deleting(sender, instance, **kwargs):
+    # the follow rows go with the user without an m2m signal, the followers are told here
+    for follower_pk in instance.users_set.values_list('pk', flat=True):
+        log(follower_pk, 'follow', [instance.user_id])
+
+
+def _following_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    from user.models import Users
+
+    if action == 'pre_clear':
+        # pk_set is only sent with add and remove, a clear is logged before the rows go
+        pk_set = set((instance.users_set if reverse else instance.following).values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        # instance is the followed user, pk_set the followers
+        for follower_pk in pk_set or ():
+            log(follower_pk, 'follow', [instance.user_id])
+    else:
+        log(instance.pk, 'follow', Users.objects.filter(pk__in=pk_set or ()).values_list('user_id', flat=True))
+
+
+def connect():
+    """ log changes when posts, comments, users and follows are saved or deleted """
+    from user.models import Users
+    from post.models import Posts
+    from comment.models import Comments
+
+    post_save.connect(_post_saved, sender=Posts, dispatch_uid='lifesnap.changelog.posts.save')
+    post_delete.connect(_post_deleted, sender=Posts, dispatch_uid='lifesnap.changelog.posts.delete')
+    post_save.connect(_comment_changed, sender=Comments, dispatch_uid='lifesnap.changelog.comments.save')
+    post_delete.connect(_comment_changed, sender=Comments, dispatch_uid='lifesnap.changelog.comments.delete')
+    post_save.connect(_user_saved, sender=Users, dispatch_uid='lifesnap.changelog.users.save')
+    pre_delete.connect(_user_deleting, sender=Users, dispatch_uid='lifesnap.changelog.users.delete')
+    m2m_changed.connect(_following_changed, sender=Users.following.through, dispatch_uid='lifesnap.changelog.following')
+
+
+def _horizon() -> int:
+    """ the first position that may still be uncommitted, every entry before it can be read """
+    from user.models import Changes, ChangeCompactions
+
+    if _by_txid():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            return cursor.fetchone()[0]
+
+    newest = Changes.objects.aggregate(newest=Max('id'))['newest']
+    floor = ChangeCompactions.objects.aggregate(floor=Max('floor'))['floor']
+    return max(newest or 0, floor or 0) + 1
+
+
+def current_version() -> int:
+    """ the version a client that loads everything starts syncing from """
+    return _horizon()
+
+
+def changes_since(user, version: int, limit: int) -> dict:
+    """ what changed for user since version, the version the client was last sent
+        limit: at most this many log entries are read, 'more' is set when there were more. The entries of one
+               transaction are never split, a transaction that logged more than limit is sent whole
+
+        return value: dict {
+            'version': send this next time,
+            'reset': True when version is older than the log, the client has to load everything again,
+            'more': True when there are more changes, ask again with the new version,
+            'posts': new and changed post objects,
+            'deletedposts': ids of posts that were deleted or hidden,
+            'likes': {postid: like count} for posts whose like count is all that changed,
+            'comments': new and changed comments,
+            'deletedcomments': ids of comments that were deleted,
+            'commentlikes': {commentid: like count},
+            'following': {'added': user ids, 'removed': user ids} changes to who user follows,
+            'profiles': changed profiles of user and the users they follow
+        }
+    """
+    from user.models import Changes, ChangeCompactions, Users
+    from post.models import Posts
+    from comment.models import Comments
+
+    position = _position()
+    floor = ChangeCompactions.objects.aggregate(floor=Max('floor'))['floor']
+    if floor is not None and version <= floor:
+        return dict({'version': current_version(), 'reset': True, 'more': False})
+
+    horizon = _horizon()
+    following = list(user.following.values_list('pk', flat=True))
+    # the follows of the users user follows are their own business
+    mine = Changes.objects.filter(Q(user_pk=user.pk) | (Q(user_pk__in=following) & ~Q(kind='follow')))
+    entries = list(mine.filter(**{
+        position + '__gte': version,
+        position + '__lt': horizon
+    }).order_by(position, 'id').values_list(position, 'kind', 'object_id')[:limit + 1])
+
+    more = len(entries) > limit
+    next_version = max(version, horizon)
+    if more:
+        # stop at a transaction boundary, the next call starts with the first transaction left out
+        next_version = entries[limit][0]
+        entries = [entry for entry in entries[:limit] if entry[0] < next_version]
+        if not entries:
+            entries = list(mine.filter(**{position: next_version}).values_list(position, 'kind', 'object_id'))
+            next_version += 1
+
+    changed = dict((kind, set()) for (kind, _) in Changes.KINDS)
+    for (_, kind, object_id) in entries:
+        changed[kind].add(object_id)
+
+    # a changed post or comment is sent whole, its like count with it
+    posts = Posts.objects.filter(post_id__in=changed['post'], visibility='visible')
+    post_list = serialize_posts(posts, FEED_FIELDS) if changed['post'] else []
+    likes = dict(Posts.objects.filter(
+        post_id__in=changed['like'] - changed['post'],
+        visibility='visible'
+    ).values_list('post_id', 'like_count')) if changed['like'] else {}
+
+    comments = []
+    if changed['comment']:
+        rows = Comments.objects.filter(comment_id__in=changed['comment']).values_list(
+            'comment_id', 'post__post_id', 'message', 'author_name', 'like_count', 'creation_date')
+        comments = [dict({
+            'commentid': comment_id,
+            'postid': post_id,
+            'message': message,
+            'author': author,
+            'likes': like_count,
+            'date': date.isoformat()
+        }) for (comment_id, post_id, message, author, like_count, date) in rows]
+    comment_likes = dict(Comments.objects.filter(
+        comment_id__in=changed['commentlike'] - changed['comment']
+    ).values_list('comment_id', 'like_count')) if changed['commentlike'] else {}
+
+    followed = set(user.following.filter(user_id__in=changed['follow']).values_list('user_id', flat=True)) if changed['follow'] else set()
+
+    profiles = []
+    if changed['profile']:
+        rows = Users.objects.filter(user_id__in=changed['profile']).values_list(
+            'user_id', 'user_name', 'about', 'profile_url', 'profile_variants', 'follower_count')
+        profiles = [dict({
+            'userid': user_id,
+            'username': username,
+            'about': about,
+            'avatar': avatar,
+            'avatarvariants': variant_urls(variants),
+            'followers': followers
+        }) for (user_id, username, about, avatar, variants, followers) in rows]
+
+    return dict({
+        'version': next_version,
+        'reset': False,
+        'more': more,
+        'posts': post_list,
+        'deletedposts': sorted(changed['post'] - set(post['postid'] for post in post_list)),
+        'likes': likes,
+        'comments': comments,
+        'deletedcomments': sorted(changed['comment'] - set(comment['commentid'] for comment in comments)),
+        'commentlikes': comment_likes,
+        'following': {'added': sorted(followed), 'removed': sorted(changed['follow'] - followed)},
+        'profiles': profiles
+    })
+
+
+def compact(retention_days: int = None) -> (int, int):
+    """ shrink the change log, see the module docstring
+        return value: tuple (entries removed as older copies of an object, entries removed by age)
+    """
+    from user.models import Changes, ChangeCompactions
+
+    if retention_days is None:
+        retention_days = settings.CHANGE_LOG_RETENTION_DAYS
+
+    # an entry is superseded by one for the same object further on in commit order, the newest by id may
+    # be the older by commit, and a client between the two would miss the later commit
+    position = _position()
+    newer = Changes.objects.filter(
+        user_pk=OuterRef('user_pk'),
+        kind=OuterRef('kind'),
+        object_id=OuterRef('object_id'),
+        **{position + '__gt': OuterRef(position)}
+    )
+    superseded = Changes.objects.annotate(superseded=Exists(newer)).filter(superseded=True).values('pk')
+    (duplicates, _) = Changes.objects.filter(pk__in=superseded).delete()
+
+    floor = Changes.objects.filter(
+        change_date__lt=timezone.now() - timedelta(days=retention_days)
+    ).aggregate(floor=Max(position))['floor']
+    expired = 0
+    if floor is not None:
+        (expired, _) = Changes.objects.filter(**{position + '__lte': floor}).delete()
+        ChangeCompactions.objects.create(floor=floor, removed=expired)
+    return (duplicates, expired)
@@ -0,0 +1,77 @@
+""" gzip and brotli compression for api responses
+    Responses of COMPRESS_MIN_SIZE bytes or more with a type in COMPRESS_CONTENT_TYPES are compressed with
+    brotli when the client accepts it and the brotli package is installed, with gzip otherwise. Below the
+    threshold the compressed body plus headers is hardly smaller and not worth the CPU.
+
+    A strong ETag becomes weak once the body is compressed, the same way django's GZipMiddleware does it,
+    If-None-Match compares ETags weakly so 304s keep working.
+"""
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header: str) -> set:
+    """ the content codings an Accept-Encoding header allows, codings with q=0 are left out """
+    encodings = set()
+    for item in header.split(','):
+        (coding, _, params) = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            (name, _, value) = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def compress(content: bytes, encodings: set) -> (str, bytes):
+    """ compress content with the best coding in encodings
+        return value: tuple (the Content-Encoding, the compressed bytes), or (None, content)
+    """
+    if brotli is not None and 'br' in encodings:
+        return ('br', brotli.compress(content, quality=settings.COMPRESS_BROTLI_QUALITY))
+    if 'gzip' in encodings or '*' in encodings:
+        return ('gzip', gzip.compress(content, compresslevel=settings.COMPRESS_GZIP_LEVEL))
+    return (None, content)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """ compress response bodies, see the module docstring """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.COMPRESS_MIN_SIZE:
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if not content_type.startswith(settings.COMPRESS_CONTENT_TYPES):
+            return response
+
+        # caches have to keep compressed and plain copies apart, whether this client gets one or not
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        (encoding, content) = compress(response.content, accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        if encoding is None or len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,227 @@
+""" background pipeline that makes smaller copies (variants) of uploaded images
+    the resize and re-encode work runs in a process pool so it never holds up a request worker or the GIL.
+    The original is copied to a temporary file a chunk at a time and the pool process opens it by path, so an
+    upload is never read into memory whole or pickled to the pool. The finished variants are uploaded beside
+    the original and recorded on the row as a json map of {width: url}. Widths and format come from
+    IMAGE_VARIANT_WIDTHS and IMAGE_VARIANT_FORMAT.
+
+    Pillow is optional, without it nothing is scheduled and payloads return an empty variants map.
+"""
+import io
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg')
+}
+
+_process_pool = None
+_io_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pools():
+    global _process_pool, _io_pool
+    if _process_pool is None:
+        with _pool_lock:
+            if _process_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=2)
+                _process_pool = ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS)
+    return (_process_pool, _io_pool)
+
+
+def variant_key(key_name: str, width: int, image_format: str = None) -> str:
+    """ the key a variant is stored under, next to the original: 3241234.png -> 3241234_480.webp """
+    extension = _FORMATS[image_format or settings.IMAGE_VARIANT_FORMAT][1]
+    base = key_name.rsplit('.', 1)[0]
+    return '{}_{}.{}'.format(base, width, extension)
+
+
+def variant_keys(variants_json: str) -> [str]:
+    """ the S3 keys of the variants recorded in an image_variants / profile_variants column """
+    if not variants_json:
+        return []
+    return list(json.loads(variants_json)['keys'].values())
+
+
+def variant_urls(variants_json: str) -> dict:
+    """ the {width: url} map for a payload from an image_variants / profile_variants column,
+        the URLs are signed when IMAGE_URL_SIGNED is on
+    """
+    if not variants_json:
+        return {}
+
+    variants = json.loads(variants_json)
+    if not settings.IMAGE_URL_SIGNED:
+        return variants['urls']
+
+    from lifesnap.image_urls import image_url
+    return dict((width, image_url(variants['keys'][width], url)) for (width, url) in variants['urls'].items())
+
+
+def render_variants(image_path: str, widths: [int], image_format: str, quality: int) -> dict:
+    """ resize and re-encode the image at image_path, this runs in a pool process
+        widths at or above the original width are skipped, the original is already the best copy
+
+        return value: dict {width: encoded image bytes}
+    """
+    (pil_format, _) = _FORMATS[image_format]
+    variants = {}
+
+    with Image.open(image_path) as original:
+        image = original
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+
+        for width in sorted(widths):
+            if width >= image.width:
+                continue
+
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            resized.save(buffer, format=pil_format, quality=quality, optimize=True)
+            variants[width] = buffer.getvalue()
+
+    return variants
+
+
+def _store_variants(key_name: str, variants: dict, save):
+    """ upload the rendered variants beside the original and record them, runs on the io pool """
+    # imported here, lifesnap.storage is not needed by the pool processes
+    from lifesnap.storage import release, store
+    from lifesnap.image_urls import public_url
+
+    try:
+        keys = {}
+        urls = {}
+        for (width, data) in variants.items():
+            # the variant key is derived from the content key of the original, so it is shared too
+            keys[width] = store(io.BytesIO(data), key_name=variant_key(key_name, width))
+            urls[width] = public_url(keys[width])
+
+        if not save(json.dumps({'keys': keys, 'urls': urls})):
+            # the row was deleted or its image replaced while the variants were made
+            release(list(keys.values()))
+    except Exception:
+        logger.exception('unable to store image variants for %s', key_name)
+    finally:
+        close_old_connections()
+
+
+def _copy_to_temp(image_file) -> str:
+    """ copy image_file from its start into a temporary file the pool processes can open
+        return value: the path of the copy, or None when image_file is empty
+    """
+    image_file.seek(0)
+    with tempfile.NamedTemporaryFile(prefix='lifesnap-variant-', delete=False) as copy:
+        shutil.copyfileobj(image_file, copy)
+        size = copy.tell()
+    if not size:
+        _remove_file(copy.name)
+        return None
+    return copy.name
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def schedule_variants(key_name: str, image_file, save):
+    """ render and upload the variants of key_name in the background
+        key_name: the full S3 key of the original image
+        image_file: a binary file object holding the original image, it is copied before this returns
+                    and stays the callers to close
+        save: called with the json for the variants column once every variant is uploaded,
+              returns the number of rows updated
+
+        return value: the future for the render step, or None when Pillow is not installed or no widths are set
+    """
+    if Image is None or image_file is None or not settings.IMAGE_VARIANT_WIDTHS:
+        return None
+
+    image_path = _copy_to_temp(image_file)
+    if image_path is None:
+        return None
+
+    (process_pool, io_pool) = _get_pools()
+    try:
+        future = process_pool.submit(
+            render_variants,
+            image_path,
+            settings.IMAGE_VARIANT_WIDTHS,
+            settings.IMAGE_VARIANT_FORMAT,
+            settings.IMAGE_VARIANT_QUALITY
+        )
+    except Exception:
+        _remove_file(image_path)
+        raise
+
+    def _rendered(done):
+        # the copy is only needed by the render step
+        _remove_file(image_path)
+        if done.exception() is not None:
+            logger.error('unable to render image variants for %s: %s', key_name, done.exception())
+            return
+        io_pool.submit(_store_variants, key_name, done.result(), save)
+
+    future.add_done_callback(_rendered)
+    return future
+
+
+def schedule_post_variants(post, image_file):
+    """ make the variants for a posts image, they are saved to post.image_variants """
+    from post.models import Posts
+    (pk, key_name) = (post.pk, post.image_name)
+
+    def save(variants_json: str):
+        from lifesnap.versions import touch_posts
+        from lifesnap.changelog import log_posts
+        updated = Posts.objects.filter(pk=pk, image_name=key_name).update(image_variants=variants_json)
+        if updated:
+            touch_posts([pk])
+            log_posts([pk])
+        return updated
+
+    return schedule_variants(key_name, image_file, save)
+
+
+def schedule_profile_variants(user, image_file):
+    """ make the variants for a users profile picture, they are saved to user.profile_variants """
+    from user.models import Users
+    (pk, profile_key) = (user.pk, user.profile_key)
+
+    def save(variants_json: str):
+        from lifesnap.versions import touch
+        from lifesnap.changelog import log_profiles
+        from lifesnap.profiles import invalidate
+        updated = Users.objects.filter(pk=pk, profile_key=profile_key).update(profile_variants=variants_json)
+        if updated:
+            touch([pk])
+            log_profiles([pk])
+            invalidate([pk])
+        return updated
+
+    return schedule_variants(user.profile_image_key(), image_file, save)
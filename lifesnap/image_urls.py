@@ -0,0 +1,129 @@
+""" public and signed URLs for stored images, built locally without a round trip to storage
+    IMAGE_BASE_URL points at the bucket or a CDN in front of it, when it is empty the storage backend builds
+    the URL. With IMAGE_URL_SIGNED on, payloads hand out signed URLs that expire.
+
+    Signing is cached per key and ttl. A signed URL is made valid for twice the ttl and reused until less
+    than ttl seconds of it are left, so a busy feed signs each image about once per ttl instead of once
+    per request, and every URL handed out is good for at least ttl seconds.
+
+    Without a base URL the storage backend signs (S3 query string auth). CDN URLs are signed as
+    ?expires=<unix time>&signature=<hmac sha256 of path + expires>, check_signature verifies them.
+"""
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit
+
+from lifesnap.storage import get_storage
+
+from django.conf import settings
+from django.test.signals import setting_changed
+
+_builder = None
+_builder_lock = threading.Lock()
+
+
+def _signing_key() -> bytes:
+    return (settings.IMAGE_URL_SIGNING_KEY or settings.SECRET_KEY).encode('utf-8')
+
+
+def _signature(path: str, expires: int) -> str:
+    return hmac.new(_signing_key(), '{}{}'.format(path, expires).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def sign_url(url: str, expires: int) -> str:
+    """ add an expiry and signature to url, expires is a unix timestamp """
+    signature = _signature(urlsplit(url).path, expires)
+    return '{}?expires={}&signature={}'.format(url, expires, signature)
+
+
+def check_signature(path: str, expires: str, signature: str) -> bool:
+    """ verify the expires and signature query parameters sign_url added for path """
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_signature(path, expires), signature or '')
+
+
+class URLBuilder(object):
+    """ builds image URLs for storage keys
+        base_url: the bucket or CDN URL keys are appended to, '' to let the storage backend build the URL
+        cache_size: how many signed URLs are kept
+    """
+
+    def __init__(self, base_url: str = '', cache_size: int = 10000):
+        self.base_url = base_url
+        self.cache_size = cache_size
+        self._signed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def public(self, key_name: str) -> str:
+        """ the URL anyone can use to download the image """
+        if self.base_url:
+            return '{}{}'.format(self.base_url, quote(key_name))
+        return get_storage().url(key_name)
+
+    def signed(self, key_name: str, ttl: int) -> str:
+        """ a URL for the image that is valid for at least ttl seconds """
+        now = time.time()
+        with self._lock:
+            cached = self._signed.get((key_name, ttl))
+            if cached is not None and cached[1] - now >= ttl:
+                self._signed.move_to_end((key_name, ttl))
+                return cached[0]
+
+        expires = int(now) + 2 * ttl
+        if self.base_url:
+            url = sign_url(self.public(key_name), expires)
+        else:
+            url = get_storage().signed_url(key_name, 2 * ttl)
+
+        with self._lock:
+            self._signed[(key_name, ttl)] = (url, expires)
+            self._signed.move_to_end((key_name, ttl))
+            while len(self._signed) > self.cache_size:
+                self._signed.popitem(last=False)
+        return url
+
+
+def get_url_builder() -> URLBuilder:
+    """ the URLBuilder for the IMAGE_BASE_URL setting, shared by every thread """
+    global _builder
+    if _builder is None:
+        with _builder_lock:
+            if _builder is None:
+                _builder = URLBuilder(settings.IMAGE_BASE_URL, settings.IMAGE_URL_CACHE_SIZE)
+    return _builder
+
+
+def _reset_builder(**kwargs):
+    global _builder
+    if kwargs['setting'] in ('STORAGE', 'IMAGE_BASE_URL', 'IMAGE_URL_CACHE_SIZE'):
+        with _builder_lock:
+            _builder = None
+
+
+setting_changed.connect(_reset_builder)
+
+
+def public_url(key_name: str) -> str:
+    """ the public URL for a stored image, this is what gets saved with a post or profile """
+    return get_url_builder().public(key_name)
+
+
+def image_url(key_name: str, url: str) -> str:
+    """ the URL to put in a payload for a stored image
+        key_name: the storage key of the image
+        url: the public URL saved with the image, '' while it is still being uploaded
+
+        return value: a signed URL when IMAGE_URL_SIGNED is on, otherwise url
+    """
+    if not settings.IMAGE_URL_SIGNED or not key_name or not url:
+        return url
+    return get_url_builder().signed(key_name, settings.IMAGE_URL_TTL)
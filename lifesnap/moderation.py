@@ -0,0 +1,166 @@
+""" post reports, the moderation queue and the report digest email
+    every report is a Reports row, one per post and reporter, and Posts.report_count is bumped with an
+    atomic update. The report that takes a post to REPORT_HIDE_THRESHOLD sets its visibility to 'hidden',
+    feeds only serve visible posts. A moderator can bring it back with set_visibility().
+
+    Moderators work from moderation_queue(), which ranks reported posts by report velocity, the number of
+    reports per hour over the last REPORT_VELOCITY_HOURS. Instead of an email per report the admin inbox
+    gets a digest of the new reports, `manage.py reportdigest` sends it and should run from cron (every 15
+    minutes or so). `manage.py moderationqueue` prints the queue and can show or hide a post.
+"""
+from datetime import timedelta
+
+from lifesnap.outbox import queue_email
+from lifesnap.versions import touch
+from lifesnap.changelog import log_posts
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Sum, When
+from django.utils import timezone
+
+
+def clean_reporter(reporter: str) -> str:
+    """ the reporters email address as it is stored, stripped and lower cased
+        raises ValueError when it is not an email address or does not fit the Reports.reporter column
+    """
+    from post.models import Reports
+
+    reporter = reporter.strip().lower()
+    max_length = Reports._meta.get_field('reporter').max_length
+    if len(reporter) > max_length:
+        raise ValueError('email can be at most {} characters'.format(max_length))
+    try:
+        validate_email(reporter)
+    except ValidationError:
+        raise ValueError('{} is not a valid email address'.format(reporter))
+    return reporter
+
+
+def report_post(post, reporter: str, reason: str) -> bool:
+    """ record a report, a reporter can only report a post once
+        reporter: the reporters email address, raises ValueError when it is not valid (see clean_reporter)
+
+        return value: False if the reporter had already reported the post
+    """
+    from post.models import Posts, Reports
+
+    reporter = clean_reporter(reporter)
+    try:
+        with transaction.atomic():
+            Reports.objects.create(post=post, reporter=reporter, reason=reason or '')
+            Posts.objects.filter(pk=post.pk).update(report_count=F('report_count') + 1)
+
+            # only the report that reaches the threshold hides the post, a post a moderator has
+            # shown again stays visible when more reports come in
+            if settings.REPORT_HIDE_THRESHOLD:
+                hidden = Posts.objects.filter(
+                    pk=post.pk,
+                    report_count=settings.REPORT_HIDE_THRESHOLD
+                ).update(visibility='hidden')
+                if hidden:
+                    touch([post.user_id])
+                    log_posts([post.pk])
+    except IntegrityError:
+        return False
+    return True
+
+
+def set_visibility(post_id: int, visibility: str) -> bool:
+    """ show ('visible') or hide ('hidden') a post
+        return value: False if the post does not exist
+    """
+    from post.models import Posts
+
+    if visibility not in ('visible', 'hidden'):
+        raise ValueError('unknown visibility {}'.format(visibility))
+    if not Posts.objects.filter(post_id=post_id).update(visibility=visibility):
+        return False
+    touch(Posts.objects.filter(post_id=post_id).values_list('user_id', flat=True))
+    log_posts(Posts.objects.filter(post_id=post_id).values_list('pk', flat=True))
+    return True
+
+
+def moderation_queue(limit: int = 50, hours: int = None, post_ids: [int] = None) -> [dict]:
+    """ the reported posts ranked by report velocity, fastest first
+        hours: the velocity window, defaults to REPORT_VELOCITY_HOURS
+        post_ids: only rank these posts (primary keys)
+
+        return value: list of dict {
+            'post': the Posts row,
+            'recent': reports in the window,
+            'velocity': reports per hour in the window,
+            'total': all reports,
+            'lastreport': when the latest report came in
+        }
+        the post rows carry their visibility, hidden posts stay in the queue
+    """
+    from post.models import Posts
+
+    hours = hours or settings.REPORT_VELOCITY_HOURS
+    since = timezone.now() - timedelta(hours=hours)
+
+    posts = Posts.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+
+    posts = posts.annotate(
+        recent=Sum(Case(When(reports__creation_date__gte=since, then=1), default=0, output_field=IntegerField())),
+        total=Count('reports'),
+        lastreport=Max('reports__creation_date')
+    ).filter(total__gt=0).order_by('-recent', '-total', '-lastreport')[:limit]
+
+    return [dict({
+        'post': post,
+        'recent': post.recent,
+        'velocity': post.recent / hours,
+        'total': post.total,
+        'lastreport': post.lastreport
+    }) for post in posts]
+
+
+def send_report_digest() -> int:
+    """ queue one email for the admin inbox that summarizes the reports no digest has covered yet
+        return value: the number of new reports in the digest, 0 means nothing was sent
+    """
+    from post.models import Reports
+
+    with transaction.atomic():
+        # skip_locked keeps two digest runs from reporting the same rows
+        new_reports = list(Reports.objects.select_for_update(skip_locked=True).filter(
+            notified=False
+        ).order_by('creation_date'))
+        if not new_reports:
+            return 0
+
+        new_by_post = {}
+        for report in new_reports:
+            new_by_post.setdefault(report.post_id, []).append(report)
+
+        lines = ['{} new reports on {} posts\n'.format(len(new_reports), len(new_by_post))]
+        for entry in moderation_queue(limit=len(new_by_post), post_ids=list(new_by_post)):
+            post = entry['post']
+            reports = new_by_post[post.pk]
+            lines.append('Post ID {}, {} by {}\n{:.2f} reports/hour, {} new, {} total\nMessage: {}\nURL: {}'.format(
+                post.post_id,
+                post.message_title,
+                post.author_username,
+                entry['velocity'],
+                len(reports),
+                entry['total'],
+                post.message,
+                post.image_url
+            ))
+            lines.extend('  {}: {}'.format(report.reporter, report.reason) for report in reports)
+            lines.append('')
+
+        queue_email(
+            'SnapLife report digest: {} new reports'.format(len(new_reports)),
+            '\n'.join(lines),
+            [settings.EMAIL_HOST_USER]
+        )
+        Reports.objects.filter(pk__in=[report.pk for report in new_reports]).update(notified=True)
+
+    return len(new_reports)
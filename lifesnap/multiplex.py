@@ -0,0 +1,181 @@
+""" many api calls in one http request
+    POST /snaplife/api/batch/ with a list of sub requests, each one is resolved with the URL resolver and its
+    view called in process. The sub requests share the session and user of the batch request, and skip the
+    middleware (CSRF is checked once, on the batch request itself). On a high latency link this saves a round
+    trip per call.
+
+    Sub requests run in order. With 'concurrent' set, GETs that follow each other run at the same time on
+    BATCH_WORKERS threads, a POST waits for the GETs before it and the GETs after it wait for the POST.
+    The json body of each sub response is copied into the batch response without being decoded.
+"""
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from lifesnap.util import JSONFragment, JSONResponse
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.urls import Resolver404, resolve
+from django.views import View
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/snaplife/api/'
+BATCH_PATH = '/snaplife/api/batch/'
+METHODS = ('GET', 'POST')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.BATCH_WORKERS, thread_name_prefix='lifesnap-batch')
+    return _executor
+
+
+def parse_requests(items) -> [(str, str, bytes)]:
+    """ check the sub requests of a batch
+        items: list of dict {'method': 'GET' or 'POST', 'path': the api path with its query string,
+                             'body': optional, a json object or string for a POST}
+
+        return value: list of tuple (method, path, body bytes), raises ValueError for a bad sub request
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('requests must be a list of sub requests')
+    if len(items) > settings.BATCH_MAX_REQUESTS:
+        raise ValueError('{} requests were sent, the limit is {}'.format(len(items), settings.BATCH_MAX_REQUESTS))
+
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('request {} is not an object'.format(item))
+
+        method = '{}'.format(item.get('method', 'GET')).upper()
+        path = item.get('path')
+        if method not in METHODS:
+            raise ValueError('method {} is not supported'.format(method))
+        if not isinstance(path, str) or not path.startswith(API_PREFIX) or urlsplit(path).path == BATCH_PATH:
+            raise ValueError('path {} is not an api path'.format(path))
+
+        body = item.get('body', b'')
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        parsed.append((method, path, body))
+    return parsed
+
+
+def subrequest(request: HttpRequest, method: str, path: str, body: bytes) -> WSGIRequest:
+    """ a request for one call of a batch, with the session and user of the batch request """
+    url = urlsplit(path)
+    environ = dict(request.META)
+    # the conditional headers were meant for the batch response
+    environ.pop('HTTP_IF_NONE_MATCH', None)
+    environ.pop('HTTP_IF_MODIFIED_SINCE', None)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body)
+    })
+
+    sub = WSGIRequest(environ)
+    if hasattr(request, 'session'):
+        sub.session = request.session
+    if hasattr(request, 'user'):
+        sub.user = request.user
+    return sub
+
+
+def dispatch(request: HttpRequest) -> dict:
+    """ call the view for a sub request
+        return value: dict {'status': the http status, 'body': the json the view returned, or None}
+    """
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return dict({'status': 404, 'body': None})
+
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception('batch request %s %s failed', request.method, request.path)
+        return dict({'status': 500, 'body': None})
+
+    body = None
+    if response.get('Content-Type', '').startswith('application/json') and response.content:
+        body = JSONFragment.raw(response.content)
+    return dict({'status': response.status_code, 'body': body})
+
+
+def _dispatch_in_thread(request: HttpRequest) -> dict:
+    try:
+        return dispatch(request)
+    finally:
+        close_old_connections()
+
+
+def run(request: HttpRequest, items: [(str, str, bytes)], concurrent: bool = False) -> [dict]:
+    """ run the sub requests of a batch, see the module docstring
+        return value: the result of dispatch() for each sub request, in order
+    """
+    subrequests = [subrequest(request, method, path, body) for (method, path, body) in items]
+    if not concurrent:
+        return [dispatch(sub) for sub in subrequests]
+
+    results = []
+    gets = []
+    for sub in subrequests:
+        if sub.method == 'GET':
+            gets.append(_get_executor().submit(_dispatch_in_thread, sub))
+            continue
+        results.extend(future.result() for future in gets)
+        gets = []
+        results.append(dispatch(sub))
+    results.extend(future.result() for future in gets)
+    return results
+
+
+class BatchRequest(View):
+    """ call many api endpoints with one request
+        POST: required json object {
+            'requests': [up to BATCH_MAX_REQUESTS objects {
+                'method': 'GET' (default) or 'POST',
+                'path': the full api path, /snaplife/api/user/posts/like/123/,
+                'body': the json object to POST
+            }],
+            'concurrent': optional, true to run GETs that follow each other at the same time
+        }
+        returned json object {
+            'responses': [for each request, in order {
+                'status': the http status code,
+                'body': the json object the endpoint returned, null if there was none
+            }]
+        }
+    """
+    def post(self, request: HttpRequest):
+        try:
+            req_json = json.loads(request.body.decode('UTF-8'))
+        except json.JSONDecodeError:
+            return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
+
+        try:
+            items = parse_requests(req_json.get('requests'))
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        results = run(request, items, concurrent=bool(req_json.get('concurrent')))
+        return JSONResponse.new(code=200, message='success', responses=results)
@@ -0,0 +1,302 @@
+""" new post notifications for followers, selected with the NOTIFY_CHANNEL setting
+    PostCreate and PostImageFinalize call notify_new_post() once the post is committed, the channel fans the
+    (author, post id) pair out to everyone listening for that author. posts/notify/ listens for the users
+    someone follows and answers with the new post ids, as a long poll or a server-sent events stream.
+
+    LocalChannel delivers inside one process, enough for tests and a single worker. PostgresChannel sends
+    through Postgres NOTIFY, so every worker and every server hears every post: each process keeps one
+    connection LISTENing on a background thread and hands what arrives to its own listeners.
+
+    A listener holds a request thread for as long as it waits. A process lets at most NOTIFY_MAX_LISTENERS
+    wait at once (acquire_listener), the view answers the rest 503, so listeners can't take every thread
+    from the rest of the API. gunicorn.conf.py gives each worker NOTIFY_THREADS threads on top of the API's
+    and sets NOTIFY_MAX_LISTENERS to match.
+"""
+import json
+import time
+import queue
+import select
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_channel = None
+_channel_lock = threading.Lock()
+
+_listeners = 0
+_listeners_lock = threading.Lock()
+
+
+class Subscription(object):
+    """ the new posts of a set of users, for one listener """
+
+    def __init__(self, channel, user_pks: [int]):
+        self.channel = channel
+        self.user_pks = frozenset(user_pks)
+        self._queue = queue.Queue()
+
+    def put(self, post_id: int):
+        self._queue.put(post_id)
+
+    def get(self, timeout: float) -> [int]:
+        """ wait up to timeout seconds for a new post
+            return value: the ids of every new post that has arrived, an empty list on timeout
+        """
+        if not timeout > 0:
+            # also catches nan, which queue.get() would wait on forever
+            timeout = 0
+        try:
+            post_ids = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                post_ids.append(self._queue.get_nowait())
+            except queue.Empty:
+                return post_ids
+
+    def close(self):
+        self.channel.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Channel(object):
+    """ interface every notification channel implements """
+
+    def publish(self, user_pk: int, post_id: int):
+        raise NotImplementedError
+
+    def subscribe(self, user_pks: [int]) -> Subscription:
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription):
+        raise NotImplementedError
+
+
+class LocalChannel(Channel):
+    """ delivers to the listeners of this process only """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def publish(self, user_pk: int, post_id: int):
+        self.deliver(user_pk, post_id)
+
+    def deliver(self, user_pk: int, post_id: int):
+        """ hand a new post to every listener of user_pk in this process """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_pk, ()))
+        for subscription in subscriptions:
+            subscription.put(post_id)
+
+    def subscribe(self, user_pks: [int]) -> Subscription:
+        subscription = Subscription(self, user_pks)
+        with self._lock:
+            for pk in subscription.user_pks:
+                self._subscriptions.setdefault(pk, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for pk in subscription.user_pks:
+                listeners = self._subscriptions.get(pk)
+                if listeners is None:
+                    continue
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._subscriptions[pk]
+
+    def listener_count(self) -> int:
+        with self._lock:
+            return len(set().union(*self._subscriptions.values())) if self._subscriptions else 0
+
+
+class PostgresChannel(LocalChannel):
+    """ delivers through Postgres LISTEN/NOTIFY to the listeners of every process
+        channel_name: the NOTIFY channel
+        alias: the database connection to notify and listen on
+        reconnect_delay: seconds to wait before listening again after the connection drops
+    """
+
+    def __init__(self, channel_name: str = 'lifesnap_posts', alias: str = 'default', reconnect_delay: float = 1.0):
+        super().__init__()
+        self.channel_name = channel_name
+        self.alias = alias
+        self.reconnect_delay = reconnect_delay
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def publish(self, user_pk: int, post_id: int):
+        # the payload is small, NOTIFY payloads must stay under 8000 bytes
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel_name, '{}:{}'.format(user_pk, post_id)])
+
+    def subscribe(self, user_pks: [int]) -> Subscription:
+        self._start_listener()
+        return super().subscribe(user_pks)
+
+    def _start_listener(self):
+        # started by the first listener of each process, so a forked worker starts its own
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='lifesnap-notify', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        wrapper = connections[self.alias]
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                # a connection of its own, outside django's per thread connections
+                conn = wrapper.get_new_connection(wrapper.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute('LISTEN {}'.format(self.channel_name))
+
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._receive(conn.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('listening on %s failed, listening again in %s seconds', self.channel_name, self.reconnect_delay)
+                self._stopped.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _receive(self, payload: str):
+        try:
+            (user_pk, post_id) = (int(part) for part in payload.split(':'))
+        except ValueError:
+            logger.warning('bad notification %r on %s', payload, self.channel_name)
+            return
+        self.deliver(user_pk, post_id)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def get_channel() -> Channel:
+    """ the channel from the NOTIFY_CHANNEL setting, created on first use and shared by every thread """
+    global _channel
+    if _channel is None:
+        with _channel_lock:
+            if _channel is None:
+                backend = import_string(settings.NOTIFY_CHANNEL['BACKEND'])
+                _channel = backend(**settings.NOTIFY_CHANNEL.get('OPTIONS', {}))
+    return _channel
+
+
+def _reset_channel(**kwargs):
+    global _channel
+    if kwargs['setting'] == 'NOTIFY_CHANNEL':
+        with _channel_lock:
+            if isinstance(_channel, PostgresChannel):
+                _channel.stop()
+            _channel = None
+
+
+setting_changed.connect(_reset_channel)
+
+
+def _publish(user_pk: int, post_id: int):
+    try:
+        get_channel().publish(user_pk, post_id)
+    except Exception:
+        # a follower missing a notification only waits for their next feed refresh
+        logger.exception('notifying the followers of user %s about post %s failed', user_pk, post_id)
+
+
+def notify_new_post(post):
+    """ tell the followers of the posts author about it, once the transaction commits """
+    (user_pk, post_id) = (post.user_id, post.post_id)
+    transaction.on_commit(lambda: _publish(user_pk, post_id))
+
+
+def wait(user_pks: [int], timeout: float) -> [int]:
+    """ wait up to timeout seconds for new posts from any of user_pks, the long poll
+        return value: the new post ids, an empty list when none came in time
+    """
+    with get_channel().subscribe(user_pks) as subscription:
+        return subscription.get(timeout)
+
+
+def acquire_listener() -> bool:
+    """ take one of the NOTIFY_MAX_LISTENERS listener slots of this process, give it back with release_listener()
+        return value: False when every slot is taken
+    """
+    global _listeners
+    with _listeners_lock:
+        if settings.NOTIFY_MAX_LISTENERS is not None and _listeners >= settings.NOTIFY_MAX_LISTENERS:
+            return False
+        _listeners += 1
+        return True
+
+
+def release_listener():
+    global _listeners
+    with _listeners_lock:
+        _listeners = max(_listeners - 1, 0)
+
+
+def encode_event(post_ids: [int]) -> bytes:
+    """ a server-sent event carrying new post ids """
+    return 'event: posts\ndata: {}\n\n'.format(json.dumps({'postids': post_ids})).encode('utf-8')
+
+
+def stream(user_pks: [int], seconds: float, keepalive: float, retry: int):
+    """ server-sent events with the new posts from any of user_pks, for seconds then the stream ends
+        keepalive: a comment line is sent after this many quiet seconds, so proxies keep the connection open
+        retry: milliseconds the browser waits before it reconnects
+    """
+    deadline = time.monotonic() + seconds
+    # subscribed on the first read, a stream that is never read never subscribes and has nothing to close
+    with get_channel().subscribe(user_pks) as subscription:
+        yield 'retry: {}\n\n'.format(retry).encode('utf-8')
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            post_ids = subscription.get(min(remaining, keepalive))
+            yield encode_event(post_ids) if post_ids else b': keepalive\n\n'
+
+
+class EventStream(object):
+    """ the stream() of a listener that holds a slot from acquire_listener()
+        the slot is given back when the response is closed, whether or not the stream was ever read
+    """
+
+    def __init__(self, user_pks: [int], seconds: float, keepalive: float, retry: int):
+        self._events = stream(user_pks, seconds, keepalive, retry)
+        self._closed = False
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._events.close()
+            finally:
+                release_listener()
@@ -0,0 +1,186 @@
+""" email outbox, views queue emails in the database and a background worker sends them
+    queue_email() only inserts an OutboxEmails row, so a slow or unreachable mail server never holds up a
+    request. The worker thread sends due emails EMAIL_BATCH_SIZE at a time over one SMTP connection that is
+    kept open between batches and only closed after EMAIL_IDLE_TIMEOUT seconds without mail or an error.
+
+    A batch is claimed in a short transaction, its rows are marked 'sending' with a lease of EMAIL_SEND_LEASE
+    seconds in next_attempt, and the emails are sent after it commits, so no row lock or transaction is held
+    while the mail server answers. A worker that dies mid batch leaves its rows 'sending', they are claimed
+    again once the lease runs out, an email can then be sent twice but is never lost.
+
+    A failed email is retried with exponential backoff (EMAIL_RETRY_BACKOFF seconds, doubling) and marked
+    'failed' after EMAIL_MAX_ATTEMPTS. queue_depth() reports how many emails are waiting, `manage.py sendoutbox`
+    sends everything that is due and prints the queue depth, for deployments without the in process worker.
+
+    The worker thread is started by queue_email(). After a restart, emails still waiting for a retry would wait
+    for the next queue_email(), so gunicorn.conf.py calls resume_pending() in every new worker. Under other
+    servers run `manage.py sendoutbox` from cron to send them.
+"""
+import json
+import time
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker(object):
+    """ background thread that sends queued emails, wake() makes it look at the outbox right away """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._connection = None
+        self._last_send = 0
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='lifesnap-outbox', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.EMAIL_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                # keep going while full batches come back, there is more waiting
+                while self.send_due() == settings.EMAIL_BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception('unable to send queued emails')
+            finally:
+                close_old_connections()
+
+            if self._connection is not None and time.monotonic() - self._last_send > settings.EMAIL_IDLE_TIMEOUT:
+                self.close()
+
+    def _open(self):
+        if self._connection is None:
+            self._connection = get_connection(fail_silently=False)
+            self._connection.open()
+        return self._connection
+
+    def close(self):
+        """ close the SMTP connection, the next email opens a new one """
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def send_due(self) -> int:
+        """ send one batch of the emails that are due
+            return value: the number of emails that were tried
+        """
+        from post.models import OutboxEmails
+
+        now = timezone.now()
+        with transaction.atomic():
+            # skip_locked lets every worker process take its own batch, the locks are only held to claim it
+            batch = list(OutboxEmails.objects.select_for_update(skip_locked=True).filter(
+                status__in=('queued', 'sending'),
+                next_attempt__lte=now
+            ).order_by('next_attempt')[:settings.EMAIL_BATCH_SIZE])
+
+            lease = now + timedelta(seconds=settings.EMAIL_SEND_LEASE)
+            for email in batch:
+                email.attempts += 1
+            OutboxEmails.objects.filter(pk__in=[email.pk for email in batch]).update(
+                status='sending',
+                attempts=F('attempts') + 1,
+                next_attempt=lease
+            )
+
+        for email in batch:
+            try:
+                self._open().send_messages([_message(email)])
+            except Exception as err:
+                # the connection may be broken, the next email gets a new one
+                self.close()
+                email.status = 'queued'
+                _retry_later(email, err)
+            else:
+                email.status = 'sent'
+                email.sent_date = timezone.now()
+            email.save(update_fields=['status', 'last_error', 'next_attempt', 'sent_date'])
+
+        if batch:
+            self._last_send = time.monotonic()
+        return len(batch)
+
+
+worker = OutboxWorker()
+
+
+def queue_email(subject: str, body: str, recipients: [str], from_email: str = None):
+    """ put an email in the outbox, the worker sends it in the background
+        recipients: list of email addresses, empty addresses are dropped
+
+        return value: the OutboxEmails row, or None when there is no one to send to
+    """
+    from post.models import OutboxEmails
+
+    recipients = [address for address in recipients if address]
+    if not recipients:
+        return None
+
+    email = OutboxEmails.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.EMAIL_HOST_USER,
+        recipients=json.dumps(recipients)
+    )
+
+    if settings.EMAIL_OUTBOX_WORKER:
+        transaction.on_commit(worker.wake)
+    return email
+
+
+def resume_pending() -> bool:
+    """ start the worker when emails are left in the outbox from before the process started
+        return value: True when the worker was woken
+    """
+    from post.models import OutboxEmails
+
+    if not settings.EMAIL_OUTBOX_WORKER:
+        return False
+    if not OutboxEmails.objects.filter(status__in=('queued', 'sending')).exists():
+        return False
+    worker.wake()
+    return True
+
+
+def queue_depth() -> dict:
+    """ the number of emails waiting to be sent, due now or later, and the number that failed for good """
+    from post.models import OutboxEmails
+
+    queued = OutboxEmails.objects.filter(status__in=('queued', 'sending'))
+    return dict({
+        'queued': queued.count(),
+        'due': queued.filter(next_attempt__lte=timezone.now()).count(),
+        'failed': OutboxEmails.objects.filter(status='failed').count()
+    })
+
+
+def _message(email) -> EmailMessage:
+    return EmailMessage(email.subject, email.body, email.from_email, json.loads(email.recipients))
+
+
+def _retry_later(email, err: Exception):
+    logger.warning('unable to send email %s (attempt %d): %s', email.pk, email.attempts, err)
+    email.last_error = '{}'.format(err)
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt = timezone.now() + timedelta(seconds=settings.EMAIL_RETRY_BACKOFF * (2 ** (email.attempts - 1)))
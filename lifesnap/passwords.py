@@ -0,0 +1,116 @@
+""" password hashing for user accounts
+    each user row records the algorithm and cost its password_hash was made with (password_algorithm,
+    password_cost), so the settings can be tuned without locking anyone out. Users are moved onto the
+    configured PASSWORD_HASH_ALGORITHM / PASSWORD_HASH_COST the next time they log in.
+
+    verification runs on a bounded thread pool (PASSWORD_HASH_WORKERS) so a burst of logins can only
+    ever use that many threads for hashing, the remaining request workers keep serving other endpoints.
+"""
+import base64
+import hashlib
+import threading
+from secrets import token_hex
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signing import Signer
+from django.utils.crypto import constant_time_compare, pbkdf2
+
+
+class PasswordHasher(object):
+    """ base class for the password hashers, subclasses set algorithm and implement encode """
+    algorithm = None
+
+    def encode(self, password: str, salt: str, cost: int) -> str:
+        raise NotImplementedError
+
+    def verify(self, password: str, salt: str, cost: int, encoded: str) -> bool:
+        return constant_time_compare(self.encode(password, salt, cost), encoded)
+
+
+class SignerHasher(PasswordHasher):
+    """ the original HMAC signature, kept so existing users can still log in. cost is ignored """
+    algorithm = 'signer'
+
+    def encode(self, password: str, salt: str, cost: int) -> str:
+        return Signer(salt=salt).signature(password)
+
+
+class PBKDF2Hasher(PasswordHasher):
+    """ PBKDF2 with SHA256, cost is the iteration count """
+    algorithm = 'pbkdf2_sha256'
+
+    def encode(self, password: str, salt: str, cost: int) -> str:
+        digest = pbkdf2(password, salt, cost, digest=hashlib.sha256)
+        return base64.b64encode(digest).decode('ascii')
+
+
+class ScryptHasher(PasswordHasher):
+    """ scrypt, cost is log2 of the CPU/memory cost parameter n """
+    algorithm = 'scrypt'
+
+    def encode(self, password: str, salt: str, cost: int) -> str:
+        n = 2 ** cost
+        digest = hashlib.scrypt(
+            password.encode('utf-8'),
+            salt=salt.encode('utf-8'),
+            n=n,
+            r=8,
+            p=1,
+            maxmem=256 * n * 8,
+            dklen=32
+        )
+        return base64.b64encode(digest).decode('ascii')
+
+
+HASHERS = {hasher.algorithm: hasher for hasher in (SignerHasher(), PBKDF2Hasher(), ScryptHasher())}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+    return _executor
+
+
+def get_hasher(algorithm: str = None) -> PasswordHasher:
+    """ return the hasher for algorithm, or the configured one when algorithm is None """
+    algorithm = algorithm or settings.PASSWORD_HASH_ALGORITHM
+    try:
+        return HASHERS[algorithm]
+    except KeyError:
+        raise ValueError('unknown password hash algorithm {}'.format(algorithm))
+
+
+def set_password(user, password: str, algorithm: str = None, cost: int = None):
+    """ hash password for user with a fresh salt, the user is not saved
+        algorithm, cost: default to PASSWORD_HASH_ALGORITHM and PASSWORD_HASH_COST
+    """
+    hasher = get_hasher(algorithm)
+    cost = settings.PASSWORD_HASH_COST if cost is None else cost
+
+    user.salt_hash = token_hex(16)
+    user.password_algorithm = hasher.algorithm
+    user.password_cost = cost
+    user.password_hash = _get_executor().submit(hasher.encode, password, user.salt_hash, cost).result()
+
+
+def verify_password(user, password: str) -> bool:
+    """ check password against the users stored hash, using the algorithm and cost it was created with """
+    if not password:
+        return False
+
+    hasher = get_hasher(user.password_algorithm)
+    future = _get_executor().submit(hasher.verify, password, user.salt_hash, user.password_cost, user.password_hash)
+    return future.result()
+
+
+def needs_rehash(user) -> bool:
+    """ True if the users hash was not made with the configured algorithm and cost """
+    return (user.password_algorithm != settings.PASSWORD_HASH_ALGORITHM or
+            user.password_cost != settings.PASSWORD_HASH_COST)
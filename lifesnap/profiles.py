@@ -0,0 +1,382 @@
+""" finding the user a view is asked about, and a two tier cache of Users rows
+    Every view that takes a user_id or a user_name finds the user with resolve_user(). A user_id or a
+    user_name is one query, a number that may be either is one query too, and a lookup that finds nobody
+    is remembered for PROFILE_MISSING_TTL seconds so repeated misses (often bots) don't reach the database.
+
+    Profiles change rarely and are read on every screen. Read only lookups look in a per process LRU first,
+    then in the shared cache (PROFILE_CACHE_ALIAS), then in the database, and fill the tiers that missed.
+    Entries are keyed by user_id, a user_name key points at the user_id. Password fields are never cached.
+
+    Every entry carries the version stamp of its user, a counter in the shared cache that each write bumps.
+    An entry whose stamp is not the current one is a miss, so a request that loaded the row before a write
+    and stores it after cannot bring the old row back. Saves and deletes of Users bump the stamp right away
+    and write the committed row through once the transaction commits (signals connected in
+    UserConfig.ready), queryset update() calls use invalidate().
+
+    The per process tier is not checked against the stamp, a write made by another process shows there
+    after at most PROFILE_CACHE_LOCAL_TTL seconds. With more than one web process the shared cache has to be
+    memcached or redis, as for sessions (MEMCACHED_LOCATION). When PROFILE_CACHE_ALIAS is a LocMemCache the
+    "shared" tier is per process too, a write only bumps the stamp in the process that made it, so there
+    every entry is kept no longer than PROFILE_CACHE_LOCAL_TTL.
+"""
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.test.signals import setting_changed
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'lifesnap.profiles'
+PRIVATE_FIELDS = ('password_hash', 'password_algorithm', 'password_cost', 'salt_hash')
+MAX_USER_ID = 2147483647
+
+# what an identifier passed to resolve_user() may be
+USER_ID = ('user_id',)
+USER_NAME = ('user_name',)
+ID_OR_NAME = ('user_id', 'user_name')
+
+
+class LocalProfiles(object):
+    """ LRU of (stamp, row values) entries that expire after PROFILE_CACHE_LOCAL_TTL seconds """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, stamp: int, value):
+        """ keep value unless a newer stamp is already held for key """
+        expires = time.monotonic() + settings.PROFILE_CACHE_LOCAL_TTL
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[1][0] > stamp:
+                return
+            self._entries[key] = (expires, (stamp, value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.PROFILE_CACHE_LOCAL_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = LocalProfiles()
+
+
+def _fields() -> [str]:
+    from user.models import Users
+    return [field.attname for field in Users._meta.concrete_fields if field.attname not in PRIVATE_FIELDS]
+
+
+def _entry_key(user_id) -> str:
+    return '{}:{}'.format(KEY_PREFIX, user_id)
+
+
+def _name_key(user_name: str) -> str:
+    # hashed, a user_name may hold characters or a length memcached does not take in a key
+    return '{}:name:{}'.format(KEY_PREFIX, hashlib.sha1(user_name.encode('utf-8')).hexdigest())
+
+
+def _stamp_key(user_id) -> str:
+    return '{}:stamp:{}'.format(KEY_PREFIX, user_id)
+
+
+def _shared():
+    return caches[settings.PROFILE_CACHE_ALIAS]
+
+
+def _timeout(seconds: int) -> int:
+    """ how long the shared tier keeps an entry, no longer than the local tier when it is per process """
+    if isinstance(_shared(), LocMemCache):
+        return min(seconds, settings.PROFILE_CACHE_LOCAL_TTL)
+    return seconds
+
+
+def _new_stamp() -> int:
+    # a stamp that was evicted starts again above any stamp an old entry could still carry
+    return int(time.time() * 1000000)
+
+
+def _current_stamp(user_id: int) -> int:
+    cache = _shared()
+    cache.add(_stamp_key(user_id), _new_stamp(), None)
+    return cache.get(_stamp_key(user_id))
+
+
+def _bump(user_id: int) -> int:
+    """ a new stamp for user_id, every entry stored before it is out of date """
+    cache = _shared()
+    try:
+        return cache.incr(_stamp_key(user_id))
+    except ValueError:
+        stamp = _new_stamp()
+        if cache.add(_stamp_key(user_id), stamp, None):
+            return stamp
+        return cache.incr(_stamp_key(user_id))
+
+
+def _build(values):
+    from user.models import Users
+    return Users.from_db(DEFAULT_DB_ALIAS, _fields(), values)
+
+
+def _store(stamp: int, values):
+    """ put a row in both tiers, under its user_id and its user_name """
+    fields = _fields()
+    (user_id, user_name) = (values[fields.index('user_id')], values[fields.index('user_name')])
+    _local.put(user_id, stamp, values)
+    _local.put(('name', user_name), stamp, user_id)
+    try:
+        _shared().set_many({
+            _entry_key(user_id): (stamp, values),
+            _name_key(user_name): user_id
+        }, _timeout(settings.PROFILE_CACHE_TIMEOUT))
+    except Exception:
+        logger.exception('caching the profile of user %s failed', user_id)
+
+
+def _cached_by_id(user_id: int):
+    """ the row cached under user_id when its stamp is current, otherwise None """
+    entry = _local.get(user_id)
+    if entry is not None:
+        return _build(entry[1])
+
+    try:
+        cached = _shared().get_many([_entry_key(user_id), _stamp_key(user_id)])
+    except Exception:
+        # some cache backends raise on invalid keys, treat it as a miss
+        cached = {}
+    entry = cached.get(_entry_key(user_id))
+    stamp = cached.get(_stamp_key(user_id))
+    if entry is not None and stamp is not None and entry[0] == stamp:
+        _local.put(user_id, stamp, entry[1])
+        return _build(entry[1])
+    return None
+
+
+def _name_to_id(user_name: str):
+    """ the user_id cached for a user_name, or None """
+    entry = _local.get(('name', user_name))
+    if entry is not None:
+        return entry[1]
+    try:
+        return _shared().get(_name_key(user_name))
+    except Exception:
+        return None
+
+
+def _user_id(identifier: str, fields):
+    """ the user_id an identifier could be, None when it can't be one """
+    if 'user_id' not in fields or not identifier.isdigit():
+        return None
+    user_id = int(identifier)
+    # user_id is a 32 bit column, a longer number can't match and would be a database error
+    return user_id if user_id <= MAX_USER_ID else None
+
+
+def _missing_key(fields, identifier: str) -> str:
+    # identifiers come from anyone, hashed they are always a valid cache key
+    digest = hashlib.sha1(identifier.encode('utf-8')).hexdigest()
+    return '{}:missing:{}:{}'.format(KEY_PREFIX, ','.join(fields), digest)
+
+
+def _is_missing(fields, identifier: str) -> bool:
+    try:
+        return bool(_shared().get(_missing_key(fields, identifier)))
+    except Exception:
+        return False
+
+
+def _remember_missing(fields, identifier: str):
+    try:
+        _shared().set(_missing_key(fields, identifier), True, _timeout(settings.PROFILE_MISSING_TTL))
+    except Exception:
+        logger.exception('caching the missing user %r failed', identifier)
+
+
+def _forget_missing(user_id: int, user_name: str):
+    """ a user that was just created or renamed is not missing anymore """
+    keys = []
+    for fields in (USER_ID, ID_OR_NAME):
+        keys.append(_missing_key(fields, '{}'.format(user_id)))
+    for fields in (USER_NAME, ID_OR_NAME):
+        keys.append(_missing_key(fields, user_name))
+    _shared().delete_many(keys)
+
+
+def resolve_user(identifier, fields=ID_OR_NAME, fresh: bool = False):
+    """ the Users row an identifier from a url or a request names
+        fields: what the identifier may be, USER_ID, USER_NAME or ID_OR_NAME. When a number is both a
+                user_id and a user_name the user_id wins
+        fresh: read the whole row from the database, for views that save the user or check its password.
+               Otherwise the row comes from the cache when it can and leaves out the password fields
+
+        One query when the row is not cached (two the first time a name is read), none when it is. Raises
+        Users.DoesNotExist, an identifier that was not found is remembered as missing for PROFILE_MISSING_TTL
+        seconds.
+    """
+    from user.models import Users
+
+    identifier = '' if identifier is None else '{}'.format(identifier).strip()
+    user_id = _user_id(identifier, fields)
+    by_name = 'user_name' in fields and identifier != ''
+    if user_id is None and not by_name:
+        raise Users.DoesNotExist('user {} does not exist'.format(identifier))
+
+    if _is_missing(fields, identifier):
+        raise Users.DoesNotExist('user {} does not exist'.format(identifier))
+
+    lookup = Q()
+    if user_id is not None:
+        lookup |= Q(user_id=user_id)
+    if by_name:
+        lookup |= Q(user_name=identifier)
+
+    def pick(rows, get_user_id, wanted):
+        # at most two rows, the user with this user_id and the user with this user_name
+        for row in rows:
+            if get_user_id(row) == wanted:
+                return row
+        return rows[0] if rows else None
+
+    if fresh:
+        user = pick(list(Users.objects.filter(lookup).order_by()[:2]), lambda row: row.user_id, user_id)
+        if user is None:
+            _remember_missing(fields, identifier)
+            raise Users.DoesNotExist('user {} does not exist'.format(identifier))
+        return user
+
+    # a number is looked up by its user_id first, a user_name entry could hide the user_id's owner.
+    # a name goes through the user_id it belongs to, so the row is cached once for both
+    cached_id = user_id if user_id is not None else _name_to_id(identifier)
+    if cached_id is not None:
+        user = _cached_by_id(cached_id)
+        # a deleted users name can be taken by someone new
+        if user is not None and (user_id is not None or user.user_name == identifier):
+            return user
+        if user_id is None:
+            lookup = Q(user_id=cached_id) | Q(user_name=identifier)
+
+    stamp = None
+    if cached_id is not None:
+        # the stamp is read before the row, a write in between makes this entry a miss
+        try:
+            stamp = _current_stamp(cached_id)
+        except Exception:
+            logger.exception('reading the profile stamp of user %s failed', cached_id)
+
+    fields_list = _fields()
+    (id_index, name_index) = (fields_list.index('user_id'), fields_list.index('user_name'))
+    rows = list(Users.objects.filter(lookup).order_by().values_list(*fields_list)[:2])
+    if user_id is None:
+        # by name, the cached user_id only counts while it still has this name
+        rows = [row for row in rows if row[name_index] == identifier]
+    values = pick(rows, lambda row: row[id_index], user_id)
+    if values is None:
+        _remember_missing(fields, identifier)
+        raise Users.DoesNotExist('user {} does not exist'.format(identifier))
+
+    if stamp is not None and values[id_index] == cached_id:
+        _store(stamp, values)
+    else:
+        # found by a name that was not cached, there was no user_id to read a stamp for before the row.
+        # read the row again by user_id after the stamp, so the next lookup by name or user_id is free
+        try:
+            stamp = _current_stamp(values[id_index])
+            fresh_values = Users.objects.filter(pk=values[0]).values_list(*fields_list).first()
+            if fresh_values is not None:
+                _store(stamp, fresh_values)
+                values = fresh_values
+        except Exception:
+            logger.exception('caching the profile of user %s failed', values[id_index])
+    return _build(values)
+
+
+def _write_through(user_pk: int, user_id: int, user_name: str):
+    from user.models import Users
+
+    try:
+        stamp = _bump(user_id)
+        _forget_missing(user_id, user_name)
+        values = Users.objects.filter(pk=user_pk).values_list(*_fields()).first()
+        if values is not None:
+            _store(stamp, values)
+    except Exception:
+        logger.exception('updating the cached profile of user %s failed', user_id)
+
+
+def _forget(user_id: int, user_name: str):
+    _local.discard(user_id, ('name', user_name))
+    try:
+        _bump(user_id)
+        _forget_missing(user_id, user_name)
+    except Exception:
+        logger.exception('invalidating the cached profile of user %s failed', user_id)
+
+
+def _user_saved(sender, instance, **kwargs):
+    # out of date right away, in this transaction too, the committed row is cached once it commits
+    (user_pk, user_id, user_name) = (instance.pk, instance.user_id, instance.user_name)
+    _forget(user_id, user_name)
+    transaction.on_commit(lambda: _write_through(user_pk, user_id, user_name))
+
+
+def _user_deleted(sender, instance, **kwargs):
+    (user_id, user_name) = (instance.user_id, instance.user_name)
+    _forget(user_id, user_name)
+    transaction.on_commit(lambda: _forget(user_id, user_name))
+
+
+def invalidate(user_pks: [int]):
+    """ drop the cached profiles of these users, for writes made with a queryset update() """
+    from user.models import Users
+
+    for (user_pk, user_id, user_name) in Users.objects.filter(pk__in=user_pks).values_list('pk', 'user_id', 'user_name'):
+        _forget(user_id, user_name)
+        transaction.on_commit(lambda user_pk=user_pk, user_id=user_id, user_name=user_name: _write_through(user_pk, user_id, user_name))
+
+
+def clear():
+    """ empty the per process tier """
+    _local.clear()
+
+
+def _reset_local(**kwargs):
+    if kwargs['setting'].startswith('PROFILE_CACHE'):
+        _local.clear()
+
+
+setting_changed.connect(_reset_local)
+
+
+def connect():
+    """ keep the cache in step with saves and deletes of Users """
+    from user.models import Users
+
+    post_save.connect(_user_saved, sender=Users, dispatch_uid='lifesnap.profiles.users.save')
+    post_delete.connect(_user_deleted, sender=Users, dispatch_uid='lifesnap.profiles.users.delete')
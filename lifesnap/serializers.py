@@ -0,0 +1,161 @@
+""" post payloads built straight from database rows
+    Views used to load a Posts model object for every row and copy its attributes into a dict by hand.
+    serialize_posts() asks the database for only the columns the payload needs, with values_list(), and
+    builds the dicts from the row tuples, no model objects are made. The comments of every post in a page
+    are fetched with one query.
+
+    Every payload key is listed in POST_FIELDS with the columns it is built from, pick the keys a view
+    returns with the fields argument. SUMMARY_FIELDS, FEED_FIELDS and SNAPSHOT_FIELDS are the shapes the
+    views return.
+"""
+from functools import lru_cache
+
+from lifesnap.util import FragmentCache
+from lifesnap.image_urls import image_url
+from lifesnap.derivatives import variant_urls
+
+from django.conf import settings
+
+
+def _isoformat(value) -> str:
+    return value.isoformat()
+
+
+# payload key: (the columns it is built from, the function that builds it from the column values)
+# a key without a function is the column value as it is
+POST_FIELDS = dict({
+    'postid': (('post_id',), None),
+    'message': (('message',), None),
+    'title': (('message_title',), None),
+    'views': (('view_count',), None),
+    'likes': (('like_count',), None),
+    'imageurl': (('image_name', 'image_url'), image_url),
+    # the account snapshot calls the image url 'url'
+    'url': (('image_name', 'image_url'), image_url),
+    'variants': (('image_variants',), variant_urls),
+    'imagestatus': (('image_status',), None),
+    'date': (('creation_date',), _isoformat),
+    'author': (('author_username',), None),
+    'authoravatar': (('author_profile_url',), None)
+})
+
+SUMMARY_FIELDS = ('postid', 'message', 'title', 'views', 'likes', 'imageurl', 'variants', 'imagestatus', 'date')
+FEED_FIELDS = SUMMARY_FIELDS + ('author', 'authoravatar')
+SNAPSHOT_FIELDS = ('message', 'url', 'variants', 'imagestatus', 'date', 'likes')
+
+# encoded post dicts, keyed by the row they are built from
+_fragments = FragmentCache()
+
+
+class PostSerializer(object):
+    """ builds post payloads with the given keys
+        fields: keys from POST_FIELDS, in the order they appear in the payload
+        comments: add a 'comments' list to each post
+    """
+
+    def __init__(self, fields: (str,) = SUMMARY_FIELDS, comments: bool = False):
+        unknown = [field for field in fields if field not in POST_FIELDS]
+        if unknown:
+            raise ValueError('unknown post fields {}'.format(', '.join(unknown)))
+
+        self.fields = tuple(fields)
+        self.comments = comments
+
+        columns = ['id'] if comments else []
+        for field in self.fields:
+            columns.extend(column for column in POST_FIELDS[field][0] if column not in columns)
+        self.columns = tuple(columns)
+
+        # (key, the positions of its columns in a row, build function)
+        self._plan = tuple(
+            (field, tuple(self.columns.index(column) for column in POST_FIELDS[field][0]), POST_FIELDS[field][1])
+            for field in self.fields
+        )
+
+    def row(self, row: tuple) -> dict:
+        """ the payload for a row of values_list(*self.columns), without comments """
+        payload = {}
+        for (field, positions, build) in self._plan:
+            if build is None:
+                payload[field] = row[positions[0]]
+            else:
+                payload[field] = build(*[row[position] for position in positions])
+        return payload
+
+    def rows(self, queryset) -> [tuple]:
+        """ the rows of a Posts queryset, sliced or not, with the columns the payload needs """
+        return list(queryset.values_list(*self.columns))
+
+    def serialize(self, queryset, fragments: bool = False) -> list:
+        """ the payloads for the posts in a Posts queryset, in the order of the queryset
+            fragments: return each post encoded ahead of time (a JSONFragment), cached by its row.
+                       Ignored for comments and signed URLs, those change without the row changing
+        """
+        rows = self.rows(queryset)
+
+        if fragments and not self.comments and not settings.IMAGE_URL_SIGNED:
+            return [_fragments.get((self.fields, row), lambda row=row: self.row(row)) for row in rows]
+
+        payloads = [self.row(row) for row in rows]
+        if self.comments:
+            comments = post_comments([row[0] for row in rows])
+            for (row, payload) in zip(rows, payloads):
+                payload['comments'] = comments.get(row[0], [])
+        return payloads
+
+    def group(self, queryset, column: str) -> dict:
+        """ the payloads grouped by another column of the rows, such as user_id, without comments
+            return value: dict {column value: [payloads in the order of the queryset]}
+        """
+        groups = {}
+        for row in queryset.values_list(column, *self.columns):
+            groups.setdefault(row[0], []).append(self.row(row[1:]))
+        return groups
+
+    def instance(self, post) -> dict:
+        """ the payload for a Posts object that is already loaded, such as one that was just saved """
+        payload = self.row(tuple(getattr(post, column) for column in self.columns))
+        if self.comments:
+            payload['comments'] = post_comments([post.pk]).get(post.pk, [])
+        return payload
+
+
+@lru_cache(maxsize=None)
+def get_serializer(fields: (str,) = SUMMARY_FIELDS, comments: bool = False) -> PostSerializer:
+    """ the shared PostSerializer for these fields """
+    return PostSerializer(tuple(fields), comments)
+
+
+def serialize_posts(queryset, fields: (str,) = SUMMARY_FIELDS, comments: bool = False, fragments: bool = False) -> list:
+    """ the payloads for the posts in a Posts queryset, see PostSerializer """
+    return get_serializer(tuple(fields), comments).serialize(queryset, fragments=fragments)
+
+
+def group_posts(queryset, column: str, fields: (str,) = SUMMARY_FIELDS) -> dict:
+    """ the payloads for the posts in a Posts queryset grouped by column, see PostSerializer.group """
+    return get_serializer(tuple(fields)).group(queryset, column)
+
+
+def serialize_post(post, fields: (str,) = SUMMARY_FIELDS, comments: bool = False) -> dict:
+    """ the payload for a loaded Posts object, see PostSerializer """
+    return get_serializer(tuple(fields), comments).instance(post)
+
+
+def post_comments(post_pks: [int]) -> dict:
+    """ the comments of some posts, newest first, with one query
+        return value: dict {post primary key: [{'message', 'author', 'date'}]}
+    """
+    from comment.models import Comments
+
+    if not post_pks:
+        return {}
+
+    comments = {}
+    rows = Comments.objects.filter(post_id__in=post_pks).values_list('post_id', 'message', 'author_name', 'creation_date')
+    for (post_pk, message, author, date) in rows:
+        comments.setdefault(post_pk, []).append({
+            'message': message,
+            'author': author,
+            'date': date.isoformat()
+        })
+    return comments
@@ -0,0 +1,213 @@
+""" cache backed session store that writes through to the database lazily and in batches
+    set SESSION_ENGINE = 'lifesnap.sessions' to use it.
+
+    sessions are read from and written to the cache (SESSION_CACHE_ALIAS). Writes and deletes are
+    buffered in the process and persisted to django_session once SESSION_BATCH_SIZE changes are pending
+    or SESSION_FLUSH_INTERVAL seconds have passed, whichever comes first. The database is only read when
+    a session is missing from the cache, for example after a cache restart.
+
+    with more than one worker process the cache needs to be shared (memcached, redis), a per process
+    locmem cache only sees the sessions its own process created until the buffer is flushed.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, UpdateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+from django.core.exceptions import SuspiciousOperation
+from django.db import transaction
+from django.utils import timezone
+
+KEY_PREFIX = 'lifesnap.sessions'
+
+logger = logging.getLogger(__name__)
+
+
+class SessionWriteBuffer(object):
+    """ Holds session writes and deletes that have not been persisted to the database yet """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writes = {}
+        self._deletes = set()
+        self._last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self._writes) + len(self._deletes)
+
+    def queue_write(self, session_key: str, session_data: str, expire_date):
+        """ queue a session row to be inserted or updated on the next flush """
+        with self._lock:
+            self._deletes.discard(session_key)
+            self._writes[session_key] = (session_data, expire_date)
+
+        self._flush_if_due()
+
+    def queue_delete(self, session_key: str):
+        """ queue a session row to be removed on the next flush """
+        with self._lock:
+            self._writes.pop(session_key, None)
+            self._deletes.add(session_key)
+
+        self._flush_if_due()
+
+    def get(self, session_key: str):
+        """ return the pending (session_data, expire_date) for a key, or None if nothing is pending """
+        with self._lock:
+            return self._writes.get(session_key)
+
+    def is_deleted(self, session_key: str) -> bool:
+        with self._lock:
+            return session_key in self._deletes
+
+    def _flush_if_due(self):
+        batch_size = getattr(settings, 'SESSION_BATCH_SIZE', 50)
+        interval = getattr(settings, 'SESSION_FLUSH_INTERVAL', 30)
+
+        if len(self) >= batch_size or time.monotonic() - self._last_flush >= interval:
+            try:
+                self.flush()
+            except Exception:
+                # the batch is back in the buffer, a database hiccup shouldn't fail the request
+                logger.exception('unable to persist %d session changes', len(self))
+
+    def flush(self):
+        """ persist every pending write and delete using one transaction
+            return value: the number of session rows written or removed
+        """
+        with self._lock:
+            writes, self._writes = self._writes, {}
+            deletes, self._deletes = self._deletes, set()
+            self._last_flush = time.monotonic()
+
+        if not writes and not deletes:
+            return 0
+
+        model = SessionStore.get_model_class()
+        try:
+            with transaction.atomic():
+                # there is no bulk upsert, so replace the rows: one delete and one insert per batch
+                model.objects.filter(session_key__in=list(deletes) + list(writes)).delete()
+                model.objects.bulk_create([
+                    model(session_key=key, session_data=data, expire_date=expire_date)
+                    for (key, (data, expire_date)) in writes.items()
+                ])
+        except Exception:
+            # put the batch back so the next flush retries it, newer changes win
+            with self._lock:
+                for (key, value) in writes.items():
+                    if key not in self._deletes:
+                        self._writes.setdefault(key, value)
+                for key in deletes:
+                    if key not in self._writes:
+                        self._deletes.add(key)
+            raise
+
+        return len(writes) + len(deletes)
+
+
+write_buffer = SessionWriteBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        write_buffer.flush()
+    except Exception:
+        pass
+
+
+class SessionStore(DBStore):
+    """ Cache session store, persisted to the database through write_buffer """
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # some cache backends raise on invalid keys, treat it as a miss
+            data = None
+
+        if data is not None:
+            return data
+
+        if write_buffer.is_deleted(self.session_key):
+            self._session_key = None
+            return {}
+
+        # cache miss, the session is either waiting in the buffer or only in the database
+        pending = write_buffer.get(self.session_key)
+        try:
+            if pending is not None:
+                (session_data, expire_date) = pending
+                if expire_date <= timezone.now():
+                    raise self.model.DoesNotExist
+            else:
+                row = self.model.objects.get(session_key=self.session_key, expire_date__gt=timezone.now())
+                (session_data, expire_date) = (row.session_data, row.expire_date)
+
+            data = self.decode(session_data)
+        except (self.model.DoesNotExist, SuspiciousOperation) as err:
+            if isinstance(err, SuspiciousOperation):
+                logging.getLogger('django.security.{}'.format(err.__class__.__name__)).warning(str(err))
+            self._session_key = None
+            return {}
+
+        self._cache.set(self.cache_key, data, self.get_expiry_age(expiry=expire_date))
+        return data
+
+    def exists(self, session_key: str) -> bool:
+        if not session_key or write_buffer.is_deleted(session_key):
+            return False
+
+        if (self.cache_key_prefix + session_key) in self._cache or write_buffer.get(session_key) is not None:
+            return True
+
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        if must_create:
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        elif write_buffer.is_deleted(self.session_key):
+            raise UpdateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+
+        write_buffer.queue_write(self.session_key, self.encode(data), self.get_expiry_date())
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+
+        self._cache.delete(self.cache_key_prefix + session_key)
+        write_buffer.queue_delete(session_key)
+
+    def flush(self):
+        self.clear()
+        self.delete(self.session_key)
+        self._session_key = None
+
+    @classmethod
+    def clear_expired(cls):
+        """ called by `manage.py clearsessions`, persist anything pending then drop the expired rows """
+        write_buffer.flush()
+        cls.get_model_class().objects.filter(expire_date__lt=timezone.now()).delete()
@@ -69,6 +69,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'lifesnap.compression.CompressionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -102,8 +103,42 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'lifesnap.wsgi.application'
+# for ASGI servers (uvicorn, daphne), see lifesnap/asgi.py
+ASGI_APPLICATION = 'lifesnap.asgi.application'
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
+# sessions live in the cache and are written to the database in batches, see lifesnap/sessions.py
+# run `manage.py clearsessions` periodically to remove expired rows from django_session
+SESSION_ENGINE = 'lifesnap.sessions'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_BATCH_SIZE = 50
+SESSION_FLUSH_INTERVAL = 30
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+# sessions and the profile cache live here and every web process has to see the same cache, set
+# MEMCACHED_LOCATION (host:port, comma separated for more than one server, docker-compose runs one).
+# Without it each process gets its own LocMemCache, which is only right for runserver and the tests,
+# gunicorn.conf.py refuses to start more than one worker on it
+MEMCACHED_LOCATION = os.getenv('MEMCACHED_LOCATION', '')
+
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATION.split(',')
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'snaplife'
+        }
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
@@ -142,6 +177,137 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# where images are kept, see lifesnap/storage.py. Images are content addressed and reference counted.
+# lifesnap.storage.LocalStorage keeps them on disk (OPTIONS location, base_url) so the upload path can be
+# load tested offline, lifesnap.storage.MemoryStorage keeps them in memory for tests
+STORAGE = {
+    'BACKEND': 'lifesnap.storage.S3Storage',
+    'OPTIONS': {
+        'bucket_name': 'snap-life'
+    }
+}
+
+# image URLs are built locally, see lifesnap/image_urls.py. IMAGE_BASE_URL is the bucket or CDN URL keys are
+# appended to, '' uses the storage backends own URL. With IMAGE_URL_SIGNED payloads carry signed URLs that
+# stay valid for at least IMAGE_URL_TTL seconds, IMAGE_URL_SIGNING_KEY ('' for SECRET_KEY) signs CDN URLs
+IMAGE_BASE_URL = ''
+IMAGE_URL_SIGNED = False
+IMAGE_URL_TTL = 3600
+IMAGE_URL_SIGNING_KEY = ''
+IMAGE_URL_CACHE_SIZE = 10000
+
+# images that are no longer used are released on background threads, see lifesnap.storage.release_later
+STORAGE_RELEASE_WORKERS = 2
+
+# one boto3 client per process is shared by every request, see lifesnap.aws.get_client
+# this should be at least the number of threads that talk to S3 at once (request threads + upload workers)
+AWS_MAX_POOL_CONNECTIONS = 20
+
+# bulk deletes (AWS.remove_images) send 1000 keys per request, this many requests at once
+AWS_DELETE_WORKERS = 4
+
+# Image uploads, presigned direct to S3 uploads (PostImagePresign, UserProfilePresign) and base64 json uploads
+UPLOAD_URL_EXPIRES = 300
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+
+# base64 images sent inside the json body are decoded into memory up to this size, then spill to a temp file
+UPLOAD_SPOOL_MAX_BYTES = 1024 * 1024
+
+# post images from PostCreate are uploaded in the background, see lifesnap/upload_queue.py
+# IMAGE_UPLOAD_BACKOFF is the first retry delay in seconds, it doubles on every attempt
+IMAGE_UPLOAD_WORKERS = 4
+IMAGE_UPLOAD_RETRIES = 4
+IMAGE_UPLOAD_BACKOFF = 0.5
+IMAGE_UPLOAD_DEAD_LETTER_DIR = os.path.join(BASE_DIR, 'failed_uploads')
+
+# smaller copies of post images and profile pictures made in the background, see lifesnap/derivatives.py
+# needs Pillow, IMAGE_VARIANT_FORMAT is 'webp' or 'jpeg'
+IMAGE_VARIANT_WIDTHS = [160, 480, 1080]
+IMAGE_VARIANT_FORMAT = 'webp'
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = 2
+
+# outgoing email is queued in the OutboxEmails table and sent by a background worker, see lifesnap/outbox.py
+# EMAIL_OUTBOX_WORKER runs the worker thread in every web process, it starts on the first queued email or,
+# under gunicorn, when a worker starts with emails waiting. Turn it off, or run a server other than gunicorn,
+# and `manage.py sendoutbox` has to run from cron. EMAIL_RETRY_BACKOFF is the first retry delay in seconds.
+# EMAIL_SEND_LEASE is how long a claimed batch is kept from other workers while it is sent, keep it
+# longer than a batch takes
+EMAIL_OUTBOX_WORKER = True
+EMAIL_BATCH_SIZE = 50
+EMAIL_SEND_LEASE = 300
+EMAIL_POLL_INTERVAL = 30
+EMAIL_IDLE_TIMEOUT = 60
+EMAIL_RETRY_BACKOFF = 60
+EMAIL_MAX_ATTEMPTS = 5
+
+# post reports, see lifesnap/moderation.py. The moderation queue ranks posts by reports per hour over
+# the last REPORT_VELOCITY_HOURS, `manage.py reportdigest` emails the new reports to EMAIL_HOST_USER
+REPORT_VELOCITY_HOURS = 24
+# a post is hidden from feeds when this many people have reported it, None to never hide posts
+REPORT_HIDE_THRESHOLD = 10
+
+# responses are compressed with brotli (when the brotli package is installed) or gzip, see
+# lifesnap/compression.py. Bodies under COMPRESS_MIN_SIZE bytes are sent as they are
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_CONTENT_TYPES = ('application/json', 'text/')
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+
+# the batch endpoints (likes, comment counts, posts by ids) answer for at most this many ids per request
+BATCH_MAX_IDS = 100
+# how many of each users latest posts the batch snapshots (account/snapshot/batch/, friend/snapshot/batch/) include
+SNAPSHOT_BATCH_POSTS = 3
+# /snaplife/api/batch/ runs at most BATCH_MAX_REQUESTS calls per request, concurrent GETs on BATCH_WORKERS
+# threads per process, see lifesnap/multiplex.py
+BATCH_MAX_REQUESTS = 20
+BATCH_WORKERS = 4
+
+# new post notifications for posts/notify/, see lifesnap/notifications.py. lifesnap.notifications.LocalChannel
+# only reaches listeners in the same process, use PostgresChannel (LISTEN/NOTIFY) with more than one worker.
+# A long poll waits up to NOTIFY_POLL_SECONDS, keep it under the gunicorn and proxy timeouts. An event
+# stream stays open NOTIFY_STREAM_SECONDS with a keepalive every NOTIFY_KEEPALIVE_SECONDS, then the
+# browser reconnects after NOTIFY_RETRY_MILLISECONDS. Each waiting client holds a web worker thread, at most
+# NOTIFY_MAX_LISTENERS wait at once in a process (None for no limit) and the others are answered 503.
+# gunicorn.conf.py gives every worker NOTIFY_THREADS threads for them and sets NOTIFY_MAX_LISTENERS to match
+NOTIFY_CHANNEL = {
+    'BACKEND': 'lifesnap.notifications.PostgresChannel',
+    'OPTIONS': {
+        'channel_name': 'lifesnap_posts'
+    }
+}
+NOTIFY_POLL_SECONDS = 25
+NOTIFY_STREAM_SECONDS = 300
+NOTIFY_KEEPALIVE_SECONDS = 15
+NOTIFY_RETRY_MILLISECONDS = 3000
+NOTIFY_MAX_LISTENERS = int(os.getenv('NOTIFY_MAX_LISTENERS', '8'))
+
+# Users rows read by the profile endpoints are cached, see lifesnap/profiles.py. A per process LRU of
+# PROFILE_CACHE_LOCAL_SIZE rows, each kept PROFILE_CACHE_LOCAL_TTL seconds (how long another process's
+# write can take to show), sits in front of the PROFILE_CACHE_ALIAS cache, which keeps rows
+# PROFILE_CACHE_TIMEOUT seconds and has to be shared by all processes (memcached, redis) in production.
+# On a per process LocMemCache the shared tier keeps entries no longer than PROFILE_CACHE_LOCAL_TTL
+PROFILE_CACHE_ALIAS = 'default'
+PROFILE_CACHE_TIMEOUT = 3600
+PROFILE_CACHE_LOCAL_SIZE = 10000
+PROFILE_CACHE_LOCAL_TTL = 5
+# a user id or username that was not found is answered from the cache for this many seconds
+PROFILE_MISSING_TTL = 30
+
+# user/changes/ sends what changed since a clients last sync from a change log, see lifesnap/changelog.py.
+# A call reads at most DELTA_MAX_CHANGES log entries. `manage.py compactchanges` (run it daily from cron)
+# removes superseded entries and entries older than CHANGE_LOG_RETENTION_DAYS, clients offline for
+# longer than that load everything again
+DELTA_MAX_CHANGES = 500
+CHANGE_LOG_RETENTION_DAYS = 30
+
+# Password hashing for Users, see lifesnap/passwords.py
+# users are rehashed onto these on their next login. `manage.py benchmarklogin` reports logins per
+# second for a list of costs, pick the highest cost that still meets the login throughput you need.
+PASSWORD_HASH_ALGORITHM = 'pbkdf2_sha256'
+PASSWORD_HASH_COST = 100000
+PASSWORD_HASH_WORKERS = 4
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
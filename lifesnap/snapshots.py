@@ -0,0 +1,65 @@
+""" profile snapshots for many users at once
+    A follower list or search page used to call account/snapshot/ or friend/snapshot/ per user, 3 to 4
+    queries each. user_snapshots() answers for the whole page with 3 queries however many users there are:
+    the users with their following counts, the visible post counts, and the latest posts of every user.
+
+    The latest posts come from one window function query, ROW_NUMBER() over the visible posts of each user
+    newest first, which the partial index on visible posts (user_id, creation_date DESC) serves.
+"""
+from lifesnap.serializers import SNAPSHOT_FIELDS, group_posts
+from lifesnap.derivatives import variant_urls
+
+from django.db.models import Count
+from django.db.models.expressions import RawSQL
+
+
+def latest_posts(user_pks: [int], count: int):
+    """ the visible Posts of each user, at most count per user, newest first """
+    from post.models import Posts
+
+    placeholders = ', '.join(['%s'] * len(user_pks))
+    ranked = RawSQL(
+        'SELECT id FROM ('
+        'SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY creation_date DESC) AS post_rank '
+        'FROM {} WHERE user_id IN ({}) AND visibility = %s'
+        ') ranked WHERE post_rank <= %s'.format(Posts._meta.db_table, placeholders),
+        list(user_pks) + ['visible', count]
+    )
+    return Posts.objects.filter(pk__in=ranked)
+
+
+def user_snapshots(users, count: int) -> [dict]:
+    """ the snapshots of the users in a Users queryset, in the order of the queryset
+        count: how many of each users latest posts are included
+
+        return value: list of dict {
+            'userid', 'username', 'about', 'avatar', 'avatarvariants', 'followers', 'following',
+            'postcount': visible posts,
+            'posts': the latest visible posts, the same post objects friend/snapshot/ returns
+        }
+    """
+    from post.models import Posts
+
+    users = list(users.annotate(following_count=Count('following')))
+    user_pks = [user.pk for user in users]
+    if not user_pks:
+        return []
+
+    post_counts = dict(Posts.objects.filter(
+        user_id__in=user_pks,
+        visibility='visible'
+    ).order_by().values('user_id').annotate(count=Count('pk')).values_list('user_id', 'count'))
+
+    posts = group_posts(latest_posts(user_pks, count), 'user_id', SNAPSHOT_FIELDS) if count > 0 else {}
+
+    return [dict({
+        'userid': user.user_id,
+        'username': user.user_name,
+        'about': user.about,
+        'avatar': user.profile_url,
+        'avatarvariants': variant_urls(user.profile_variants),
+        'followers': user.follower_count,
+        'following': user.following_count,
+        'postcount': post_counts.get(user.pk, 0),
+        'posts': posts.get(user.pk, [])
+    }) for user in users]
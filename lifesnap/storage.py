@@ -0,0 +1,337 @@
+""" where images are kept, selected with the STORAGE setting
+    S3Storage is the production backend, LocalStorage keeps images on disk so the whole upload path can be
+    run and load tested without network access, MemoryStorage keeps them in a dict for tests.
+
+    Uploaded images are content addressed, the key is the SHA-256 of the image bytes. The same image
+    uploaded twice is stored once and a StoredObjects row counts how many posts and profiles point at it,
+    release() only removes the object once the last reference is gone. Objects that could not be removed
+    are left with 0 references, `manage.py purgeimages` removes them later.
+
+    Views call release_later(), the release runs on one of STORAGE_RELEASE_WORKERS background threads after
+    the transaction commits, so a response never waits on storage deletes.
+"""
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+_storage = None
+_storage_lock = threading.Lock()
+
+_release_pool = None
+_release_pool_lock = threading.Lock()
+
+
+class Storage(object):
+    """ interface every storage backend implements, keys are relative paths such as posts/<sha256>.png """
+
+    def save(self, key_name: str, image_file):
+        """ store the contents of a binary file object under key_name, replacing what was there """
+        raise NotImplementedError
+
+    def delete_many(self, key_names: [str]) -> [str]:
+        """ remove the objects stored under key_names, missing keys are ignored
+            return value: the keys that could not be removed
+        """
+        raise NotImplementedError
+
+    def exists(self, key_name: str) -> bool:
+        raise NotImplementedError
+
+    def url(self, key_name: str) -> str:
+        """ the public URL for the object stored under key_name """
+        raise NotImplementedError
+
+    def signed_url(self, key_name: str, expires: int) -> str:
+        """ a URL for the object stored under key_name that stops working after expires seconds
+            by default the public URL is signed with lifesnap.image_urls.sign_url
+        """
+        from lifesnap.image_urls import sign_url
+        return sign_url(self.url(key_name), int(time.time()) + expires)
+
+    def presign_upload(self, key_name: str, method: str = 'post', expires: int = 300, max_bytes: int = 10485760) -> dict:
+        """ a request the frontend can use to upload straight to storage, see AWS.presign_upload """
+        raise ValueError('direct uploads are not supported by {}'.format(type(self).__name__))
+
+
+class S3Storage(Storage):
+    """ images in an S3 bucket """
+
+    def __init__(self, bucket_name: str):
+        # imported here so the local and memory backends work without boto3 configured
+        from lifesnap.aws import AWS
+        self.aws = AWS(bucket_name)
+
+    def save(self, key_name: str, image_file):
+        self.aws.upload_file(key_name, image_file)
+
+    def delete_many(self, key_names: [str]) -> [str]:
+        summary = self.aws.remove_images(key_names)
+        for (key, error) in summary['failed'].items():
+            logger.warning('unable to remove %s: %s', key, error)
+        return list(summary['failed'])
+
+    def exists(self, key_name: str) -> bool:
+        return self.aws.image_exists(key_name)
+
+    def url(self, key_name: str) -> str:
+        return self.aws.image_url(key_name)
+
+    def signed_url(self, key_name: str, expires: int) -> str:
+        return self.aws.signed_url(key_name, expires)
+
+    def presign_upload(self, key_name: str, method: str = 'post', expires: int = 300, max_bytes: int = 10485760) -> dict:
+        return self.aws.presign_upload(key_name, method=method, expires=expires, max_bytes=max_bytes)
+
+
+class LocalStorage(Storage):
+    """ images in a directory on the local disk
+        location: the directory images are written to
+        base_url: the URL location is served from
+    """
+
+    def __init__(self, location: str, base_url: str = '/media/'):
+        self.location = os.path.abspath(location)
+        self.base_url = base_url
+
+    def _path(self, key_name: str) -> str:
+        path = os.path.abspath(os.path.join(self.location, key_name))
+        if not path.startswith(self.location + os.sep):
+            raise ValueError('key {} is outside of the storage location'.format(key_name))
+        return path
+
+    def save(self, key_name: str, image_file):
+        path = self._path(key_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so a reader never sees half an image
+        (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: image_file.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def delete_many(self, key_names: [str]) -> [str]:
+        failed = []
+        for key in key_names:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as err:
+                logger.warning('unable to remove %s: %s', key, err)
+                failed.append(key)
+        return failed
+
+    def exists(self, key_name: str) -> bool:
+        return os.path.isfile(self._path(key_name))
+
+    def url(self, key_name: str) -> str:
+        return '{}{}'.format(self.base_url, key_name)
+
+
+class MemoryStorage(Storage):
+    """ images in a dict, they are gone when the process exits """
+
+    def __init__(self, base_url: str = 'memory://'):
+        self.base_url = base_url
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def save(self, key_name: str, image_file):
+        data = image_file.read()
+        with self._lock:
+            self.objects[key_name] = data
+
+    def delete_many(self, key_names: [str]) -> [str]:
+        with self._lock:
+            for key in key_names:
+                self.objects.pop(key, None)
+        return []
+
+    def exists(self, key_name: str) -> bool:
+        return key_name in self.objects
+
+    def url(self, key_name: str) -> str:
+        return '{}{}'.format(self.base_url, key_name)
+
+
+def get_storage() -> Storage:
+    """ the storage backend from the STORAGE setting, created on first use and shared by every thread """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = import_string(settings.STORAGE['BACKEND'])
+                _storage = backend(**settings.STORAGE.get('OPTIONS', {}))
+    return _storage
+
+
+def _reset_storage(**kwargs):
+    global _storage
+    if kwargs['setting'] == 'STORAGE':
+        with _storage_lock:
+            _storage = None
+
+
+setting_changed.connect(_reset_storage)
+
+
+def content_key(image_file, prefix: str = '', extension: str = 'png') -> str:
+    """ the content addressed key for an image: <prefix><sha256 of the bytes>.<extension>
+        image_file is read to the end and rewound
+    """
+    digest = hashlib.sha256()
+    image_file.seek(0)
+    for chunk in iter(lambda: image_file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    image_file.seek(0)
+    return '{}{}.{}'.format(prefix, digest.hexdigest(), extension)
+
+
+def store(image_file, key_name: str = None, prefix: str = '', extension: str = 'png') -> str:
+    """ store an image and take a reference to it, nothing is uploaded if the key is already stored
+        image_file: a seekable binary file object holding the image
+        key_name: the key to store under, it must be derived from the content (see content_key and
+                  derivatives.variant_key). By default it is content_key(image_file, prefix, extension)
+
+        return value: the key the image is stored under, pass it to release() when it is no longer used
+    """
+    from post.models import StoredObjects
+
+    if key_name is None:
+        key_name = content_key(image_file, prefix, extension)
+
+    if StoredObjects.objects.filter(key=key_name).update(refs=F('refs') + 1):
+        return key_name
+
+    image_file.seek(0, os.SEEK_END)
+    size = image_file.tell()
+    image_file.seek(0)
+    get_storage().save(key_name, image_file)
+
+    return register(key_name, size)
+
+
+def register(key_name: str, size: int = 0) -> str:
+    """ take a reference to an object that is already in storage, such as a presigned upload,
+        so release() counts it like a stored image instead of removing it right away
+
+        return value: key_name
+    """
+    from post.models import StoredObjects
+
+    if StoredObjects.objects.filter(key=key_name).update(refs=F('refs') + 1):
+        return key_name
+
+    # someone else may have stored the same image while we were uploading
+    try:
+        with transaction.atomic():
+            StoredObjects.objects.create(key=key_name, refs=1, size=size)
+    except IntegrityError:
+        StoredObjects.objects.filter(key=key_name).update(refs=F('refs') + 1)
+    return key_name
+
+
+def release(key_names: [str]) -> [str]:
+    """ drop a reference to each key, objects are removed from storage once nothing points at them.
+        a key listed twice (two posts with the same image) drops two references.
+        keys without a StoredObjects row (presigned uploads, images stored before dedupe) are removed right away
+
+        return value: the keys that were removed from storage
+    """
+    from post.models import StoredObjects
+
+    released = Counter(key for key in key_names if key)
+    key_names = sorted(released)
+    if not key_names:
+        return []
+
+    with transaction.atomic():
+        # the rows stay locked until the objects are gone, so a concurrent store() can't revive a key
+        # that is being deleted, it uploads the image again instead
+        stored = StoredObjects.objects.select_for_update().filter(key__in=key_names).order_by('key')
+        counts = dict((row.key, row.refs) for row in stored)
+
+        # keys still used after this release, grouped by how many references they lose
+        shared = {}
+        for key in key_names:
+            if counts.get(key, 0) > released[key]:
+                shared.setdefault(released[key], []).append(key)
+        for (n, keys) in shared.items():
+            StoredObjects.objects.filter(key__in=keys).update(refs=F('refs') - n)
+
+        return _remove([key for key in key_names if counts.get(key, 0) <= released[key]])
+
+
+def _get_release_pool() -> ThreadPoolExecutor:
+    global _release_pool
+    if _release_pool is None:
+        with _release_pool_lock:
+            if _release_pool is None:
+                _release_pool = ThreadPoolExecutor(max_workers=settings.STORAGE_RELEASE_WORKERS,
+                                                   thread_name_prefix='lifesnap-release')
+    return _release_pool
+
+
+def _release_in_thread(key_names: [str]):
+    try:
+        release(key_names)
+    except Exception:
+        # the release rolled back, the references are left as they were
+        logger.exception('unable to release %s', key_names)
+    finally:
+        close_old_connections()
+
+
+def release_later(key_names: [str]):
+    """ release() in the background once the current transaction commits, nothing happens if it rolls back """
+    key_names = [key for key in key_names if key]
+    if key_names:
+        transaction.on_commit(lambda: _get_release_pool().submit(_release_in_thread, key_names))
+
+
+def purge() -> ([str], [str]):
+    """ try again to remove the objects release() could not remove, they are kept with 0 references
+        return value: tuple (the keys that were removed, the keys that are still in storage)
+    """
+    from post.models import StoredObjects
+
+    with transaction.atomic():
+        stored = StoredObjects.objects.select_for_update().filter(refs__lte=0).order_by('key')
+        key_names = [row.key for row in stored]
+        removed = _remove(key_names)
+
+    return (removed, [key for key in key_names if key not in removed])
+
+
+def _remove(key_names: [str]) -> [str]:
+    """ remove objects nothing points at, the caller holds the row locks """
+    from post.models import StoredObjects
+
+    failed = set(get_storage().delete_many(key_names))
+    removed = [key for key in key_names if key not in failed]
+
+    # a row with 0 references marks an object purge() still has to remove, store() can take it back
+    StoredObjects.objects.filter(key__in=removed).delete()
+    for key in failed:
+        StoredObjects.objects.update_or_create(key=key, defaults={'refs': 0})
+    return removed
@@ -0,0 +1,216 @@
+""" streaming ingestion of base64 encoded images sent inside a json request body
+    the image field is decoded from the request stream a chunk at a time into a spooled temporary file,
+    so an upload never holds more than a couple of chunks in memory no matter how large the image is.
+    Small images stay in memory, larger ones spill to disk once they pass spool_max bytes.
+"""
+import json
+import binascii
+from tempfile import SpooledTemporaryFile
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 1024 * 1024
+
+_B64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+# everything that is not part of the base64 alphabet, b64decode discards these as well
+_B64_DISCARD = bytes(c for c in range(256) if c not in _B64_ALPHABET)
+
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+_WHITESPACE = b' \t\r\n'
+
+
+class Base64Decoder(object):
+    """ incremental base64 decoder, decoded bytes are written to a spooled temporary file
+        write() takes the raw characters of a json string value, json escapes (\\/, \\n, \\r) are handled
+        max_bytes: raise ValueError once more than this many bytes have been decoded, None for no limit
+    """
+
+    def __init__(self, max_bytes: int = None, spool_max: int = SPOOL_MAX_BYTES):
+        self.file = SpooledTemporaryFile(max_size=spool_max)
+        self.size = 0
+        self.max_bytes = max_bytes
+        self._carry = b''
+
+    def write(self, data: bytes):
+        data = self._carry + bytes(data)
+
+        # an escape may be split over two chunks, keep a trailing backslash for the next write
+        escapes = len(data) - len(data.rstrip(b'\\'))
+        if escapes % 2:
+            (data, self._carry) = (data[:-1], b'\\')
+        else:
+            self._carry = b''
+
+        if b'\\' in data:
+            data = data.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'')
+        data = data.translate(None, _B64_DISCARD)
+
+        # only decode whole 4 character groups, the remainder waits for the next write
+        end = len(data) - len(data) % 4
+        self._carry = data[end:] + self._carry
+        self._decode(data[:end])
+
+    def close(self):
+        """ decode what is left and rewind the file, return value: the file holding the decoded bytes """
+        tail = self._carry.rstrip(b'\\')
+        self._carry = b''
+        if len(tail) % 4:
+            self.file.close()
+            raise ValueError('b64 decode error Incorrect padding')
+
+        self._decode(tail)
+        self.file.seek(0)
+        return self.file
+
+    def _decode(self, data: bytes):
+        if not data:
+            return
+
+        try:
+            decoded = binascii.a2b_base64(data)
+        except binascii.Error as err:
+            self.file.close()
+            raise ValueError('b64 decode error {}'.format(err))
+
+        self.size += len(decoded)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.file.close()
+            raise ValueError('image is larger than {} bytes'.format(self.max_bytes))
+
+        self.file.write(decoded)
+
+
+def decode_base64(b64_string: str, max_bytes: int = None, spool_max: int = SPOOL_MAX_BYTES):
+    """ decode a base64 string into a spooled temporary file, chunk by chunk
+        return value: the file holding the decoded bytes, positioned at the start
+    """
+    decoder = Base64Decoder(max_bytes=max_bytes, spool_max=spool_max)
+    for start in range(0, len(b64_string), CHUNK_SIZE):
+        decoder.write(b64_string[start:start + CHUNK_SIZE].encode('utf-8'))
+    return decoder.close()
+
+
+def _string_end(chunk: bytes, start: int, carry: bytes) -> int:
+    """ return the index of the quote closing the json string in chunk, or -1 if it isn't in this chunk """
+    end = chunk.find(b'"', start)
+    while end != -1:
+        text = carry + chunk[start:end]
+        if (len(text) - len(text.rstrip(b'\\'))) % 2 == 0:
+            return end
+        end = chunk.find(b'"', end + 1)
+    return -1
+
+
+def read_json_upload(stream, file_field: str, max_bytes: int = None, spool_max: int = SPOOL_MAX_BYTES,
+                     chunk_size: int = CHUNK_SIZE):
+    """ parse a json object from stream, decoding the base64 string in file_field as it is read
+        stream: anything with read(size), such as a django HttpRequest whose body hasn't been read yet
+        file_field: the top level key holding the base64 encoded image
+
+        return value: tuple (the json object with file_field set to None,
+                             a file holding the decoded image or None if the field was missing or empty)
+        raises json.JSONDecodeError for malformed json and ValueError for bad base64 or an image over max_bytes
+    """
+    field = json.dumps(file_field).encode('utf-8')[1:-1]
+    other = bytearray()
+    decoder = None
+    upload = None
+
+    depth = 0
+    in_string = False
+    escape = False
+    expect_key = False
+    key_start = None
+    last_key = None
+    await_value = False
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if decoder is not None:
+                end = _string_end(chunk, i, decoder._carry)
+                if end == -1:
+                    decoder.write(chunk[i:])
+                    break
+
+                decoder.write(chunk[i:end])
+                if upload is not None:
+                    upload.close()
+                if decoder.size or decoder._carry.strip(b'\\'):
+                    upload = decoder.close()
+                else:
+                    # an empty string, treat it the same as a missing image
+                    decoder.file.close()
+                    upload = None
+                decoder = None
+                other += b'null'
+                i = end + 1
+                continue
+
+            c = chunk[i]
+            i += 1
+
+            if in_string:
+                other.append(c)
+                if escape:
+                    escape = False
+                elif c == _BACKSLASH:
+                    escape = True
+                elif c == _QUOTE:
+                    in_string = False
+                    if key_start is not None:
+                        last_key = bytes(other[key_start:-1])
+                        key_start = None
+                continue
+
+            if await_value:
+                if c in _WHITESPACE:
+                    other.append(c)
+                    continue
+
+                await_value = False
+                if c == _QUOTE:
+                    decoder = Base64Decoder(max_bytes=max_bytes, spool_max=spool_max)
+                    continue
+
+            other.append(c)
+            if c == _QUOTE:
+                in_string = True
+                if depth == 1 and expect_key:
+                    key_start = len(other)
+                    expect_key = False
+            elif c in b'{[':
+                depth += 1
+                expect_key = depth == 1 and c == ord('{')
+            elif c in b'}]':
+                depth -= 1
+            elif depth == 1 and c == ord(','):
+                expect_key = True
+            elif depth == 1 and c == ord(':'):
+                await_value = last_key == field
+                last_key = None
+
+    if decoder is not None:
+        decoder.file.close()
+        raise json.JSONDecodeError('Unterminated string starting at', other.decode('utf-8', 'replace'), len(other))
+
+    try:
+        data = json.loads(other.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError) as err:
+        if upload is not None:
+            upload.close()
+        if isinstance(err, UnicodeDecodeError):
+            raise json.JSONDecodeError('invalid utf-8', '', err.start)
+        raise
+
+    if not isinstance(data, dict):
+        if upload is not None:
+            upload.close()
+        raise json.JSONDecodeError('expected a json object', other.decode('utf-8'), 0)
+
+    return (data, upload)
@@ -0,0 +1,264 @@
+""" background S3 uploads for post images and profile pictures
+    PostCreate saves the post with image_status 'pending' and hands the decoded image to this queue, the
+    request returns without waiting on storage. A pool of IMAGE_UPLOAD_WORKERS threads uploads the image and
+    flips the post to 'ready'. Failed attempts are retried IMAGE_UPLOAD_RETRIES times with exponential
+    backoff, after that the post is marked 'failed', the image is kept in IMAGE_UPLOAD_DEAD_LETTER_DIR and
+    a FailedUploads row is written. `manage.py retryuploads` puts dead letters back on the queue, the dead
+    letters of a deleted post are dropped by PostDelete and by retryuploads.
+
+    UserProfileUpdate and AuthUserCreate queue profile pictures the same way. The profile keeps its old
+    picture until the new one is stored, a picture that still fails after the retries is logged and dropped.
+"""
+import os
+import random
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lifesnap.storage import release, release_later, store
+from lifesnap.image_urls import public_url
+from lifesnap.derivatives import schedule_post_variants, schedule_profile_variants, variant_keys
+from lifesnap.versions import touch, touch_posts
+from lifesnap.changelog import log_posts
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_UPLOAD_WORKERS)
+    return _executor
+
+
+class ImageUpload(object):
+    """ an image waiting to be uploaded, the job owns image_file and closes it when it is done
+        subclasses set key_name and say what happens once the image is stored (_finish) or given up on (_fail)
+        image_file: a binary file object holding the decoded image
+    """
+    key_name = ''
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+        self.attempts = 0
+
+    def submit(self):
+        return _get_executor().submit(self.run)
+
+    def run(self):
+        """ one upload attempt, runs on the upload pool """
+        self.attempts += 1
+        try:
+            # key_name is the content key, a duplicate image only gains a reference
+            key_name = store(self.image_file, key_name=self.key_name)
+            url = public_url(key_name)
+        except Exception as err:
+            if self.attempts >= settings.IMAGE_UPLOAD_RETRIES:
+                self._fail(err)
+            else:
+                self._retry(err)
+            return
+
+        try:
+            self._finish(url)
+        finally:
+            close_old_connections()
+
+    def _retry(self, err: Exception):
+        # exponential backoff with jitter, the timer keeps the pool thread free while we wait
+        delay = settings.IMAGE_UPLOAD_BACKOFF * (2 ** (self.attempts - 1)) * random.uniform(0.5, 1.5)
+        logger.warning('upload of %s failed (attempt %d), retrying in %.1fs: %s',
+                       self.key_name, self.attempts, delay, err)
+
+        timer = threading.Timer(delay, self.submit)
+        timer.daemon = True
+        timer.start()
+
+    def _finish(self, url: str):
+        raise NotImplementedError()
+
+    def _fail(self, err: Exception):
+        raise NotImplementedError()
+
+
+class PostImageUpload(ImageUpload):
+    """ a post image waiting to be uploaded
+        post: the saved post, only pk and image_name are used
+        failure: the FailedUploads row when a dead letter is being retried
+    """
+
+    def __init__(self, post, image_file, failure=None):
+        super().__init__(image_file)
+        self.post = post
+        self.failure = failure
+
+    @property
+    def key_name(self) -> str:
+        return self.post.image_name
+
+    def _finish(self, url: str):
+        from post.models import Posts
+
+        try:
+            updated = Posts.objects.filter(pk=self.post.pk).update(image_url=url, image_status='ready')
+        except DatabaseError as err:
+            # the post can't point at the stored image, keep it as a dead letter rather than leave it
+            # pending forever, and drop the reference store() took since a retry stores it again
+            self._fail(err)
+            release([self.post.image_name])
+            return
+
+        try:
+            if not updated:
+                # the post was deleted while the upload was in flight
+                release([self.post.image_name])
+            else:
+                touch_posts([self.post.pk])
+                log_posts([self.post.pk])
+                schedule_post_variants(self.post, self.image_file)
+
+            if self.failure is not None:
+                if self.failure.file_path:
+                    _remove_file(self.failure.file_path)
+                self.failure.delete()
+        finally:
+            self.image_file.close()
+
+    def _fail(self, err: Exception):
+        from post.models import FailedUploads, Posts
+
+        logger.error('upload of %s failed after %d attempts: %s', self.post.image_name, self.attempts, err)
+        try:
+            failure = self.failure or FailedUploads(post_id=self.post.pk, image_name=self.post.image_name)
+            if not failure.file_path:
+                failure.file_path = self._keep_file()
+            failure.attempts += self.attempts
+            failure.error = '{}'.format(err)
+            failure.save()
+
+            Posts.objects.filter(pk=self.post.pk).update(image_status='failed')
+            touch_posts([self.post.pk])
+            log_posts([self.post.pk])
+        finally:
+            self.image_file.close()
+            close_old_connections()
+
+    def _keep_file(self) -> str:
+        """ copy the image into the dead letter directory so the upload can be retried later """
+        os.makedirs(settings.IMAGE_UPLOAD_DEAD_LETTER_DIR, exist_ok=True)
+        path = os.path.join(settings.IMAGE_UPLOAD_DEAD_LETTER_DIR, os.path.basename(self.post.image_name))
+
+        self.image_file.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self.image_file, f)
+        return path
+
+
+class ProfileImageUpload(ImageUpload):
+    """ a new profile picture waiting to be uploaded, the profile points at it once it is stored
+        user: the user whose picture it is, only pk is used
+        key_name: the content key of the picture, see lifesnap.storage.content_key
+    """
+
+    def __init__(self, user, key_name: str, image_file):
+        super().__init__(image_file)
+        self.user_pk = user.pk
+        self.key_name = key_name
+
+    def _finish(self, url: str):
+        from user.models import Users
+
+        try:
+            with transaction.atomic():
+                user = Users.objects.select_for_update().filter(pk=self.user_pk).first()
+                if user is not None:
+                    # pictures are stored by content, the old one is only removed once nothing else uses it
+                    old_keys = [user.profile_image_key()] + variant_keys(user.profile_variants)
+                    user.profile_key = self.key_name
+                    user.profile_url = url
+                    user.profile_variants = ''
+                    user.save(update_fields=['profile_url', 'profile_key', 'profile_variants'])
+                    user.posts_set.update(author_profile_url=url)
+                    release_later(old_keys)
+        except DatabaseError as err:
+            self._fail(err)
+            release([self.key_name])
+            return
+
+        try:
+            if user is None:
+                # the user was deleted while the upload was in flight
+                release([self.key_name])
+            else:
+                touch([user.pk])
+                # thumbnails show up in 'avatarvariants' once they are uploaded
+                schedule_profile_variants(user, self.image_file)
+        finally:
+            self.image_file.close()
+
+    def _fail(self, err: Exception):
+        # the profile keeps its old picture
+        logger.error('upload of %s failed after %d attempts: %s', self.key_name, self.attempts, err)
+        self.image_file.close()
+        close_old_connections()
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_failures(failures):
+    """ delete FailedUploads rows and their kept images, a kept image is named after the content key so
+        it is only removed once no other row still points at it
+        failures: a FailedUploads queryset
+        return value: the number of rows deleted
+    """
+    from post.models import FailedUploads
+
+    paths = set(failure.file_path for failure in failures if failure.file_path)
+    deleted, _ = failures.delete()
+
+    in_use = set(FailedUploads.objects.filter(file_path__in=paths).values_list('file_path', flat=True))
+    for path in paths - in_use:
+        _remove_file(path)
+    return deleted
+
+
+def queue_post_image(post, image_file):
+    """ upload a posts image in the background, the queue takes ownership of image_file """
+    return PostImageUpload(post, image_file).submit()
+
+
+def queue_profile_image(user, key_name: str, image_file):
+    """ upload a users profile picture in the background and point the profile at it, the queue takes
+        ownership of image_file
+    """
+    return ProfileImageUpload(user, key_name, image_file).submit()
+
+
+def retry_failed_upload(failure):
+    """ put a dead letter back on the queue
+        return value: the future for the first attempt, or None if the kept image is gone
+    """
+    from post.models import Posts
+
+    if failure.post_id is None or not failure.file_path or not os.path.exists(failure.file_path):
+        return None
+
+    Posts.objects.filter(pk=failure.post_id).update(image_status='pending')
+    touch_posts([failure.post_id])
+    log_posts([failure.post_id])
+    post = Posts(pk=failure.post_id, image_name=failure.image_name)
+    return PostImageUpload(post, open(failure.file_path, 'rb'), failure=failure).submit()
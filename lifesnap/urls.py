@@ -13,6 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+from lifesnap.multiplex import BatchRequest
 from django.conf.urls import url, include
 # from django.contrib import admin
 
@@ -20,6 +21,7 @@ from django.conf.urls import url, include
 urlpatterns = [
     # url(r'^admin/', admin.site.urls),
     url(r'^', include('home.urls')),
+    url(r'^snaplife/api/batch/$', BatchRequest.as_view(), name='batch'),
     url(r'^snaplife/api/auth/', include('userauth.urls')),
     url(r'^snaplife/api/user/', include('user.urls')),
     url(r'^snaplife/api/user/posts/', include('post.urls')),
@@ -1,20 +1,134 @@
+""" json responses for the api views, and parsing the id lists of the batch endpoints
+    payloads are encoded once, straight to utf-8 bytes, with orjson when it is installed and the stdlib json
+    encoder otherwise, the stdlib path encodes the types orjson handles natively (datetimes, dates, times,
+    UUIDs, enums, dataclasses) the same way. Parts of a payload that repeat across responses, such as post
+    dicts, can be encoded ahead of time as a JSONFragment (see FragmentCache), they are copied into the
+    response as is.
+"""
+import re
 import json
-from django.http import JsonResponse
+import uuid
+import secrets
+import datetime
+import threading
+import dataclasses
+from enum import Enum
+from collections import OrderedDict
 
+from django.conf import settings
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# a fragment is encoded as this string first and swapped for its json afterwards, the token keeps
+# user supplied strings from ever looking like a marker
+_TOKEN = secrets.token_hex(8)
+_MARKER = '\x00{}:{{}}\x00'.format(_TOKEN)
+_MARKER_RE = re.compile('"\\\\u0000{}:([0-9]+)\\\\u0000"'.format(_TOKEN).encode('ascii'))
+
+
+class JSONFragment(object):
+    """ a value that has already been encoded to json """
+    __slots__ = ('encoded',)
+
+    def __init__(self, value):
+        self.encoded = encode_json(value)
+
+    @classmethod
+    def raw(cls, encoded: bytes):
+        """ a fragment for bytes that already are json, such as the content of another JSONResponse """
+        fragment = cls.__new__(cls)
+        fragment.encoded = encoded
+        return fragment
+
+
+def _stdlib_default(value, default):
+    """ the types orjson encodes without a default, written the way orjson writes them """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dict((field.name, getattr(value, field.name)) for field in dataclasses.fields(value))
+    return default(value)
+
+
+def _dumps(obj, default) -> bytes:
+    if orjson is not None:
+        # variants maps have int keys
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    # ascii output is the faster path through the c encoder
+    return json.dumps(obj, default=lambda value: _stdlib_default(value, default), separators=(',', ':')).encode('ascii')
+
+
+def encode_json(obj) -> bytes:
+    """ encode obj to compact utf-8 json, JSONFragments anywhere inside obj are inserted as they are """
+    fragments = []
+
+    def default(value):
+        if isinstance(value, JSONFragment):
+            fragments.append(value.encoded)
+            return _MARKER.format(len(fragments) - 1)
+        raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+    data = _dumps(obj, default)
+    if fragments:
+        data = _MARKER_RE.sub(lambda match: fragments[int(match.group(1))], data)
+    return data
+
+
+class FragmentCache(object):
+    """ LRU cache of encoded fragments
+        the key must change whenever the value does, for example the database row the value is built from
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build) -> JSONFragment:
+        """ the fragment for key, build() makes the value to encode when it is not cached """
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+
+        fragment = JSONFragment(build())
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+        return fragment
+
+
+class JSONResponse(HttpResponse):
+    """ a response holding a json payload, encoded once """
+
+    def __init__(self, data, status: int = 200, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(encode_json(data), status=status, **kwargs)
 
-class JSONResponse(object):
     @classmethod
     def new(cls, *, code: int, message: str, **kwargs):
         """ return a new Json Response """
-        resp = JsonResponse({})
-        resp.status_code = code
-
-        payload = dict({
-            'message': message
-        })
+        return cls({'message': message, **kwargs}, status=code)
 
-        for (key, value) in kwargs.items():
-            payload[key] = value
 
-        resp.content = json.dumps(payload)
-        return resp
+def parse_ids(ids: str, convert=int) -> list:
+    """ the ids of a batch request, sent in the url as 1,2,3
+        convert: makes an id from each item, str for usernames
+        duplicates are dropped, more than BATCH_MAX_IDS ids is a ValueError
+    """
+    parsed = list(OrderedDict.fromkeys(convert(item) for item in ids.split(',') if item))
+    if not parsed:
+        raise ValueError('no ids were sent')
+    if len(parsed) > settings.BATCH_MAX_IDS:
+        raise ValueError('{} ids were sent, the limit is {}'.format(len(parsed), settings.BATCH_MAX_IDS))
+    return parsed
@@ -0,0 +1,118 @@
+""" per user content versions and the ETags built from them
+    Every user has a ContentVersions counter that goes up whenever something their snapshots or feed show
+    changes: their account, who they follow, their posts and the comments on them. Model saves and deletes
+    bump it through signals (connected in UserConfig.ready), writes that go around save() with a queryset
+    update() call touch() themselves.
+
+    content_etag() hashes the counters a response depends on, so a view can answer If-None-Match with a 304
+    after one small query, before it loads or serializes any posts. While IMAGE_URL_SIGNED is on the ETag
+    also changes every IMAGE_URL_TTL seconds, so a client never keeps signed URLs that have expired.
+"""
+import time
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+def touch(user_pks: [int]):
+    """ bump the content version of each user, call it after the write """
+    from user.models import ContentVersions
+
+    user_pks = set(pk for pk in user_pks if pk is not None)
+    if not user_pks:
+        return
+
+    if ContentVersions.objects.filter(user_pk__in=user_pks).update(version=F('version') + 1) == len(user_pks):
+        return
+
+    # the first change for a user creates its counter
+    existing = set(ContentVersions.objects.filter(user_pk__in=user_pks).values_list('user_pk', flat=True))
+    for pk in user_pks - existing:
+        try:
+            with transaction.atomic():
+                ContentVersions.objects.create(user_pk=pk, version=1)
+        except IntegrityError:
+            ContentVersions.objects.filter(user_pk=pk).update(version=F('version') + 1)
+
+
+def touch_posts(post_pks: [int]):
+    """ bump the content version of the users who own these posts """
+    from post.models import Posts
+    touch(Posts.objects.filter(pk__in=post_pks).values_list('user_id', flat=True))
+
+
+def content_etag(user, *parts, following: bool = False) -> str:
+    """ an ETag for a response about user
+        parts: whatever else the response depends on, such as the view and its arguments
+        following: the response also shows the users user follows (their posts or avatars)
+    """
+    from user.models import ContentVersions
+
+    users = Q(user_pk=user.pk)
+    if following:
+        users |= Q(user_pk__in=user.following.values('pk'))
+    versions = sorted(ContentVersions.objects.filter(users).values_list('user_pk', 'version'))
+
+    if settings.IMAGE_URL_SIGNED:
+        parts += ('signed', int(time.time() // settings.IMAGE_URL_TTL))
+
+    digest = hashlib.sha1('{}:{!r}:{!r}'.format(user.pk, parts, versions).encode('utf-8'))
+    return '"{}"'.format(digest.hexdigest())
+
+
+def not_modified(request, etag: str):
+    """ the 304 response when the client already has the current version (If-None-Match), otherwise None """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_etag(response, etag)
+    return response
+
+
+def set_etag(response, etag: str):
+    """ add the ETag to a response, clients keep it but check it with us before using it again """
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _post_changed(sender, instance, **kwargs):
+    touch([instance.user_id])
+
+
+def _comment_changed(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        touch_posts([instance.post_id])
+
+
+def _user_changed(sender, instance, **kwargs):
+    touch([instance.pk])
+
+
+def _user_deleted(sender, instance, **kwargs):
+    from user.models import ContentVersions
+    ContentVersions.objects.filter(user_pk=instance.pk).delete()
+
+
+def _following_changed(sender, instance, action, pk_set, **kwargs):
+    # both sides change, the follower's following list and the followed users follower count
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        touch([instance.pk] + list(pk_set or []))
+
+
+def connect():
+    """ bump versions when posts, comments, users and follows are saved or deleted """
+    from user.models import Users
+    from post.models import Posts
+    from comment.models import Comments
+
+    post_save.connect(_post_changed, sender=Posts, dispatch_uid='lifesnap.versions.posts.save')
+    post_delete.connect(_post_changed, sender=Posts, dispatch_uid='lifesnap.versions.posts.delete')
+    post_save.connect(_comment_changed, sender=Comments, dispatch_uid='lifesnap.versions.comments.save')
+    post_delete.connect(_comment_changed, sender=Comments, dispatch_uid='lifesnap.versions.comments.delete')
+    post_save.connect(_user_changed, sender=Users, dispatch_uid='lifesnap.versions.users.save')
+    post_delete.connect(_user_deleted, sender=Users, dispatch_uid='lifesnap.versions.users.delete')
+    m2m_changed.connect(_following_changed, sender=Users.following.through, dispatch_uid='lifesnap.versions.following')
@@ -0,0 +1,55 @@
+""" compare the cost of a new boto3 client per request against the shared client from lifesnap.aws """
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3.session
+from lifesnap.aws import AWS, get_client, reset_clients
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure S3 client overhead. "per request" builds a new boto3 client for every request (the old '
+        'behaviour), "shared" uses the pooled process wide client. With --key every request also does a '
+        'head_object call, which shows the cost of new connections against reused keep alive ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='number of simulated requests')
+        parser.add_argument('--concurrency', type=int, default=8, help='number of simulated request workers')
+        parser.add_argument('--bucket', default='snap-life', help='bucket to use with --key')
+        parser.add_argument('--key', default=None, help='an existing key to head_object on every request')
+
+    def handle(self, **options):
+        key = options['key']
+
+        def per_request(_):
+            # the default session is not thread safe, a request built its client from a session of its own
+            s3 = boto3.session.Session().client('s3')
+            if key:
+                s3.head_object(Bucket=options['bucket'], Key=key)
+
+        def shared(_):
+            aws = AWS(options['bucket'])
+            if key:
+                aws.s3.head_object(Bucket=options['bucket'], Key=key)
+
+        reset_clients()
+        start = time.perf_counter()
+        get_client('s3')
+        self.stdout.write('shared client startup: {:.2f} ms'.format((time.perf_counter() - start) * 1000))
+
+        self.stdout.write('{} requests, {} request workers, {} pooled connections{}'.format(
+            options['requests'], options['concurrency'], settings.AWS_MAX_POOL_CONNECTIONS,
+            ', head_object {}'.format(key) if key else ''))
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as workers:
+            for (name, request) in (('per request', per_request), ('shared', shared)):
+                start = time.perf_counter()
+                list(workers.map(request, range(options['requests'])))
+                elapsed = time.perf_counter() - start
+
+                self.stdout.write('{:>12}: {:>10.1f} requests/s, {:>8.2f} ms per request'.format(
+                    name, options['requests'] / elapsed, elapsed / options['requests'] * 1000))
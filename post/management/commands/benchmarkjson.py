@@ -0,0 +1,98 @@
+""" compare the json response encoder against the helper it replaced on feed sized payloads """
+import json
+import time
+import tracemalloc
+
+from lifesnap import util
+from lifesnap.util import FragmentCache, JSONResponse
+
+from django.http import JsonResponse
+from django.core.management.base import BaseCommand
+
+
+def legacy_response(*, code: int, message: str, **kwargs):
+    """ the old JSONResponse.new, kept here as the baseline """
+    resp = JsonResponse({})
+    resp.status_code = code
+
+    payload = dict({
+        'message': message
+    })
+
+    for (key, value) in kwargs.items():
+        payload[key] = value
+
+    resp.content = json.dumps(payload)
+    return resp
+
+
+def feed_post(post_id: int, comments: int) -> dict:
+    return dict({
+        'postid': post_id,
+        'message': 'a post message that is about as long as the ones people write {}'.format(post_id),
+        'title': 'post title {}'.format(post_id),
+        'views': post_id * 7,
+        'likes': post_id * 3,
+        'imageurl': 'https://snap-life.s3.amazonaws.com/posts/{:064x}.png'.format(post_id),
+        'variants': dict((width, 'https://snap-life.s3.amazonaws.com/posts/{:064x}_{}.webp'.format(post_id, width))
+                         for width in (160, 480, 1080)),
+        'imagestatus': 'ready',
+        'date': '2026-10-19T15:30:00.000000+00:00',
+        'author': 'someusername',
+        'authoravatar': 'https://snap-life.s3.amazonaws.com/profilepic/someusername.png',
+        'comments': [dict({
+            'message': 'comment {} on a post'.format(i),
+            'author': 'commenter{}'.format(i),
+            'date': '2026-10-19T15:31:00.000000+00:00'
+        }) for i in range(comments)]
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        'Time building a feed response with the old JSONResponse helper, the new single pass encoder and '
+        'the new encoder with cached post fragments. Encoder: orjson when installed, otherwise stdlib json.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50, help='posts per response')
+        parser.add_argument('--comments', type=int, default=5, help='comments per post')
+        parser.add_argument('--responses', type=int, default=500, help='responses to build per encoder')
+        parser.add_argument('--stdlib', action='store_true', help='use the stdlib json encoder even if orjson is installed')
+
+    def handle(self, **options):
+        if options['stdlib']:
+            util.orjson = None
+
+        posts = [feed_post(i, options['comments']) for i in range(options['posts'])]
+        cache = FragmentCache()
+
+        def cached_posts():
+            # in a view the key is the row the post dict is built from
+            return [cache.get(post['postid'], lambda: post) for post in posts]
+
+        runs = (
+            ('legacy', lambda: legacy_response(code=200, message='success', posts=posts)),
+            ('encoder', lambda: JSONResponse.new(code=200, message='success', posts=posts)),
+            ('fragments', lambda: JSONResponse.new(code=200, message='success', posts=cached_posts()))
+        )
+
+        self.stdout.write('{} posts with {} comments, {} responses each, encoder {}'.format(
+            options['posts'], options['comments'], options['responses'], 'orjson' if util.orjson else 'json'))
+
+        for (name, build) in runs:
+            size = len(build().content)
+
+            start = time.perf_counter()
+            for _ in range(options['responses']):
+                build()
+            elapsed = time.perf_counter() - start
+
+            # measured apart from the timing, tracing allocations slows everything down
+            tracemalloc.start()
+            build()
+            (_, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write('{:>10}: {:>9.1f} us per response, {:>7} bytes, {:>8} peak bytes allocated'.format(
+                name, elapsed / options['responses'] * 1e6, size, peak))
@@ -0,0 +1,95 @@
+""" load test deleting posts with storage deletes in the request against deletes in the background """
+import time
+import threading
+
+from lifesnap import storage
+from lifesnap.storage import MemoryStorage, release, release_later
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+
+
+class SlowStorage(MemoryStorage):
+    """ in memory storage where every call takes as long as a round trip to S3 """
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    def save(self, key_name: str, image_file):
+        time.sleep(self.latency)
+        super().save(key_name, image_file)
+
+    def delete_many(self, key_names: [str]) -> [str]:
+        time.sleep(self.latency)
+        return super().delete_many(key_names)
+
+    def exists(self, key_name: str) -> bool:
+        time.sleep(self.latency)
+        return super().exists(key_name)
+
+
+def percentile(values: [float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate PostDelete under load, with the storage deletes made in the request (release) and on the '
+        'background release pool (release_later). Storage is an in memory backend with --latency seconds per call. '
+        'release locks the StoredObjects rows, on sqlite run it with one client and STORAGE_RELEASE_WORKERS = 1'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='request threads')
+        parser.add_argument('--requests', type=int, default=50, help='requests per client')
+        parser.add_argument('--latency', type=float, default=0.05, help='seconds per storage call')
+
+    def _load(self, release_keys, options) -> ([float], float):
+        latencies = []
+        lock = threading.Lock()
+
+        def client(number: int):
+            try:
+                for i in range(options['requests']):
+                    # a post image and its three variants, like PostDelete releases
+                    key_names = ['posts/benchmark-{}-{}{}.png'.format(number, i, suffix) for suffix in ('', '_160', '_480', '_1080')]
+                    start = time.perf_counter()
+                    release_keys(key_names)
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(options['clients'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (latencies, time.perf_counter() - start)
+
+    def handle(self, **options):
+        previous = storage._storage
+        storage._storage = SlowStorage(options['latency'])
+        try:
+            self.stdout.write('{} clients x {} requests, {:.0f} ms per storage call'.format(
+                options['clients'], options['requests'], options['latency'] * 1000))
+
+            for (name, release_keys) in (('inline', release), ('background', release_later)):
+                (latencies, elapsed) = self._load(release_keys, options)
+
+                if name == 'background':
+                    # the requests are answered, wait for the release pool to finish the deletes they handed it
+                    start = time.perf_counter()
+                    storage._get_release_pool().shutdown(wait=True)
+                    storage._release_pool = None
+                    drained = elapsed + time.perf_counter() - start
+                else:
+                    drained = elapsed
+
+                self.stdout.write('{:>10}: {:>7.1f} requests/s, p50 {:>6.1f} ms, p95 {:>6.1f} ms, deletes done after {:.2f} s'.format(
+                    name, len(latencies) / elapsed, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, drained))
+        finally:
+            storage._storage = previous
@@ -0,0 +1,80 @@
+""" compare building post payloads from model objects against building them from values_list rows """
+import time
+import tracemalloc
+
+from lifesnap.image_urls import image_url
+from lifesnap.derivatives import variant_urls
+from lifesnap.serializers import FEED_FIELDS, SUMMARY_FIELDS, serialize_posts
+
+from post.models import Posts
+from django.db import transaction
+from django.db.models import Max
+from django.core.management.base import BaseCommand
+
+
+def model_posts(queryset) -> [dict]:
+    """ the payloads the way the views built them before the serializer, kept here as the baseline """
+    return [dict({
+        'postid': post.post_id,
+        'message': post.message,
+        'title': post.message_title,
+        'views': post.view_count,
+        'likes': post.like_count,
+        'imageurl': image_url(post.image_name, post.image_url),
+        'variants': variant_urls(post.image_variants),
+        'imagestatus': post.image_status,
+        'date': post.creation_date.isoformat(),
+        'author': post.author_username,
+        'authoravatar': post.author_profile_url
+    }) for post in queryset]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time and measure the memory of building post payloads from Posts model objects and from '
+        'values_list rows. The posts are made for the run and rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000, help='posts per query')
+        parser.add_argument('--runs', type=int, default=20, help='queries per method')
+
+    def handle(self, **options):
+        with transaction.atomic():
+            first_id = (Posts.objects.aggregate(Max('post_id'))['post_id__max'] or 0) + 1
+            Posts.objects.bulk_create([Posts(
+                post_id=post_id,
+                message='a post message that is about as long as the ones people write {}'.format(post_id),
+                message_title='post title {}'.format(post_id),
+                author_username='someusername',
+                author_profile_url='https://snap-life.s3.amazonaws.com/profilepic/someusername.png',
+                image_name='posts/{:064x}.png'.format(post_id),
+                image_url='https://snap-life.s3.amazonaws.com/posts/{:064x}.png'.format(post_id)
+            ) for post_id in range(first_id, first_id + options['posts'])])
+
+            posts = Posts.objects.filter(post_id__gte=first_id)
+            runs = (
+                ('models', lambda: model_posts(posts.all())),
+                ('rows', lambda: serialize_posts(posts, FEED_FIELDS)),
+                ('rows (summary)', lambda: serialize_posts(posts, SUMMARY_FIELDS))
+            )
+
+            self.stdout.write('{} posts per query, {} queries each'.format(options['posts'], options['runs']))
+            for (name, build) in runs:
+                count = len(build())
+
+                start = time.perf_counter()
+                for _ in range(options['runs']):
+                    build()
+                elapsed = time.perf_counter() - start
+
+                # measured apart from the timing, tracing allocations slows everything down
+                tracemalloc.start()
+                build()
+                (_, peak) = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                self.stdout.write('{:>15}: {:>7.2f} us per row, {:>6} peak bytes allocated per row'.format(
+                    name, elapsed / options['runs'] / count * 1e6, peak // count))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,117 @@
+""" load test post and profile image uploads made in the request against uploads on the background queue """
+import time
+import threading
+from io import BytesIO
+
+from post.models import Posts, StoredObjects
+from user.models import Users
+from lifesnap import storage, upload_queue
+from lifesnap.storage import content_key
+from lifesnap.upload_queue import PostImageUpload, ProfileImageUpload, queue_post_image, queue_profile_image
+from post.management.commands.benchmarkrelease import SlowStorage, percentile
+
+from django.db import connection
+from django.utils import timezone
+from django.test.utils import override_settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate PostCreate and UserProfileUpdate under load, with the image stored in the request and on the '
+        'background upload queue. Storage is an in memory backend with --latency seconds per call. The posts and '
+        'users the run creates are deleted again at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='request threads')
+        parser.add_argument('--requests', type=int, default=20, help='requests per client')
+        parser.add_argument('--latency', type=float, default=0.05, help='seconds per storage call')
+
+    def _users(self, options) -> [Users]:
+        users = []
+        for number in range(options['clients']):
+            name = 'benchmark-{}'.format(number)
+            users.append(Users.objects.create(
+                user_id=-1 - number, first_name='Bench', last_name='Mark', user_name=name,
+                email='{}@noemail.set'.format(name), password_hash=name, salt_hash=name,
+                last_login_date=timezone.now()))
+        return users
+
+    def _load(self, upload, users, options) -> ([float], float):
+        latencies = []
+        lock = threading.Lock()
+
+        def client(number: int):
+            try:
+                for i in range(options['requests']):
+                    # a different image every time, a duplicate would only gain a reference
+                    image = 'benchmark image {} {} {}'.format(upload.__name__, number, i).encode('utf-8')
+                    start = time.perf_counter()
+                    upload(users[number], number * options['requests'] + i, image)
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(options['clients'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (latencies, time.perf_counter() - start)
+
+    def handle(self, **options):
+        previous = storage._storage
+        storage._storage = SlowStorage(options['latency'])
+        users = self._users(options)
+        try:
+            self.stdout.write('{} clients x {} requests, {:.0f} ms per storage call'.format(
+                options['clients'], options['requests'], options['latency'] * 1000))
+
+            # only the upload is measured, no thumbnails
+            with override_settings(IMAGE_VARIANT_WIDTHS=[]):
+                for (name, upload) in (('post inline', _post_inline), ('post queued', _post_queued),
+                                       ('profile inline', _profile_inline), ('profile queued', _profile_queued)):
+                    (latencies, elapsed) = self._load(upload, users, options)
+
+                    # the requests are answered, wait for the upload pool to finish what they handed it
+                    start = time.perf_counter()
+                    upload_queue._get_executor().shutdown(wait=True)
+                    upload_queue._executor = None
+                    drained = elapsed + time.perf_counter() - start
+
+                    self.stdout.write('{:>15}: {:>7.1f} requests/s, p50 {:>6.1f} ms, p95 {:>6.1f} ms, uploads done after {:.2f} s'.format(
+                        name, len(latencies) / elapsed, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, drained))
+        finally:
+            storage._storage = previous
+            key_names = list(Posts.objects.filter(user__in=users).values_list('image_name', flat=True))
+            key_names += [user.profile_key for user in Users.objects.filter(pk__in=[user.pk for user in users])]
+            Posts.objects.filter(user__in=users).delete()
+            Users.objects.filter(pk__in=[user.pk for user in users]).delete()
+            StoredObjects.objects.filter(key__in=key_names).delete()
+
+
+def _new_post(user: Users, post_id: int, image: bytes) -> Posts:
+    # what PostCreate does before the image is uploaded
+    post = Posts(post_id=-1 - post_id, message='benchmark', author_username=user.user_name, user=user,
+                 image_name=content_key(BytesIO(image), prefix='posts/'), image_status='pending')
+    post.save()
+    return post
+
+
+def _post_inline(user: Users, post_id: int, image: bytes):
+    PostImageUpload(_new_post(user, post_id, image), BytesIO(image)).run()
+
+
+def _post_queued(user: Users, post_id: int, image: bytes):
+    queue_post_image(_new_post(user, post_id + 1000000, image), BytesIO(image))
+
+
+def _profile_inline(user: Users, post_id: int, image: bytes):
+    ProfileImageUpload(user, content_key(BytesIO(image), prefix='profilepic/'), BytesIO(image)).run()
+
+
+def _profile_queued(user: Users, post_id: int, image: bytes):
+    queue_profile_image(user, content_key(BytesIO(image), prefix='profilepic/'), BytesIO(image))
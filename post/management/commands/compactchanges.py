@@ -0,0 +1,18 @@
+""" shrink the change log the delta sync endpoint (user/changes/) reads """
+from lifesnap.changelog import compact
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove change log entries that a newer entry for the same object supersedes, and entries older than '
+        'CHANGE_LOG_RETENTION_DAYS. Clients that last synced before the removed entries load everything again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='keep this many days instead of CHANGE_LOG_RETENTION_DAYS')
+
+    def handle(self, **options):
+        (duplicates, expired) = compact(options['days'])
+        self.stdout.write('removed {} superseded and {} expired change log entries'.format(duplicates, expired))
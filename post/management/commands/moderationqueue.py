@@ -0,0 +1,33 @@
+""" print the reported posts ranked by report velocity, show or hide a post """
+from lifesnap.moderation import moderation_queue, set_visibility
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'List the reported posts, the posts collecting reports the fastest come first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50, help='number of posts to list')
+        parser.add_argument('--hours', type=int, default=None,
+                            help='velocity window in hours, defaults to REPORT_VELOCITY_HOURS')
+        parser.add_argument('--show', type=int, metavar='POSTID', help='make a hidden post visible again')
+        parser.add_argument('--hide', type=int, metavar='POSTID', help='hide a post from the feeds')
+
+    def handle(self, **options):
+        for (visibility, post_id) in (('visible', options['show']), ('hidden', options['hide'])):
+            if post_id is None:
+                continue
+            if set_visibility(post_id, visibility):
+                self.stdout.write('post {} is now {}'.format(post_id, visibility))
+            else:
+                self.stderr.write('post {} is not found'.format(post_id))
+            return
+
+        hours = options['hours'] or settings.REPORT_VELOCITY_HOURS
+        for entry in moderation_queue(limit=options['limit'], hours=hours):
+            post = entry['post']
+            self.stdout.write('{:>8.2f}/h {:>5} recent {:>5} total {:>8}  post {} by {}: {}'.format(
+                entry['velocity'], entry['recent'], entry['total'], post.visibility, post.post_id,
+                post.author_username, post.message_title or post.message))
@@ -0,0 +1,15 @@
+""" remove the stored images that nothing points at but could not be removed when they were released """
+from lifesnap.storage import purge
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Remove the images with 0 references from storage, run this after a bulk delete reported failures.'
+
+    def handle(self, **options):
+        (removed, failed) = purge()
+
+        self.stdout.write('removed {} images'.format(len(removed)))
+        for key in failed:
+            self.stderr.write('unable to remove {}'.format(key))
@@ -0,0 +1,12 @@
+""" email the admin inbox a digest of the post reports that came in since the last digest """
+from lifesnap.moderation import send_report_digest
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Queue one email summarizing the new post reports, run this periodically from cron.'
+
+    def handle(self, **options):
+        count = send_report_digest()
+        self.stdout.write('{} new reports in the digest'.format(count) if count else 'no new reports')
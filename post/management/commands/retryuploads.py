@@ -0,0 +1,30 @@
+""" put post images that failed to upload back on the background upload queue """
+from post.models import FailedUploads
+from lifesnap.upload_queue import discard_failures, retry_failed_upload
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Retry the post image uploads recorded in FailedUploads and wait for them to finish.'
+
+    def handle(self, **options):
+        # dead letters whose post was deleted have nothing left to upload to
+        dropped = discard_failures(FailedUploads.objects.filter(post__isnull=True))
+
+        futures = []
+        skipped = 0
+        for failure in FailedUploads.objects.all():
+            future = retry_failed_upload(failure)
+            if future is None:
+                skipped += 1
+            else:
+                futures.append(future)
+
+        for future in futures:
+            future.result()
+
+        self.stdout.write('dropped {} uploads of deleted posts'.format(dropped))
+        self.stdout.write('retried {} uploads, {} skipped because the kept image is gone'.format(
+            len(futures), skipped))
+        self.stdout.write('{} uploads are still failing'.format(FailedUploads.objects.count()))
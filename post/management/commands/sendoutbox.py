@@ -0,0 +1,28 @@
+""" send the queued emails from the outbox, for deployments that don't run the in process outbox worker """
+from lifesnap.outbox import queue_depth, worker
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Send every email in the outbox that is due, then print the queue depth.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', action='store_true', help='only print the queue depth')
+
+    def handle(self, **options):
+        if not options['depth']:
+            sent = 0
+            try:
+                while True:
+                    count = worker.send_due()
+                    sent += count
+                    if count < settings.EMAIL_BATCH_SIZE:
+                        break
+            finally:
+                worker.close()
+            self.stdout.write('tried {} emails'.format(sent))
+
+        depth = queue_depth()
+        self.stdout.write('{} queued ({} due), {} failed'.format(depth['queued'], depth['due'], depth['failed']))
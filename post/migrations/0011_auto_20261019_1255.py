@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 12:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0010_posts_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='image_status',
+            field=models.CharField(default='ready', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='FailedUploads',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_name', models.CharField(max_length=100)),
+                ('file_path', models.CharField(blank=True, max_length=255)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='post.Posts')),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+            },
+        ),
+    ]
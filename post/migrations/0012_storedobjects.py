@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 13:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0011_auto_20261019_1255'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredObjects',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('refs', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0012_storedobjects'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmails',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=254)),
+                ('recipients', models.TextField()),
+                ('status', models.CharField(default='queued', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('sent_date', models.DateTimeField(null=True)),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxemails',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
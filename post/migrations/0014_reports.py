@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 14:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0013_outboxemails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reports',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reporter', models.EmailField(max_length=254)),
+                ('reason', models.TextField(blank=True)),
+                ('notified', models.BooleanField(default=False)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='post.Posts')),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='reports',
+            unique_together=set([('post', 'reporter')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='reports',
+            index_together=set([('notified', 'creation_date')]),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0014_reports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='visibility',
+            field=models.CharField(default='visible', max_length=10),
+        ),
+        # django 1.11 has no partial indexes, hidden posts are left out so the index stays the size of the feed
+        migrations.RunSQL(
+            sql="CREATE INDEX post_posts_visible_user_date ON post_posts (user_id, creation_date DESC) "
+                "WHERE visibility = 'visible'",
+            reverse_sql='DROP INDEX post_posts_visible_user_date'
+        ),
+    ]
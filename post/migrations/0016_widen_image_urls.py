@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 21:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0015_posts_visibility'),
+    ]
+
+    # content addressed keys make URLs longer than 100 characters
+    operations = [
+        migrations.AlterField(
+            model_name='posts',
+            name='image_url',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='posts',
+            name='author_profile_url',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -1,6 +1,7 @@
 """ Posts Model """
 from user.models import Users
 from django.db import models
+from django.utils import timezone
 
 
 class Posts(models.Model):
@@ -8,17 +9,87 @@ class Posts(models.Model):
         ordering = ['-creation_date']
 
     post_id = models.IntegerField(blank=False, unique=True)
-    image_url = models.CharField(blank=True, max_length=100)
+    image_url = models.CharField(blank=True, max_length=255)
     image_name = models.CharField(blank=True, max_length=100)
+    image_variants = models.TextField(blank=True, default='')
+    image_status = models.CharField(max_length=10, default='ready')
     author_username = models.CharField(blank=False, max_length=40)
-    author_profile_url = models.CharField(max_length=100, blank=True)
+    author_profile_url = models.CharField(max_length=255, blank=True)
     message = models.CharField(max_length=254)
     message_title = models.CharField(blank=True, max_length=100)
     creation_date = models.DateTimeField(auto_now_add=True)
     view_count = models.IntegerField(default=0)
     like_count = models.IntegerField(default=0)
     report_count = models.IntegerField(default=0)
+    # 'visible' or 'hidden', set to 'hidden' when report_count reaches REPORT_HIDE_THRESHOLD. Feed queries
+    # filter on visibility = 'visible', which a partial index covers (see migration 0015_posts_visibility)
+    visibility = models.CharField(max_length=10, default='visible')
     user = models.ForeignKey(Users, on_delete=models.CASCADE, null=True)
 
     def __str__(self):
         return '{}: {}'.format(self.post_id, self.image_url)
+
+
+class FailedUploads(models.Model):
+    """ dead letter record for post images that could not be uploaded to S3, see lifesnap/upload_queue.py """
+    class Meta:
+        ordering = ['-creation_date']
+
+    post = models.ForeignKey(Posts, on_delete=models.SET_NULL, null=True)
+    image_name = models.CharField(max_length=100)
+    file_path = models.CharField(max_length=255, blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    creation_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.image_name, self.error)
+
+
+class StoredObjects(models.Model):
+    """ reference count for a content addressed image in storage, see lifesnap/storage.py """
+    key = models.CharField(max_length=100, unique=True)
+    refs = models.IntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    creation_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.key, self.refs)
+
+
+class OutboxEmails(models.Model):
+    """ an email waiting to be sent by the outbox worker, see lifesnap/outbox.py """
+    class Meta:
+        ordering = ['-creation_date']
+        index_together = [['status', 'next_attempt']]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField()
+    status = models.CharField(max_length=10, default='queued')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.subject, self.status)
+
+
+class Reports(models.Model):
+    """ a report of a post, a reporter can report a post once, see lifesnap/moderation.py """
+    class Meta:
+        ordering = ['-creation_date']
+        unique_together = [['post', 'reporter']]
+        index_together = [['notified', 'creation_date']]
+
+    post = models.ForeignKey(Posts, on_delete=models.CASCADE)
+    reporter = models.EmailField()
+    reason = models.TextField(blank=True)
+    notified = models.BooleanField(default=False)
+    creation_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.post_id, self.reporter)
@@ -1,11 +1,35 @@
 from urllib.parse import quote
-from datetime import datetime
+from datetime import datetime, timedelta
+from threading import Lock, Timer
 from base64 import b64encode
+from io import BytesIO, StringIO
+from uuid import UUID
+from unittest import skipIf
+from tempfile import TemporaryDirectory
+import os
 import json
 
 from user.models import Users
+from post.models import Posts, FailedUploads, OutboxEmails, Reports, StoredObjects
+from lifesnap.derivatives import Image, render_variants, variant_key
+from lifesnap.upload_queue import PostImageUpload, discard_failures
+from lifesnap.aws import AWS
+from lifesnap import util
+from lifesnap.util import FragmentCache, JSONFragment, JSONResponse
+from lifesnap.serializers import FEED_FIELDS, SNAPSHOT_FIELDS, serialize_post, serialize_posts
+from comment.models import Comments
+from lifesnap import outbox
+from lifesnap.outbox import queue_depth, queue_email, worker
+from lifesnap.moderation import moderation_queue, send_report_digest, set_visibility
+from lifesnap.notifications import get_channel
+from lifesnap.storage import LocalStorage, content_key, get_storage, purge, release, store
+from lifesnap.image_urls import URLBuilder, check_signature, image_url, public_url
 from django.utils import timezone
-from django.test import TestCase, tag, Client
+from django.test import TestCase, tag, Client, override_settings
+from django.core import mail
+from django.core.management import call_command
+from django.db import DataError
+from django.core.mail.backends.base import BaseEmailBackend
 from django.core.signing import Signer
 
 
@@ -252,3 +276,821 @@ class UserPostCreate(TestCase):
         print('\tpost_report status: {}'.format(resp.status_code))
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json()['count'], 1)
+
+
+@tag('userpost')
+class UserPostImageUpload(TestCase):
+    """ make sure the image upload paths validate their input before touching S3 """
+    def _login_user(self, password: str):
+        url = '/snaplife/api/auth/user/login/'
+        data = json.dumps({'username': self.user.user_name, 'password': password})
+        resp = self.client.post(url, data, content_type='application/json')
+
+        print('\tuser post: login status {}'.format(resp.status_code == 200))
+        self.assertEqual(resp.status_code, 200)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        salt = 'blahfffffj349feiblah123'
+        signer = Signer(salt=salt)
+
+        user = Users()
+        user.user_id = 324
+        user.first_name = 'Billy'
+        user.last_name = 'Bobtest'
+        user.user_name = 'myUsername'
+        user.last_login_date = timezone.now()
+        user.password_hash = signer.signature('password123')
+        user.salt_hash = salt
+        user.save()
+
+        cls.user = user
+        cls.client = Client()
+
+    def test_presign_bad_method(self):
+        self._login_user('password123')
+
+        url = '/snaplife/api/user/posts/image/presign/'
+        data = json.dumps({'userid': self.user.user_id, 'method': 'get'})
+        resp = self.client.post(url, data, content_type='application/json')
+
+        print('\tpresign_bad_method: {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertEqual(resp.status_code, 400)
+        self.assertContains(resp, 'unknown upload method', status_code=400)
+
+    def test_finalize_foreign_key(self):
+        self._login_user('password123')
+
+        url = '/snaplife/api/user/posts/image/finalize/'
+        data = json.dumps({
+            'userid': self.user.user_id,
+            'postid': 1234,
+            'key': '9991234.png',
+            'message': 'this is a description of our post'
+        })
+        resp = self.client.post(url, data, content_type='application/json')
+
+        print('\tfinalize_foreign_key: {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertEqual(resp.status_code, 400)
+        self.assertContains(resp, 'does not belong', status_code=400)
+
+    def test_finalize_colliding_key(self):
+        self._login_user('password123')
+
+        # user 32 uploading post 41234 used to get the same key as user 324 uploading post 1234
+        url = '/snaplife/api/user/posts/image/finalize/'
+        for key in ('3241234.png', 'uploads/32/41234.png'):
+            data = json.dumps({
+                'userid': self.user.user_id,
+                'postid': 1234,
+                'key': key,
+                'message': 'this is a description of our post'
+            })
+            resp = self.client.post(url, data, content_type='application/json')
+
+            print('\tfinalize_colliding_key: {}: {}'.format(resp.status_code, resp.json()['message']))
+            self.assertContains(resp, 'does not belong', status_code=400)
+
+    @override_settings(STORAGE={'BACKEND': 'lifesnap.storage.MemoryStorage'})
+    def test_finalize_counts_reference(self):
+        self._login_user('password123')
+        key = 'uploads/{}/1234.png'.format(self.user.user_id)
+        get_storage().save(key, BytesIO(b'a presigned png'))
+
+        url = '/snaplife/api/user/posts/image/finalize/'
+        data = json.dumps({
+            'userid': self.user.user_id,
+            'postid': 1234,
+            'key': key,
+            'message': 'this is a description of our post'
+        })
+        resp = self.client.post(url, data, content_type='application/json')
+
+        print('\tfinalize_counts_reference: {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(StoredObjects.objects.get(key=key).refs, 1)
+
+        release([key])
+        self.assertFalse(StoredObjects.objects.filter(key=key).exists())
+        self.assertFalse(get_storage().exists(key))
+
+    def test_create_without_image(self):
+        self._login_user('password123')
+
+        url = '/snaplife/api/user/posts/create/'
+        data = json.dumps({
+            'message': 'this is a "description" of our post',
+            'title': 'a test title!!!',
+            'image': '',
+            'userid': self.user.user_id
+        })
+        resp = self.client.post(url, data, content_type='application/json')
+
+        print('\tcreate_without_image: {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['post']['message'], 'this is a "description" of our post')
+        self.assertEqual(resp.json()['post']['imageurl'], '')
+
+    def test_create_bad_image(self):
+        self._login_user('password123')
+
+        url = '/snaplife/api/user/posts/create/'
+        data = json.dumps({
+            'image': 'abc',
+            'message': 'this is a description of our post',
+            'userid': self.user.user_id
+        })
+        resp = self.client.post(url, data, content_type='application/json')
+
+        print('\tcreate_bad_image: {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertEqual(resp.status_code, 400)
+        self.assertContains(resp, 'b64 decode error', status_code=400)
+
+
+@tag('userpost')
+@skipIf(Image is None, 'Pillow is not installed')
+class UserPostImageVariants(TestCase):
+    """ make sure the image variants are resized and re-encoded """
+    def test_render_variants(self):
+        # the pool process opens the original by path, it is never pickled to it
+        with TemporaryDirectory() as directory:
+            original = os.path.join(directory, 'original.png')
+            Image.new('RGBA', (1200, 600), (255, 0, 0, 255)).save(original, format='PNG')
+
+            variants = render_variants(original, [160, 480, 1080, 2000], 'webp', 80)
+
+        print('\trender_variants: widths {}'.format(sorted(variants)))
+        self.assertEqual(sorted(variants), [160, 480, 1080])
+        with Image.open(BytesIO(variants[480])) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (480, 240))
+
+    def test_variant_key(self):
+        self.assertEqual(variant_key('3241234.png', 480, 'webp'), '3241234_480.webp')
+        self.assertEqual(variant_key('profilepic/myUsername.png', 160, 'jpeg'), 'profilepic/myUsername_160.jpg')
+
+
+@tag('userpost')
+class UserPostImageUploadQueue(TestCase):
+    """ make sure an image that can't be uploaded ends up as a dead letter """
+    def test_upload_failure(self):
+        post = Posts()
+        post.post_id = 1234
+        post.image_name = '3241234.png'
+        post.image_status = 'pending'
+        post.message = 'some post message'
+        post.save()
+
+        with TemporaryDirectory() as dead_letters, override_settings(IMAGE_UPLOAD_DEAD_LETTER_DIR=dead_letters):
+            job = PostImageUpload(post, BytesIO(b'not really a png'))
+            job.attempts = 4
+            job._fail(Exception('S3 is down'))
+
+            failure = FailedUploads.objects.get(post=post)
+            post.refresh_from_db()
+
+            print('\tupload_failure: status {}, error {}'.format(post.image_status, failure.error))
+            self.assertEqual(post.image_status, 'failed')
+            self.assertEqual(failure.attempts, 4)
+            self.assertEqual(failure.error, 'S3 is down')
+            with open(failure.file_path, 'rb') as f:
+                self.assertEqual(f.read(), b'not really a png')
+
+    def test_discard_failures(self):
+        with TemporaryDirectory() as dead_letters, override_settings(IMAGE_UPLOAD_DEAD_LETTER_DIR=dead_letters):
+            # two posts of the same image share one kept file
+            posts = []
+            for post_id in (1234, 1235):
+                post = Posts()
+                post.post_id = post_id
+                post.image_name = 'posts/abc.png'
+                post.image_status = 'pending'
+                post.message = 'some post message'
+                post.save()
+                PostImageUpload(post, BytesIO(b'not really a png'))._fail(Exception('S3 is down'))
+                posts.append(post)
+
+            path = FailedUploads.objects.get(post=posts[0]).file_path
+            discard_failures(FailedUploads.objects.filter(post=posts[0]))
+            self.assertTrue(os.path.exists(path))
+
+            # a post deleted before the fix left its row behind, retryuploads drops it with the file
+            posts[1].delete()
+            out = StringIO()
+            call_command('retryuploads', stdout=out)
+
+            print('\tdiscard_failures: {}'.format(out.getvalue().splitlines()[0]))
+            self.assertFalse(FailedUploads.objects.exists())
+            self.assertFalse(os.path.exists(path))
+
+
+@tag('userpost')
+@override_settings(STORAGE={'BACKEND': 'lifesnap.storage.MemoryStorage'}, IMAGE_VARIANT_WIDTHS=[])
+class UserPostImageStorage(TestCase):
+    """ make sure identical images are stored once and removed with their last reference """
+    def _upload(self, post_id: int, image: bytes) -> Posts:
+        post = Posts()
+        post.post_id = post_id
+        post.image_name = content_key(BytesIO(image), prefix='posts/')
+        post.image_status = 'pending'
+        post.message = 'some post message'
+        post.save()
+
+        PostImageUpload(post, BytesIO(image)).run()
+        post.refresh_from_db()
+        return post
+
+    def test_dedupe(self):
+        first = self._upload(1234, b'the same png')
+        second = self._upload(1235, b'the same png')
+        stored = StoredObjects.objects.get(key=first.image_name)
+
+        print('\tdedupe: {} refs to {}'.format(stored.refs, stored.key))
+        self.assertEqual(first.image_status, 'ready')
+        self.assertEqual(first.image_name, second.image_name)
+        self.assertEqual(first.image_url, 'memory://{}'.format(first.image_name))
+        self.assertEqual(stored.refs, 2)
+        self.assertEqual(get_storage().objects[first.image_name], b'the same png')
+
+        self.assertEqual(release([first.image_name]), [])
+        self.assertTrue(get_storage().exists(first.image_name))
+        self.assertEqual(release([second.image_name]), [second.image_name])
+        self.assertFalse(get_storage().exists(first.image_name))
+        self.assertFalse(StoredObjects.objects.filter(key=first.image_name).exists())
+
+    def test_release_duplicates(self):
+        # deleting two posts that share an image releases its key twice
+        first = self._upload(1234, b'the same png')
+        self._upload(1235, b'the same png')
+        self._upload(1236, b'the same png')
+
+        self.assertEqual(release([first.image_name, first.image_name]), [])
+        stored = StoredObjects.objects.get(key=first.image_name)
+        print('\trelease_duplicates: {} refs left'.format(stored.refs))
+        self.assertEqual(stored.refs, 1)
+
+        self.assertEqual(release([first.image_name]), [first.image_name])
+        self.assertFalse(get_storage().exists(first.image_name))
+        self.assertFalse(StoredObjects.objects.filter(key=first.image_name).exists())
+
+        self._upload(1237, b'another png')
+        other = self._upload(1238, b'another png')
+        self.assertEqual(release([other.image_name] * 3), [other.image_name])
+        self.assertFalse(get_storage().exists(other.image_name))
+
+    def test_finish_database_error(self):
+        # the first update, pointing the post at its image, fails like an over long url would on postgres
+        filter_posts = Posts.objects.filter
+
+        def failing_filter(*args, **kwargs):
+            Posts.objects.filter = filter_posts
+            raise DataError('value too long for type character varying(100)')
+
+        Posts.objects.filter = failing_filter
+        self.addCleanup(setattr, Posts.objects, 'filter', filter_posts)
+
+        with TemporaryDirectory() as dead_letters, override_settings(IMAGE_UPLOAD_DEAD_LETTER_DIR=dead_letters):
+            post = self._upload(1234, b'a png')
+            failure = FailedUploads.objects.get(post=post)
+
+            print('\tfinish_database_error: status {}, error {}'.format(post.image_status, failure.error))
+            self.assertEqual(post.image_status, 'failed')
+            self.assertFalse(StoredObjects.objects.filter(key=post.image_name).exists())
+            self.assertTrue(os.path.exists(failure.file_path))
+
+    def test_local_storage(self):
+        with TemporaryDirectory() as location:
+            storage = LocalStorage(location, base_url='/media/')
+            storage.save('posts/abc.png', BytesIO(b'a local png'))
+
+            print('\tlocal_storage: {}'.format(storage.url('posts/abc.png')))
+            self.assertTrue(storage.exists('posts/abc.png'))
+            self.assertEqual(storage.url('posts/abc.png'), '/media/posts/abc.png')
+
+            storage.delete_many(['posts/abc.png', 'posts/missing.png'])
+            self.assertFalse(storage.exists('posts/abc.png'))
+            with self.assertRaises(ValueError):
+                storage.save('../outside.png', BytesIO(b'nope'))
+
+
+@tag('userpost')
+@override_settings(STORAGE={'BACKEND': 'lifesnap.storage.MemoryStorage'}, IMAGE_BASE_URL='https://cdn.example.com/')
+class UserPostImageURLs(TestCase):
+    """ make sure image URLs are built locally and signed URLs are cached """
+    @override_settings(IMAGE_BASE_URL='https://snap-life.s3.amazonaws.com/')
+    def test_url_fits_column(self):
+        columns = [(Posts._meta.get_field('image_url'), 'posts/'),
+                   (Posts._meta.get_field('author_profile_url'), 'profilepic/'),
+                   (Users._meta.get_field('profile_url'), 'profilepic/')]
+        for field, prefix in columns:
+            url = public_url(content_key(BytesIO(b'a png'), prefix=prefix))
+            print('\turl_fits_column: {} characters for {}'.format(len(url), field.name))
+            self.assertLessEqual(len(url), field.max_length)
+    def test_public_url(self):
+        url = public_url('posts/abc def.png')
+
+        print('\tpublic_url: {}'.format(url))
+        self.assertEqual(url, 'https://cdn.example.com/posts/abc%20def.png')
+        with override_settings(IMAGE_BASE_URL=''):
+            self.assertEqual(public_url('posts/abc.png'), 'memory://posts/abc.png')
+
+    def test_signed_url(self):
+        with override_settings(IMAGE_URL_SIGNED=True, IMAGE_URL_TTL=60):
+            url = image_url('posts/abc.png', 'https://cdn.example.com/posts/abc.png')
+
+            print('\tsigned_url: {}'.format(url))
+            self.assertEqual(url, image_url('posts/abc.png', 'https://cdn.example.com/posts/abc.png'))
+            self.assertEqual(image_url('posts/abc.png', ''), '')
+
+            (path, query) = url[len('https://cdn.example.com'):].split('?')
+            params = dict(param.split('=') for param in query.split('&'))
+            self.assertTrue(check_signature(path, params['expires'], params['signature']))
+            self.assertFalse(check_signature('/posts/other.png', params['expires'], params['signature']))
+
+    def test_signed_cache_size(self):
+        builder = URLBuilder('https://cdn.example.com/', cache_size=2)
+        for key in ('a.png', 'b.png', 'c.png'):
+            builder.signed(key, 60)
+
+        self.assertEqual([key for (key, _) in builder._signed], ['b.png', 'c.png'])
+
+
+class FakeDeleteClient(object):
+    """ stands in for the S3 client, 'slow' keys fail once with SlowDown, 'denied' keys always fail """
+    def __init__(self):
+        self.requests = []
+        self.seen = set()
+        self.lock = Lock()
+
+    def delete_objects(self, Bucket: str, Delete: dict):
+        keys = [obj['Key'] for obj in Delete['Objects']]
+        with self.lock:
+            retried = self.seen.intersection(keys)
+            self.seen.update(keys)
+            self.requests.append(keys)
+
+        errors = []
+        for key in keys:
+            if key.startswith('denied'):
+                errors.append({'Key': key, 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+            elif key.startswith('slow') and key not in retried:
+                errors.append({'Key': key, 'Code': 'SlowDown', 'Message': 'Please reduce your request rate'})
+        return {'Errors': errors}
+
+
+@tag('userpost')
+class UserPostImageBulkDelete(TestCase):
+    """ make sure bulk deletes are split into batches and per key failures are retried and reported """
+    def test_remove_images(self):
+        aws = AWS('snap-life')
+        aws.s3 = FakeDeleteClient()
+
+        keys = ['{}.png'.format(i) for i in range(2498)] + ['slow.png', 'denied.png']
+        summary = aws.remove_images(keys)
+
+        print('\tremove_images: {} requests, {} deleted, failed {}'.format(
+            len(aws.s3.requests), summary['deleted'], summary['failed']))
+        self.assertEqual(sorted(len(request) for request in aws.s3.requests), [1, 500, 1000, 1000])
+        self.assertIn(['slow.png'], aws.s3.requests)
+        self.assertEqual(summary['deleted'], 2499)
+        self.assertEqual(list(summary['failed']), ['denied.png'])
+
+    @override_settings(STORAGE={'BACKEND': 'lifesnap.storage.MemoryStorage'})
+    def test_purge(self):
+        storage = get_storage()
+        key_name = store(BytesIO(b'a png'), prefix='posts/')
+
+        storage.delete_many = lambda key_names: key_names
+        self.assertEqual(release([key_name]), [])
+        self.assertEqual(StoredObjects.objects.get(key=key_name).refs, 0)
+
+        del storage.delete_many
+        (removed, failed) = purge()
+
+        print('\tpurge: removed {}, failed {}'.format(removed, failed))
+        self.assertEqual(removed, [key_name])
+        self.assertFalse(storage.exists(key_name))
+        self.assertFalse(StoredObjects.objects.filter(key=key_name).exists())
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    """ an email backend whose mail server is always down """
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('mail server is down')
+
+
+class ClaimCheckingEmailBackend(BaseEmailBackend):
+    """ an email backend that records the outbox rows as they are while the mail is sent """
+    seen = []
+
+    def send_messages(self, email_messages):
+        ClaimCheckingEmailBackend.seen.extend(OutboxEmails.objects.values_list('status', 'next_attempt'))
+        return len(email_messages)
+
+
+@tag('userpost')
+@override_settings(EMAIL_OUTBOX_WORKER=False, EMAIL_HOST_USER='admin@snaplife.test')
+class UserPostOutbox(TestCase):
+    """ make sure queued emails are sent in batches and failures are retried """
+    def test_resume_after_restart(self):
+        class Worker(object):
+            woken = 0
+
+            def wake(self):
+                self.woken += 1
+
+        self.addCleanup(setattr, outbox, 'worker', outbox.worker)
+        outbox.worker = Worker()
+
+        with override_settings(EMAIL_OUTBOX_WORKER=True):
+            self.assertFalse(outbox.resume_pending())
+
+            # a retry left over from the last run, nothing queues a new email to wake the worker
+            queue_email('SnapLife post reported', 'thank you', ['reporter@snaplife.test'])
+            self.assertTrue(outbox.resume_pending())
+
+        print('\tresume_after_restart: worker woken {} times'.format(outbox.worker.woken))
+        self.assertEqual(outbox.worker.woken, 1)
+        self.assertFalse(outbox.resume_pending())
+    def test_send_queued(self):
+        queue_email('SnapLife post reported', 'thank you', ['reporter@snaplife.test'])
+        queue_email('nobody to send to', 'dropped', [None])
+        self.assertEqual(queue_depth()['due'], 1)
+
+        sent = worker.send_due()
+        worker.close()
+
+        print('\tsend_queued: sent {}, outbox {}'.format(sent, len(mail.outbox)))
+        self.assertEqual(sent, 1)
+        self.assertEqual(mail.outbox[0].to, ['reporter@snaplife.test'])
+        self.assertEqual(mail.outbox[0].from_email, 'admin@snaplife.test')
+        self.assertEqual(OutboxEmails.objects.get().status, 'sent')
+        self.assertEqual(queue_depth()['queued'], 0)
+
+    @override_settings(EMAIL_BACKEND='post.tests.FailingEmailBackend', EMAIL_MAX_ATTEMPTS=2)
+    def test_send_failure(self):
+        email = queue_email('SnapLife post reported', 'thank you', ['reporter@snaplife.test'])
+
+        worker.send_due()
+        email.refresh_from_db()
+        print('\tsend_failure: {} after {} attempts, {}'.format(email.status, email.attempts, email.last_error))
+        self.assertEqual(email.status, 'queued')
+        self.assertEqual(queue_depth(), {'queued': 1, 'due': 0, 'failed': 0})
+
+        OutboxEmails.objects.update(next_attempt=timezone.now())
+        worker.send_due()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'failed')
+        self.assertEqual(email.attempts, 2)
+        self.assertEqual(email.last_error, 'mail server is down')
+
+    @override_settings(EMAIL_BACKEND='post.tests.ClaimCheckingEmailBackend', EMAIL_SEND_LEASE=300)
+    def test_send_claimed(self):
+        email = queue_email('SnapLife post reported', 'thank you', ['reporter@snaplife.test'])
+        ClaimCheckingEmailBackend.seen = []
+
+        # the batch is claimed and leased before the mail server is called, not locked while it answers
+        worker.send_due()
+        worker.close()
+        ((status, lease),) = ClaimCheckingEmailBackend.seen
+        print('\tsend_claimed: {} while sending'.format(status))
+        self.assertEqual(status, 'sending')
+        self.assertGreater(lease, timezone.now())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+
+        # a worker that died mid batch leaves its rows claimed until the lease runs out
+        OutboxEmails.objects.update(status='sending', next_attempt=timezone.now() + timedelta(seconds=60))
+        self.assertEqual(worker.send_due(), 0)
+        OutboxEmails.objects.update(next_attempt=timezone.now())
+        self.assertEqual(worker.send_due(), 1)
+        worker.close()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 2))
+
+
+@tag('userpost')
+@override_settings(EMAIL_OUTBOX_WORKER=False, EMAIL_HOST_USER='admin@snaplife.test')
+class UserPostReports(TestCase):
+    """ make sure a post is counted once per reporter and new reports are sent as one digest """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+
+    def _post(self, post_id: int) -> Posts:
+        post = Posts()
+        post.post_id = post_id
+        post.message = 'some post message'
+        post.author_username = 'myUsername'
+        post.save()
+        return post
+
+    def _report(self, post: Posts, email: str):
+        data = json.dumps({'postid': post.post_id, 'email': email, 'reason': 'offensive post'})
+        return self.client.post('/snaplife/api/user/posts/report/', data, content_type='application/json')
+
+    def test_report_once(self):
+        post = self._post(1234)
+        self._report(post, 'one@snaplife.test')
+        resp = self._report(post, 'ONE@snaplife.test')
+
+        print('\treport_once: {}: {}'.format(resp.json()['message'], resp.json()['count']))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['message'], 'already reported')
+        self.assertEqual(self._report(post, 'two@snaplife.test').json()['count'], 2)
+        self.assertEqual(self._report(post, '').status_code, 400)
+
+    def test_bad_reporter(self):
+        post = self._post(1234)
+        resp = self._report(post, 'not an email')
+
+        print('\tbad_reporter: {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertContains(resp, 'not a valid email address', status_code=400)
+        self.assertContains(self._report(post, '{}@snaplife.test'.format('a' * 300)), 'at most 254 characters', status_code=400)
+        self.assertFalse(Reports.objects.exists())
+        self.assertFalse(OutboxEmails.objects.exists())
+
+    @override_settings(REPORT_HIDE_THRESHOLD=2)
+    def test_auto_hide(self):
+        user = Users(user_id=324, first_name='Billy', last_name='Bobtest', user_name='myUsername',
+                     password_hash='hash', salt_hash='salt', email='billy@snaplife.test', last_login_date=timezone.now())
+        user.save()
+        post = self._post(1234)
+        user.posts_set.add(post)
+
+        self._report(post, 'one@snaplife.test')
+        resp = self.client.get('/snaplife/api/user/friend/snapshot/myUsername/')
+        self.assertEqual(resp.json()['postcount'], 1)
+
+        self._report(post, 'two@snaplife.test')
+        post.refresh_from_db()
+        resp = self.client.get('/snaplife/api/user/friend/snapshot/myUsername/')
+
+        print('\tauto_hide: {}, snapshot postcount {}'.format(post.visibility, resp.json()['postcount']))
+        self.assertEqual(post.visibility, 'hidden')
+        self.assertEqual(resp.json()['postcount'], 0)
+        self.assertEqual(resp.json()['posts'], [])
+
+        set_visibility(post.post_id, 'visible')
+        self._report(post, 'three@snaplife.test')
+        post.refresh_from_db()
+        self.assertEqual(post.visibility, 'visible')
+
+    def test_digest(self):
+        slow = self._post(1234)
+        fast = self._post(1235)
+        self._report(slow, 'one@snaplife.test')
+        for i in range(3):
+            self._report(fast, 'reporter{}@snaplife.test'.format(i))
+
+        queue = moderation_queue()
+        self.assertEqual([entry['post'].post_id for entry in queue], [1235, 1234])
+        self.assertEqual(queue[0]['recent'], 3)
+
+        self.assertEqual(send_report_digest(), 4)
+        self.assertEqual(send_report_digest(), 0)
+
+        digest = OutboxEmails.objects.get(subject__startswith='SnapLife report digest')
+        print('\tdigest: {}'.format(digest.subject))
+        self.assertIn('admin@snaplife.test', digest.recipients)
+        self.assertLess(digest.body.index('Post ID 1235'), digest.body.index('Post ID 1234'))
+        self.assertFalse(Reports.objects.filter(notified=False).exists())
+
+
+@tag('userpost')
+class UserPostJSONResponse(TestCase):
+    """ make sure responses are encoded once and cached fragments come out as the same json """
+    def test_fragments(self):
+        cache = FragmentCache(maxsize=1)
+        post = dict({'postid': 1234, 'message': 'a "quoted" \u0000 message', 'variants': {480: 'url'}})
+        resp = JSONResponse.new(code=200, message='success', posts=[cache.get(1234, lambda: post), 'plain'])
+
+        print('\tfragments: {} {}'.format(resp['Content-Type'], resp.content))
+        self.assertEqual(resp['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(resp.content.decode('utf-8')), {
+            'message': 'success',
+            'posts': [{'postid': 1234, 'message': 'a "quoted" \u0000 message', 'variants': {'480': 'url'}}, 'plain']
+        })
+        self.assertIs(cache.get(1234, lambda: None), cache.get(1234, lambda: None))
+
+    def test_stdlib_fallback(self):
+        payload = dict({
+            'date': datetime(2017, 6, 24, 10, 30, 5, 123, tzinfo=timezone.utc),
+            'day': datetime(2017, 6, 24).date(),
+            'id': UUID(int=5),
+            'variants': {480: 'url'},
+            'post': JSONFragment({'postid': 1234})
+        })
+        with_orjson = util.encode_json(payload)
+
+        previous = util.orjson
+        util.orjson = None
+        try:
+            fallback = util.encode_json(payload)
+        finally:
+            util.orjson = previous
+
+        print('\tstdlib_fallback: {}'.format(fallback))
+        self.assertEqual(json.loads(fallback.decode('utf-8')), {
+            'date': '2017-06-24T10:30:05.000123+00:00',
+            'day': '2017-06-24',
+            'id': '00000000-0000-0000-0000-000000000005',
+            'variants': {'480': 'url'},
+            'post': {'postid': 1234}
+        })
+        if previous is not None:
+            self.assertEqual(json.loads(fallback.decode('utf-8')), json.loads(with_orjson.decode('utf-8')))
+
+
+@tag('userpost')
+class UserPostSerializer(TestCase):
+    """ make sure posts built from values_list rows match the dicts built from model objects """
+    def setUp(self):
+        for post_id in (1234, 1235):
+            post = Posts()
+            post.post_id = post_id
+            post.message = 'post message {}'.format(post_id)
+            post.message_title = 'title {}'.format(post_id)
+            post.author_username = 'myUsername'
+            post.image_name = 'posts/{}.png'.format(post_id)
+            post.image_url = 'https://snap-life.s3.amazonaws.com/posts/{}.png'.format(post_id)
+            post.save()
+
+            # one comment each, comments made on the same day have no set order
+            Comments(comment_id=post_id, author_id=1, author_name='commenter', message='a comment', post=post).save()
+
+    def test_feed(self):
+        with self.assertNumQueries(2):
+            posts = serialize_posts(Posts.objects.all(), FEED_FIELDS, comments=True)
+
+        expected = [dict({
+            'postid': post.post_id,
+            'message': post.message,
+            'title': post.message_title,
+            'views': post.view_count,
+            'likes': post.like_count,
+            'imageurl': post.image_url,
+            'variants': {},
+            'imagestatus': post.image_status,
+            'date': post.creation_date.isoformat(),
+            'author': post.author_username,
+            'authoravatar': post.author_profile_url,
+            'comments': [dict({
+                'message': comment.message,
+                'author': comment.author_name,
+                'date': comment.creation_date.isoformat()
+            }) for comment in post.comments_set.all()]
+        }) for post in Posts.objects.all()]
+
+        print('\tfeed: {}'.format(posts[0]))
+        self.assertEqual(posts, expected)
+        self.assertEqual(list(posts[0]), list(expected[0]))
+        self.assertEqual(serialize_post(Posts.objects.get(post_id=1234), FEED_FIELDS, comments=True), expected[-1])
+
+    def test_fields(self):
+        posts = serialize_posts(Posts.objects.filter(post_id=1234), SNAPSHOT_FIELDS)
+        self.assertEqual(list(posts[0]), list(SNAPSHOT_FIELDS))
+        self.assertEqual(posts[0]['url'], 'https://snap-life.s3.amazonaws.com/posts/1234.png')
+
+        fragments = serialize_posts(Posts.objects.filter(post_id=1234), SNAPSHOT_FIELDS, fragments=True)
+        self.assertIsInstance(fragments[0], JSONFragment)
+        self.assertEqual(json.loads(fragments[0].encoded.decode('utf-8')), posts[0])
+
+        with self.assertRaises(ValueError):
+            serialize_posts(Posts.objects.all(), ('postid', 'password'))
+
+
+@tag('userpost')
+class UserPostBatch(TestCase):
+    """ make sure the batch endpoints answer for many ids with one query each """
+    def setUp(self):
+        for post_id in (1234, 1235):
+            post = Posts(post_id=post_id, message='post message', author_username='myUsername', like_count=post_id % 10)
+            post.save()
+            Comments(comment_id=post_id, author_id=1, author_name='commenter', message='a comment', like_count=3, post=post).save()
+
+    def test_batch(self):
+        with self.assertNumQueries(1):
+            resp = self.client.get('/snaplife/api/user/posts/like/batch/1234,1235,99/')
+        print('\tbatch likes: {}'.format(resp.content))
+        self.assertEqual(json.loads(resp.content.decode('utf-8')), {
+            'message': 'success',
+            'likes': {'1234': 4, '1235': 5},
+            'missing': [99]
+        })
+
+        with self.assertNumQueries(1):
+            resp = self.client.get('/snaplife/api/user/posts/comment/count/batch/1234,1235/')
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['counts'], {'1234': 1, '1235': 1})
+
+        with self.assertNumQueries(1):
+            resp = self.client.get('/snaplife/api/user/posts/comment/count/like/batch/1234,1235/')
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['likes'], {'1234': 3, '1235': 3})
+
+        resp = self.client.get('/snaplife/api/user/posts/batch/1235,1234/')
+        posts = json.loads(resp.content.decode('utf-8'))['posts']
+        self.assertEqual(sorted(posts), ['1234', '1235'])
+        self.assertEqual(posts['1234']['author'], 'myUsername')
+
+        with self.settings(BATCH_MAX_IDS=1):
+            resp = self.client.get('/snaplife/api/user/posts/like/batch/1234,1235/')
+        self.assertEqual(resp.status_code, 400)
+
+
+@tag('userpost')
+class UserPostMultiplex(TestCase):
+    """ make sure a batch request calls every endpoint and returns their json in order """
+    def test_batch_request(self):
+        Posts(post_id=1234, message='post message', author_username='myUsername', like_count=7).save()
+        data = json.dumps({'requests': [
+            {'path': '/snaplife/api/user/posts/like/1234/'},
+            {'method': 'POST', 'path': '/snaplife/api/user/posts/report/', 'body': {'postid': 1234}},
+            {'path': '/snaplife/api/user/posts/like/batch/1234,99/?unused=1'},
+            {'path': '/snaplife/api/user/nothing/here/'}
+        ]})
+        resp = self.client.post('/snaplife/api/batch/', data, content_type='application/json')
+        responses = json.loads(resp.content.decode('utf-8'))['responses']
+
+        print('\tbatch request: {}'.format([item['status'] for item in responses]))
+        self.assertEqual([item['status'] for item in responses], [200, 400, 200, 404])
+        self.assertEqual(responses[0]['body'], {'message': 'success', 'postid': 1234, 'likecount': 7})
+        self.assertEqual(responses[1]['body']['message'], 'email is required to report a post')
+        self.assertEqual(responses[2]['body']['missing'], [99])
+        self.assertIsNone(responses[3]['body'])
+
+        data = json.dumps({'requests': [{'path': '/snaplife/api/batch/'}]})
+        resp = self.client.post('/snaplife/api/batch/', data, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+
+@tag('userpost')
+@override_settings(NOTIFY_CHANNEL={'BACKEND': 'lifesnap.notifications.LocalChannel'}, NOTIFY_POLL_SECONDS=5)
+class UserPostNotify(TestCase):
+    """ make sure a follower waiting on posts/notify/ hears about new posts from the users they follow """
+    def setUp(self):
+        users = []
+        for (user_id, username) in ((324, 'myUsername'), (325, 'friendUsername'), (326, 'strangerUsername')):
+            user = Users(user_id=user_id, first_name='Billy', last_name='Bobtest', user_name=username,
+                         password_hash='hash{}'.format(user_id), salt_hash='salt{}'.format(user_id),
+                         email='{}@snaplife.test'.format(username), last_login_date=timezone.now())
+            user.save()
+            users.append(user)
+        (self.user, self.friend, self.stranger) = users
+        self.user.following.add(self.friend)
+
+    def test_long_poll(self):
+        channel = get_channel()
+        Timer(0.1, channel.publish, args=(self.stranger.pk, 99)).start()
+        Timer(0.2, channel.publish, args=(self.friend.pk, 1234)).start()
+
+        resp = self.client.get('/snaplife/api/user/posts/notify/324/')
+        print('	long poll: {}'.format(resp.content))
+        self.assertEqual(resp.json()['postids'], [1234])
+        self.assertEqual(channel.listener_count(), 0)
+
+        resp = self.client.get('/snaplife/api/user/posts/notify/324/?wait=0.1')
+        self.assertEqual(resp.json()['postids'], [])
+
+    def test_bad_wait(self):
+        for wait in ('nan', 'inf', '-inf', 'soon'):
+            resp = self.client.get('/snaplife/api/user/posts/notify/324/?wait={}'.format(wait))
+            print('\tbad wait: {} {}'.format(wait, resp.status_code))
+            self.assertContains(resp, 'is not a number', status_code=400)
+
+        resp = self.client.get('/snaplife/api/user/posts/notify/324/?wait=-5')
+        self.assertEqual(resp.json()['postids'], [])
+        with get_channel().subscribe([self.friend.pk]) as subscription:
+            self.assertEqual(subscription.get(float('nan')), [])
+
+    @override_settings(NOTIFY_STREAM_SECONDS=0.5, NOTIFY_KEEPALIVE_SECONDS=0.2)
+    def test_event_stream(self):
+        channel = get_channel()
+        Timer(0.1, channel.publish, args=(self.friend.pk, 1234)).start()
+
+        resp = self.client.get('/snaplife/api/user/posts/notify/324/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        events = b''.join(resp.streaming_content).decode('utf-8')
+        print('	event stream: {!r}'.format(events))
+        self.assertTrue(events.startswith('retry: 3000\n\n'))
+        self.assertIn('event: posts\ndata: {"postids": [1234]}\n\n', events)
+        self.assertIn(': keepalive\n\n', events)
+        self.assertEqual(channel.listener_count(), 0)
+
+    @override_settings(NOTIFY_MAX_LISTENERS=1, NOTIFY_STREAM_SECONDS=0.2)
+    def test_listener_limit(self):
+        # an open stream holds the only slot until its response is closed
+        stream = self.client.get('/snaplife/api/user/posts/notify/324/', HTTP_ACCEPT='text/event-stream')
+        resp = self.client.get('/snaplife/api/user/posts/notify/324/?wait=0')
+
+        print('\tlistener limit: {} retry after {}'.format(resp.status_code, resp['Retry-After']))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp['Retry-After'], '3')
+
+        b''.join(stream.streaming_content)
+        self.assertEqual(self.client.get('/snaplife/api/user/posts/notify/324/?wait=0').status_code, 200)
+        # the long poll gave its slot back too, and so does a stream that is closed without being read
+        unread = self.client.get('/snaplife/api/user/posts/notify/324/', HTTP_ACCEPT='text/event-stream')
+        unread.close()
+        self.assertEqual(self.client.get('/snaplife/api/user/posts/notify/324/?wait=0').status_code, 200)
@@ -1,14 +1,20 @@
 """ post urls """
 from post.views import (
     PostCreate,
+    PostImagePresign,
+    PostImageFinalize,
     PostDelete,
     PostUpdate,
     PostSearchTitle,
     PostSearchDate,
     PostSearchUser,
+    PostNotify,
     PostLike,
     PostReport,
-    PostCommentCount
+    PostCommentCount,
+    PostBatch,
+    PostLikeBatch,
+    PostCommentCountBatch
 )
 from django.conf.urls import url
 
@@ -17,12 +23,18 @@ app_name = 'post'
 
 urlpatterns = [
     url(r'^create/$', PostCreate.as_view(), name='create'),
+    url(r'^image/presign/$', PostImagePresign.as_view(), name='imagepresign'),
+    url(r'^image/finalize/$', PostImageFinalize.as_view(), name='imagefinalize'),
     url(r'^delete/$', PostDelete.as_view(), name='delete'),
     url(r'^update/$', PostUpdate.as_view(), name='update'),
     url(r'^report/$', PostReport.as_view(), name='report'),
     url(r'^like/$', PostLike.as_view(), name='getlike'),
     url(r'^like/(?P<postid>[0-9]+)/$', PostLike.as_view(), name='updatelike'),
     url(r'^comment/count/(?P<postid>[0-9]+)/$', PostCommentCount.as_view(), name='commentcount'),
+    url(r'^notify/(?P<userid>[0-9]+)/$', PostNotify.as_view(), name='notify'),
+    url(r'^batch/(?P<postids>[0-9,]+)/$', PostBatch.as_view(), name='batch'),
+    url(r'^like/batch/(?P<postids>[0-9,]+)/$', PostLikeBatch.as_view(), name='likebatch'),
+    url(r'^comment/count/batch/(?P<postids>[0-9,]+)/$', PostCommentCountBatch.as_view(), name='commentcountbatch'),
     url(r'^search/title/(?P<userid>[0-9]+)/(?P<title>[\W\w]+)/(?P<count>[0-9]+)/$', PostSearchTitle.as_view(), name='searchtitle'),
     url(r'^search/range/(?P<userid>[0-9]+)/(?P<time_stamp>[0-9]+)/(?P<count>[0-9]+)/$', PostSearchDate.as_view(), name='searchdate'),
     url(r'^search/user/(?P<userid>[0-9]+)/(?P<count>[0-9]+)/$', PostSearchUser.as_view(), name='searchuser')
@@ -1,15 +1,27 @@
 import json
+import math
 from uuid import uuid4
+from contextlib import ExitStack
 from datetime import datetime
-from lifesnap.aws import AWS
-from lifesnap.util import JSONResponse
-
-from user.models import Users
-from post.models import Posts
+from lifesnap.util import JSONResponse, parse_ids
+from lifesnap.storage import content_key, get_storage, register, release_later
+from lifesnap.image_urls import public_url
+from lifesnap.upload import read_json_upload
+from lifesnap.derivatives import variant_keys
+from lifesnap.serializers import FEED_FIELDS, SUMMARY_FIELDS, serialize_post, serialize_posts
+from lifesnap.upload_queue import discard_failures, queue_post_image
+from lifesnap.outbox import queue_email
+from lifesnap.moderation import report_post
+from lifesnap.versions import content_etag, not_modified, set_etag
+from lifesnap.notifications import EventStream, acquire_listener, notify_new_post, release_listener, wait
+from lifesnap.profiles import USER_ID, resolve_user
+
+from post.models import FailedUploads, Posts
 from django.views import View
 from django.conf import settings
-from django.core.mail import send_mail
-from django.http import HttpRequest
+from django.db import connection, transaction
+from django.http import HttpRequest, StreamingHttpResponse
+from django.db.models import Count
 from django.core.exceptions import ObjectDoesNotExist
 
 
@@ -24,17 +36,30 @@ class PostCreate(View):
         }
     """
     def post(self, request: HttpRequest):
-        S3 = AWS('snap-life')
-
+        # the image is decoded straight from the request stream, the body is never buffered whole
         try:
-            req_json = json.loads(request.body.decode('UTF-8'))
+            (req_json, image) = read_json_upload(
+                request,
+                'image',
+                max_bytes=settings.UPLOAD_MAX_BYTES,
+                spool_max=settings.UPLOAD_SPOOL_MAX_BYTES
+            )
         except json.JSONDecodeError:
             return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        # the spooled image is closed on every way out, until the upload queue takes it over
+        with ExitStack() as cleanup:
+            if image is not None:
+                cleanup.callback(image.close)
+            return self._create(req_json, image, cleanup)
 
+    def _create(self, req_json: dict, image, cleanup: ExitStack):
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid', ''))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
-            return JSONResponse.new(code=400, message='user id {} is not found.'.format(req_json['userid']))
+            return JSONResponse.new(code=400, message='user id {} is not found.'.format(req_json.get('userid')))
 
         if user.is_active is False:
             return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
@@ -45,33 +70,154 @@ class PostCreate(View):
         new_post.author_username = user.user_name
         new_post.author_profile_url = user.profile_url
 
-        if req_json.get('image', None) is not None and len(req_json.get('image', '')) > 0 :
-            image_name = '{}{}.png'.format(user.user_id, new_post.post_id)
-            url = S3.upload_image(image_name, req_json.get('image'))
-
-            new_post.image_name = image_name
-            new_post.image_url = url
+        if image is not None:
+            # the post is saved right away, the image is uploaded in the background and the
+            # post moves from 'pending' to 'ready' (with imageurl set) once storage has it.
+            # images are stored by content, posting the same image twice only stores it once
+            new_post.image_name = content_key(image, prefix='posts/')
+            new_post.image_status = 'pending'
         else:
             new_post.image_name = ''
-            new_post.image_url = ''
+        new_post.image_url = ''
 
         new_post.message = req_json.get('message')
         new_post.message_title = req_json.get('title', '')
+        # set before the save, so the post_save signal knows the owner (see lifesnap/versions.py)
+        new_post.user = user
         new_post.save()
-        user.posts_set.add(new_post)
-
-        p = dict({
-            'postid': new_post.post_id,
-            'message': new_post.message,
-            'title': new_post.message_title,
-            'views': new_post.view_count,
-            'likes': new_post.like_count,
-            'imageurl': new_post.image_url,
-            'date': new_post.creation_date.isoformat(),
-            'author': new_post.author_username,
-            'authoravatar': new_post.author_profile_url,
-            'comments': []
-        })
+        notify_new_post(new_post)
+
+        if image is not None:
+            # from here on the queue owns the image and closes it
+            cleanup.pop_all()
+            queue_post_image(new_post, image)
+
+        # a new post has no comments yet
+        p = dict(serialize_post(new_post, FEED_FIELDS), comments=[])
+        return JSONResponse.new(code=200, message='success', post=p)
+
+
+
+def upload_key(user_id: int, post_id: int) -> str:
+    """ the storage key of a presigned post image upload, under the users own prefix so that no
+        other user_id and post_id can make the same key
+    """
+    return 'uploads/{}/{}.png'.format(user_id, post_id)
+
+
+class PostImagePresign(View):
+    """ a signed in user can ask for a presigned S3 upload, the image is then sent straight to S3
+        instead of base64 encoded inside the PostCreate json. Finish with PostImageFinalize.
+        POST: required json object {
+            'userid': the users user_id,
+            'method': optional, 'post' (default) for a form upload or 'put' to PUT the raw bytes
+        }
+        returned json object {
+            'postid': the post id reserved for the new post, send it to PostImageFinalize,
+            'key': the image key, send it to PostImageFinalize,
+            'url': where to send the upload,
+            'fields': form fields to include with a 'post' upload,
+            'headers': headers to include with a 'put' upload
+        }
+    """
+    def post(self, request: HttpRequest):
+        try:
+            req_json = json.loads(request.body.decode('UTF-8'))
+        except json.JSONDecodeError:
+            return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
+
+        try:
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
+        except ObjectDoesNotExist:
+            return JSONResponse.new(code=400, message='user id {} is not found.'.format(req_json.get('userid')))
+
+        if user.is_active is False:
+            return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
+
+        post_id = uuid4().time_mid
+        image_name = upload_key(user.user_id, post_id)
+
+        try:
+            upload = get_storage().presign_upload(
+                image_name,
+                method=req_json.get('method', 'post'),
+                expires=settings.UPLOAD_URL_EXPIRES,
+                max_bytes=settings.UPLOAD_MAX_BYTES
+            )
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        return JSONResponse.new(
+            code=200,
+            message='success',
+            postid=post_id,
+            key=image_name,
+            url=upload['url'],
+            fields=upload['fields'],
+            headers=upload['headers']
+        )
+
+
+class PostImageFinalize(View):
+    """ create the post for an image that was uploaded with a PostImagePresign upload
+        POST: required json object {
+            'userid': the users user_id,
+            'postid': the postid returned by PostImagePresign,
+            'key': the key returned by PostImagePresign,
+            'message': if you want a message with the photo,
+            'title': optional - if you want to title your post
+        }
+        returned json object is the same post object PostCreate returns
+    """
+    def post(self, request: HttpRequest):
+        try:
+            req_json = json.loads(request.body.decode('UTF-8'))
+        except json.JSONDecodeError:
+            return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
+
+        try:
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
+        except ObjectDoesNotExist:
+            return JSONResponse.new(code=400, message='user id {} is not found.'.format(req_json.get('userid')))
+
+        if user.is_active is False:
+            return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
+
+        try:
+            post_id = int(req_json.get('postid'))
+        except (TypeError, ValueError):
+            return JSONResponse.new(code=400, message='postid {} is not valid'.format(req_json.get('postid')))
+
+        # the key is derived from the user and post ids, so a user can only attach their own uploads
+        image_name = req_json.get('key', '')
+        if image_name != upload_key(user.user_id, post_id):
+            return JSONResponse.new(code=400, message='key {} does not belong to user {}'.format(image_name, user.user_id))
+
+        if Posts.objects.filter(post_id__exact=post_id).exists():
+            return JSONResponse.new(code=400, message='postid {} already exists'.format(post_id))
+
+        storage = get_storage()
+        if not storage.exists(image_name):
+            return JSONResponse.new(code=400, message='image {} has not been uploaded'.format(image_name))
+
+        new_post = Posts()
+        new_post.post_id = post_id
+        new_post.author_username = user.user_name
+        new_post.author_profile_url = user.profile_url
+        new_post.image_name = image_name
+        new_post.image_url = public_url(image_name)
+        new_post.message = req_json.get('message')
+        new_post.message_title = req_json.get('title', '')
+        # set before the save, so the post_save signal knows the owner (see lifesnap/versions.py)
+        new_post.user = user
+        with transaction.atomic():
+            new_post.save()
+            # counted like a stored image, release() then only removes it with its last reference
+            register(image_name)
+        notify_new_post(new_post)
+
+        # a new post has no comments yet
+        p = dict(serialize_post(new_post, FEED_FIELDS), comments=[])
         return JSONResponse.new(code=200, message='success', post=p)
 
 
@@ -86,15 +232,13 @@ class PostDelete(View):
         if both postid and title is present, postid will be prefered.
     """
     def post(self, request: HttpRequest):
-        S3 = AWS('snap-life')
-
         try:
             req_json = json.loads(request.body.decode('UTF-8'))
         except json.JSONDecodeError:
             return JSONResponse.new(code=400, message="request decode error, bad data sent to the server")
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid', ''))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message="userid {} is not found".format(req_json['userid']))
 
@@ -114,12 +258,21 @@ class PostDelete(View):
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='postid {} is not found'.format(req_json['postid']))
 
-        S3.remove_image(key_name=post.image_name)
+        # a pending upload takes its reference when it finishes and drops it again if the post is gone
+        key_names = variant_keys(post.image_variants)
+        if post.image_status == 'ready':
+            key_names.append(post.image_name)
+        failures = list(FailedUploads.objects.filter(post=post).values_list('pk', flat=True))
 
-        for comment in comments:
-            comment.delete()
+        # the images are only released once the delete has committed, a rollback keeps them
+        with transaction.atomic():
+            for comment in comments:
+                comment.delete()
+            post.delete()
+            release_later(key_names)
 
-        post.delete()
+        # the dead letters lost their post, their kept images go too
+        discard_failures(FailedUploads.objects.filter(pk__in=failures))
         return JSONResponse.new(code=200, message='success', postcount=user.posts_set.count())
 
 
@@ -140,7 +293,7 @@ class PostUpdate(View):
             return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json['userid'])
+            user = resolve_user(req_json['userid'], USER_ID, fresh=True)
             post = user.posts_set.get(post_id__exact=req_json['postid'])
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} or postid {} was not found'.format(req_json['userid'], req_json['postid']))
@@ -164,15 +317,7 @@ class PostUpdate(View):
                 return JSONResponse.new(code=400, message='message length incorrect {}'.format(len(new_message)))
 
         post.save(update_fields=['message_title', 'message'])
-        p = dict({
-            'postid': post.post_id,
-            'message': post.message,
-            'title': post.message_title,
-            'views': post.view_count,
-            'likes': post.like_count,
-            'imageurl': post.image_url,
-            'date': post.creation_date.isoformat()
-        })
+        p = serialize_post(post, SUMMARY_FIELDS)
         return JSONResponse.new(code=200, message='success', post=p)
 
 
@@ -190,6 +335,8 @@ class PostSearchTitle(View):
                 'views': view count,
                 'likes': like count,
                 'imageurl': the http url where the image can be found,
+                'variants': {width: url} smaller copies of the image, filled in once they are made,
+                'imagestatus': 'pending' while the image is uploading, 'ready' or 'failed',
                 'date': the date the post was created
             }]
         }
@@ -200,28 +347,18 @@ class PostSearchTitle(View):
             count *= -1
 
         try:
-            user = Users.objects.get(user_id__exact=userid)
+            user = resolve_user(userid, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} is not found'.format(userid))
 
-        post_count = user.posts_set.count()
+        # hidden (reported) posts are left out, the partial index on visible posts covers these queries
+        visible_posts = user.posts_set.filter(visibility='visible')
+        post_count = visible_posts.count()
         if count >= post_count:
             count = post_count - 1
 
-        posts = user.posts_set.filter(message_title__icontains=title)[:count]
-        post_list = []
-
-        for post in posts:
-            p = dict({
-                'postid': post.post_id,
-                'message': post.message,
-                'title': post.message_title,
-                'views': post.view_count,
-                'likes': post.like_count,
-                'imageurl': post.image_url,
-                'date': post.creation_date.isoformat()
-            })
-            post_list.append(p)
+        posts = visible_posts.filter(message_title__icontains=title)[:count]
+        post_list = serialize_posts(posts, SUMMARY_FIELDS, fragments=True)
         return JSONResponse.new(code=200, message='success', posts=post_list)
 
 
@@ -239,6 +376,8 @@ class PostSearchUser(View):
                 'views': view count,
                 'likes': like count,
                 'imageurl': the http url where the image can be found,
+                'variants': {width: url} smaller copies of the image, filled in once they are made,
+                'imagestatus': 'pending' while the image is uploading, 'ready' or 'failed',
                 'date': the date the post was created
             }]
         }
@@ -249,43 +388,86 @@ class PostSearchUser(View):
             count *= -1
 
         try:
-            user = Users.objects.get(user_id__exact=userid)
+            user = resolve_user(userid, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} is not found'.format(userid))
 
-        posts = user.posts_set.all()
-        post_list = []
-
-        for follow in user.following.all():
-            following_posts = follow.posts_set.all()
-            posts = posts | following_posts
+        # the feed only changes when the content version of the user or someone they follow does
+        etag = content_etag(user, 'feed', count, following=True)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        # one query for the user and everyone they follow, hidden (reported) posts are left out
+        user_ids = [user.pk] + list(user.following.values_list('pk', flat=True))
+        posts = Posts.objects.filter(user_id__in=user_ids, visibility='visible')
+        # the comments of the whole page come from one query
+        post_list = serialize_posts(posts[:count], FEED_FIELDS, comments=True)
+
+        response = JSONResponse.new(code=200, message='success', posts=post_list)
+        return set_etag(response, etag)
+
+
+class PostNotify(View):
+    """ wait for new posts from the users someone follows, instead of polling search/user/ for them
+        GET: a long poll, answered as soon as one of them posts or after NOTIFY_POLL_SECONDS, ?wait=seconds
+             waits less. Sent with 'Accept: text/event-stream' the connection stays open for
+             NOTIFY_STREAM_SECONDS as a server-sent events stream, with a 'posts' event for each new batch.
+             Posts made between two polls are not sent, load search/user/ (a 304 while nothing changed)
+             after each reconnect. Once NOTIFY_MAX_LISTENERS clients wait the answer is a 503 with
+             Retry-After, poll again then.
+
+        returned json object, also the data of each 'posts' event: {
+            'postids': [the ids of the new posts, empty when none came in time]
+        }
+    """
+    def get(self, request: HttpRequest, userid: str):
+        try:
+            user = resolve_user(userid, USER_ID)
+        except ObjectDoesNotExist:
+            return JSONResponse.new(code=400, message='userid {} is not found'.format(userid))
 
-        for post in posts[:count]:
-            comment_list = []
-            comments = post.comments_set.all()
+        if user.is_active is False:
+            return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
 
-            for comment in comments:
-                comment_list.append({
-                    'message': comment.message,
-                    'author': comment.author_name,
-                    'date': comment.creation_date.isoformat()
-                })
-
-            p = dict({
-                'postid': post.post_id,
-                'message': post.message,
-                'title': post.message_title,
-                'views': post.view_count,
-                'likes': post.like_count,
-                'imageurl': post.image_url,
-                'date': post.creation_date.isoformat(),
-                'author': post.author_username,
-                'authoravatar': post.author_profile_url,
-                'comments': comment_list
-            })
-            post_list.append(p)
+        user_pks = list(user.following.values_list('pk', flat=True))
+
+        # nothing is read while waiting, the database connection goes back before the wait
+        if not connection.in_atomic_block:
+            connection.close()
+
+        event_stream = 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
+        if not event_stream:
+            try:
+                timeout = float(request.GET.get('wait', settings.NOTIFY_POLL_SECONDS))
+            except ValueError:
+                timeout = math.nan
+            # nan compares false with everything and would get past min(), inf would wait forever
+            if not math.isfinite(timeout):
+                return JSONResponse.new(code=400, message='wait {} is not a number'.format(request.GET.get('wait')))
+            timeout = min(max(timeout, 0), settings.NOTIFY_POLL_SECONDS)
+
+        # every listener holds a thread, the rest of the api keeps the threads beyond NOTIFY_MAX_LISTENERS
+        if not acquire_listener():
+            response = JSONResponse.new(code=503, message='too many listeners, try again later')
+            response['Retry-After'] = '{}'.format(max(1, settings.NOTIFY_RETRY_MILLISECONDS // 1000))
+            return response
+
+        if event_stream:
+            # the slot is given back when the server closes the response
+            response = StreamingHttpResponse(
+                EventStream(user_pks, settings.NOTIFY_STREAM_SECONDS, settings.NOTIFY_KEEPALIVE_SECONDS, settings.NOTIFY_RETRY_MILLISECONDS),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            # nginx would otherwise hold the events back in its buffer
+            response['X-Accel-Buffering'] = 'no'
+            return response
 
-        return JSONResponse.new(code=200, message='success', posts=post_list)
+        try:
+            return JSONResponse.new(code=200, message='success', postids=wait(user_pks, timeout))
+        finally:
+            release_listener()
 
 
 class PostSearchDate(View):
@@ -303,6 +485,8 @@ class PostSearchDate(View):
                 'views': view count,
                 'likes': like count,
                 'imageurl': the http url where the image can be found,
+                'variants': {width: url} smaller copies of the image, filled in once they are made,
+                'imagestatus': 'pending' while the image is uploading, 'ready' or 'failed',
                 'date': the date the post was created
             }]
         }
@@ -313,7 +497,7 @@ class PostSearchDate(View):
             count *= -1
 
         try:
-            user = Users.objects.get(user_id__exact=userid)
+            user = resolve_user(userid, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} is not found'.format(userid))
 
@@ -328,19 +512,7 @@ class PostSearchDate(View):
             count = post_count - 1
 
         posts = user.posts_set.filter(creation_date__date__gt=datetime.date(search_date))[:count]
-        post_list = []
-
-        for post in posts:
-            p = dict({
-                'postid': post.post_id,
-                'message': post.message,
-                'title': post.message_title,
-                'views': post.view_count,
-                'likes': post.like_count,
-                'imageurl': post.image_url,
-                'date': post.creation_date.isoformat()
-            })
-            post_list.append(p)
+        post_list = serialize_posts(posts, SUMMARY_FIELDS, fragments=True)
         return JSONResponse.new(code=200, message='success', posts=post_list)
 
 
@@ -378,7 +550,7 @@ class PostLike(View):
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
             post = Posts.objects.get(post_id__exact=req_json.get('postid'))
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='postid {} is not found'.format(req_json.get('postid')))
@@ -394,7 +566,8 @@ class PostLike(View):
 
 #TODO - email is not working, gmail side?
 class PostReport(View):
-    """ report a post, you do not need to be logged in to report
+    """ report a post, you do not need to be logged in to report. Each email address can report a post once,
+        the admin inbox gets the new reports in a digest (manage.py reportdigest)
         required json object {
             'postid': the id of the post that is being reported,
             'reason': the reason the post is being reported,
@@ -412,32 +585,27 @@ class PostReport(View):
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='post {} is not found'.format(req_json.get('postid')))
 
-        post.report_count += 1
-        post.save(update_fields=['report_count'])
+        email = req_json.get('email')
+        if not email or not isinstance(email, str):
+            return JSONResponse.new(code=400, message='email is required to report a post')
+
+        try:
+            reported = report_post(post, email, req_json.get('reason'))
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        if not reported:
+            post.refresh_from_db(fields=['report_count'])
+            return JSONResponse.new(code=200, message='already reported', count=post.report_count)
 
-        # send an email to the reporter
-        send_mail(
+        # the thank you goes through the outbox, it is sent in the background
+        queue_email(
             'SnapLife post reported',
             'Thank you for reporting post {}. This post will now be under review'.format(post.message_title),
-            settings.EMAIL_HOST_USER,
-            [req_json.get('email')],
-            fail_silently=True
-        )
-        send_mail(
-            'Report for post ID {}, post name {}'.format(post.post_id, post.image_name),
-            'Reported by {}\nReport count: {}\nMessage: {}\n Author: {}\nURL: {}'.format(
-                req_json.get('email'),
-                post.report_count,
-                post.message,
-                post.author_username,
-                post.image_url
-            ),
-
-            settings.EMAIL_HOST_USER,
-            [settings.EMAIL_HOST_USER],
-            fail_silently=True
+            [email]
         )
 
+        post.refresh_from_db(fields=['report_count'])
         return JSONResponse.new(code=200, message='success', count=post.report_count)
 
 
@@ -463,3 +631,77 @@ class PostCommentCount(View):
             comment_list.append(comment.comment_id)
 
         return JSONResponse.new(code=200, message='success', count=count, commentids=comment_list)
+
+
+class PostBatch(View):
+    """ the posts for a list of post ids, in one query
+        GET: /batch/(postids)/ postids: up to BATCH_MAX_IDS ids separated by commas, 12,34,56
+        returned json object {
+            'posts': {postid: post object, the same object PostSearchUser returns without the comments},
+            'missing': the postids that were not found or are hidden
+        }
+    """
+    def get(self, request: HttpRequest, postids: str):
+        try:
+            postids = parse_ids(postids)
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        posts = Posts.objects.filter(post_id__in=postids, visibility='visible')
+        found = dict((post['postid'], post) for post in serialize_posts(posts, FEED_FIELDS))
+
+        return JSONResponse.new(
+            code=200,
+            message='success',
+            posts=found,
+            missing=[postid for postid in postids if postid not in found]
+        )
+
+
+class PostLikeBatch(View):
+    """ the like counts for a list of post ids, in one query
+        GET: /like/batch/(postids)/ postids: up to BATCH_MAX_IDS ids separated by commas
+        returned json object {
+            'likes': {postid: like count},
+            'missing': the postids that were not found
+        }
+    """
+    def get(self, request: HttpRequest, postids: str):
+        try:
+            postids = parse_ids(postids)
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        likes = dict(Posts.objects.filter(post_id__in=postids).values_list('post_id', 'like_count'))
+        return JSONResponse.new(
+            code=200,
+            message='success',
+            likes=likes,
+            missing=[postid for postid in postids if postid not in likes]
+        )
+
+
+class PostCommentCountBatch(View):
+    """ the comment counts for a list of post ids, in one query
+        GET: /comment/count/batch/(postids)/ postids: up to BATCH_MAX_IDS ids separated by commas
+        returned json object {
+            'counts': {postid: the number of comments},
+            'missing': the postids that were not found
+        }
+    """
+    def get(self, request: HttpRequest, postids: str):
+        try:
+            postids = parse_ids(postids)
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        counts = dict(Posts.objects.filter(post_id__in=postids).annotate(
+            count=Count('comments')
+        ).order_by().values_list('post_id', 'count'))
+
+        return JSONResponse.new(
+            code=200,
+            message='success',
+            counts=counts,
+            missing=[postid for postid in postids if postid not in counts]
+        )
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class UserConfig(AppConfig):
     name = 'user'
+
+    def ready(self):
+        # content versions for response ETags, the change log for delta syncs and the profile cache
+        # follow model saves and deletes
+        from lifesnap import changelog, profiles, versions
+        versions.connect()
+        changelog.connect()
+        profiles.connect()
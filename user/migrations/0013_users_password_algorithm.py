@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0012_auto_20170910_0953'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='password_algorithm',
+            field=models.CharField(default='signer', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='users',
+            name='password_cost',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='users',
+            name='password_hash',
+            field=models.CharField(max_length=128, unique=True),
+        ),
+    ]
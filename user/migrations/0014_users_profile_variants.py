@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 11:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0013_users_password_algorithm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='profile_variants',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 13:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0014_users_profile_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='profile_key',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
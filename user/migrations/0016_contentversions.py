@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 14:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0015_users_profile_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentVersions',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_pk', models.IntegerField(unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
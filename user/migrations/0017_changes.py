@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 17:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0016_contentversions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCompactions',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('floor', models.BigIntegerField()),
+                ('removed', models.IntegerField(default=0)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-floor'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Changes',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_pk', models.IntegerField()),
+                ('kind', models.CharField(choices=[('post', 'post'), ('like', 'post like count'), ('comment', 'comment'), ('commentlike', 'comment like count'), ('follow', 'follow'), ('profile', 'profile')], max_length=12)),
+                ('object_id', models.BigIntegerField()),
+                ('change_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='changes',
+            index_together=set([('user_pk', 'id')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-19 21:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0017_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changes',
+            name='txid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='changes',
+            index_together=set([('user_pk', 'id'), ('user_pk', 'txid')]),
+        ),
+    ]
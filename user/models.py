@@ -12,16 +12,81 @@ class Users(models.Model):
     first_name = models.CharField(max_length=40, blank=False)
     last_name = models.CharField(max_length=40, blank=False)
     user_name = models.CharField(max_length=40, unique=True, blank=False)
-    password_hash = models.CharField(max_length=32, unique=True)
+    password_hash = models.CharField(max_length=128, unique=True)
+    password_algorithm = models.CharField(max_length=20, default='signer')
+    password_cost = models.IntegerField(default=0)
     salt_hash = models.CharField(max_length=32, unique=True)
     email = models.EmailField(unique=True)
     creation_date = models.DateTimeField(auto_now_add=True)
     last_login_date = models.DateTimeField()
     is_active = models.BooleanField(default=True)
     about = models.CharField(max_length=255, blank=True)
-    profile_url = models.CharField(max_length=100, blank=True)
+    profile_url = models.CharField(max_length=255, blank=True)
+    profile_variants = models.TextField(blank=True, default='')
+    profile_key = models.CharField(max_length=100, blank=True, default='')
     follower_count = models.IntegerField(default=0)
     following = models.ManyToManyField('self', symmetrical=False)
 
+    def profile_image_key(self) -> str:
+        """ the storage key of the profile picture, pictures from before content addressing are at profilepic/<user_name>.png """
+        return self.profile_key or 'profilepic/{}.png'.format(self.user_name)
+
     def __str__(self):
         return "{}, {}: {}".format(self.last_name, self.first_name, self.email)
+
+
+class ContentVersions(models.Model):
+    """ a counter that goes up whenever something a user's snapshots or feed show changes,
+        response ETags are built from it, see lifesnap/versions.py.
+        user_pk is not a foreign key, a version can be bumped while the user is being deleted
+    """
+    user_pk = models.IntegerField(unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '{}: {}'.format(self.user_pk, self.version)
+
+
+class Changes(models.Model):
+    """ the change log behind the delta sync endpoint, see lifesnap/changelog.py
+        user_pk is the user whose content changed: the owner of the post for posts, comments and likes, the
+        follower for follows. object_id is the public id of what changed, a post_id, comment_id or user_id.
+        txid is the Postgres transaction that wrote the entry, versions are txids there (0 elsewhere)
+    """
+    class Meta:
+        index_together = [['user_pk', 'id'], ['user_pk', 'txid']]
+
+    KINDS = (
+        ('post', 'post'),
+        ('like', 'post like count'),
+        ('comment', 'comment'),
+        ('commentlike', 'comment like count'),
+        ('follow', 'follow'),
+        ('profile', 'profile')
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    user_pk = models.IntegerField()
+    kind = models.CharField(max_length=12, choices=KINDS)
+    object_id = models.BigIntegerField()
+    txid = models.BigIntegerField(default=0)
+    change_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{}: {} {} of {}'.format(self.id, self.kind, self.object_id, self.user_pk)
+
+
+class ChangeCompactions(models.Model):
+    """ a run of the change log compaction, the entries up to floor were removed by age (a txid on Postgres,
+        an id elsewhere). A client syncing from the highest floor or before has missed changes and has to
+        load everything again
+    """
+    class Meta:
+        ordering = ['-floor']
+
+    floor = models.BigIntegerField()
+    removed = models.IntegerField(default=0)
+    creation_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{}: {} removed'.format(self.floor, self.removed)
@@ -1,10 +1,21 @@
 import json
-
-from user.models import Users
-from post.models import Posts
+import gzip
+from io import BytesIO
+
+from user.models import Changes, Users
+from post.models import Posts, StoredObjects
+from comment.models import Comments
+from lifesnap import changelog
+from lifesnap.changelog import compact
+from lifesnap import profiles
+from lifesnap.util import JSONResponse
+from lifesnap.compression import CompressionMiddleware
+from lifesnap.storage import content_key, get_storage
+from lifesnap.upload_queue import ProfileImageUpload
 from django.utils import timezone
 from django.core.signing import Signer
-from django.test import TestCase, Client, tag
+from django.core.cache import cache
+from django.test import TestCase, Client, RequestFactory, override_settings, tag
 
 
 @tag('usertest')
@@ -237,3 +248,324 @@ class UserSearch(TestCase):
         self.assertEqual(lastname_resp.status_code, 200)
         self.assertEqual(len(lastname_resp.json()['users']), 3)
         print('{} users found'.format(len(lastname_resp.json()['users'])))
+
+
+@tag('usertest')
+class UserSnapshotETag(TestCase):
+    """ make sure snapshots answer 304 until the user or someone they follow changes something """
+    def _create_user(self, username: str, userid: int):
+        user = Users()
+        user.user_id = userid
+        user.first_name = 'Billy'
+        user.last_name = 'Bobtest'
+        user.user_name = username
+        user.email = '{}@gmail.com'.format(username)
+        user.last_login_date = timezone.now()
+        user.password_hash = 'hash{}'.format(userid)
+        user.salt_hash = 'salt{}'.format(userid)
+        user.save()
+        return user
+
+    def test_etag(self):
+        jim = self._create_user('jimjim', 123)
+        jane = self._create_user('jjane', 344)
+        jim.following.add(jane)
+
+        url = '/snaplife/api/user/friend/snapshot/jimjim/'
+        resp = self.client.get(url)
+        etag = resp['ETag']
+
+        # only the versions, the user comes from the profile cache and no posts are loaded
+        with self.assertNumQueries(1):
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        print('\tetag: {} {}'.format(resp.status_code, etag))
+        self.assertEqual(resp.status_code, 304)
+
+        Posts(post_id=1234, message='a post', author_username='jjane', user=jane).save()
+
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+        feed = '/snaplife/api/user/posts/search/user/123/10/'
+        etag = self.client.get(feed)['ETag']
+        self.assertEqual(self.client.get(feed, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        jim.following.remove(jane)
+        self.assertEqual(self.client.get(feed, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_compression(self):
+        middleware = CompressionMiddleware(lambda request: None)
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip;q=1.0, br;q=0')
+        payload = dict({'posts': ['post message {}'.format(i) for i in range(200)]})
+
+        resp = middleware.process_response(request, JSONResponse(payload))
+        print('\tcompression: {} {} bytes'.format(resp['Content-Encoding'], len(resp.content)))
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(resp.content).decode('utf-8')), payload)
+        self.assertIn('Accept-Encoding', resp['Vary'])
+
+        small = middleware.process_response(request, JSONResponse({'message': 'success'}))
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+
+@tag('usertest')
+class UserSnapshotBatchTest(TestCase):
+    """ make sure many snapshots come back with the same few queries """
+    def _create_user(self, username: str, userid: int):
+        user = Users(user_id=userid, first_name='Billy', last_name='Bobtest', user_name=username,
+                     email='{}@gmail.com'.format(username), last_login_date=timezone.now(),
+                     password_hash='hash{}'.format(userid), salt_hash='salt{}'.format(userid))
+        user.save()
+        return user
+
+    def test_snapshot_batch(self):
+        users = [self._create_user('user{}'.format(i), 100 + i) for i in range(3)]
+        users[0].following.add(users[1], users[2])
+        for (i, user) in enumerate(users):
+            for j in range(i + 2):
+                Posts(post_id=i * 10 + j, message='post {}'.format(j), author_username=user.user_name, user=user).save()
+        Posts.objects.filter(post_id=20).update(visibility='hidden')
+
+        with self.settings(SNAPSHOT_BATCH_POSTS=2), self.assertNumQueries(3):
+            resp = self.client.get('/snaplife/api/user/friend/snapshot/batch/user0,user1,user2,nobody/')
+        data = json.loads(resp.content.decode('utf-8'))
+
+        print('\tsnapshot batch: {}'.format(dict((name, len(user['posts'])) for (name, user) in data['users'].items())))
+        self.assertEqual(data['missing'], ['nobody'])
+        self.assertEqual(data['users']['user0']['following'], 2)
+        self.assertEqual(data['users']['user2']['postcount'], 3)
+        self.assertEqual([post['message'] for post in data['users']['user2']['posts']], ['post 3', 'post 2'])
+        self.assertEqual(len(data['users']['user1']['posts']), 2)
+
+        resp = self.client.get('/snaplife/api/user/account/snapshot/batch/101,100/')
+        self.assertEqual(sorted(json.loads(resp.content.decode('utf-8'))['users']), ['100', '101'])
+
+
+@tag('usertest')
+class UserChangesTest(TestCase):
+    """ make sure a delta sync sends only what changed since the version the client has """
+    def _create_user(self, username: str, userid: int):
+        user = Users(user_id=userid, first_name='Billy', last_name='Bobtest', user_name=username,
+                     email='{}@gmail.com'.format(username), last_login_date=timezone.now(),
+                     password_hash='hash{}'.format(userid), salt_hash='salt{}'.format(userid))
+        user.save()
+        return user
+
+    def _changes(self, version: int) -> dict:
+        resp = self.client.get('/snaplife/api/user/changes/100/{}/'.format(version))
+        return json.loads(resp.content.decode('utf-8'))
+
+    def test_changes(self):
+        (jim, jane, joe) = (self._create_user('jim', 100), self._create_user('jane', 101), self._create_user('joe', 102))
+        jim.following.add(jane, joe)
+        old = Posts(post_id=1, message='old post', author_username='jane', user=jane)
+        old.save()
+        Posts(post_id=2, message='liked post', author_username='jane', user=jane).save()
+
+        version = json.loads(self.client.get('/snaplife/api/user/changes/100/').content.decode('utf-8'))['version']
+        self.assertEqual(self._changes(version)['posts'], [])
+
+        Posts(post_id=3, message='new post', author_username='jane', user=jane).save()
+        Posts(post_id=4, message='stranger post', author_username='stranger').save()
+        self.client.post('/snaplife/api/user/posts/like/', json.dumps({'postid': 2, 'userid': 100}), content_type='application/json')
+        Comments(comment_id=7, author_id=100, author_name='jim', message='a comment', post=old).save()
+        jim.following.remove(joe)
+        jane.following.add(joe)
+        Posts.objects.get(post_id=1).delete()
+
+        changes = self._changes(version)
+        print('\tchanges: {}'.format(dict((key, value) for (key, value) in changes.items() if value)))
+        self.assertEqual([post['postid'] for post in changes['posts']], [3])
+        self.assertEqual(changes['deletedposts'], [1])
+        self.assertEqual(changes['likes'], {'2': 1})
+        self.assertEqual(changes['deletedcomments'], [7])
+        self.assertEqual(changes['following'], {'added': [], 'removed': [102]})
+        self.assertFalse(changes['reset'])
+
+        # nothing new since the version that came back
+        self.assertEqual(self._changes(changes['version'])['posts'], [])
+
+        with self.settings(DELTA_MAX_CHANGES=1):
+            self.assertTrue(self._changes(version)['more'])
+
+    def _as_postgres(self, horizon: int):
+        """ read the log by txid with horizon as the oldest running transaction, as on Postgres """
+        (position, read_horizon) = (changelog._position, changelog._horizon)
+        changelog._position = lambda: 'txid'
+        changelog._horizon = lambda: horizon
+
+        def restore():
+            (changelog._position, changelog._horizon) = (position, read_horizon)
+        self.addCleanup(restore)
+
+    def _post(self, user: Users, post_id: int, txid: int):
+        Posts(post_id=post_id, message='post {}'.format(post_id), author_username=user.user_name, user=user).save()
+        Changes.objects.filter(kind='post', object_id=post_id).update(txid=txid)
+
+    def test_commit_order(self):
+        jim = self._create_user('jim', 100)
+        Changes.objects.all().delete()
+        # post 1 is logged first (the lower id) by transaction 200, which is still running when
+        # transaction 150 logs post 2 and commits
+        self._post(jim, 1, 200)
+        self._post(jim, 2, 150)
+
+        self._as_postgres(horizon=200)
+        changes = self._changes(100)
+        print('\tcommit order: {} up to version {}'.format([post['postid'] for post in changes['posts']], changes['version']))
+        self.assertEqual([post['postid'] for post in changes['posts']], [2])
+        self.assertEqual(changes['version'], 200)
+
+        # transaction 200 commits, the next read sends post 1 and nothing twice
+        self._as_postgres(horizon=201)
+        changes = self._changes(changes['version'])
+        self.assertEqual([post['postid'] for post in changes['posts']], [1])
+        self.assertEqual(self._changes(changes['version'])['posts'], [])
+
+    def test_transaction_not_split(self):
+        jim = self._create_user('jim', 100)
+        Changes.objects.all().delete()
+        for (post_id, txid) in ((1, 150), (2, 150), (3, 160)):
+            self._post(jim, post_id, txid)
+
+        self._as_postgres(horizon=200)
+        with self.settings(DELTA_MAX_CHANGES=1):
+            # transaction 150 logged two posts, it is sent whole
+            changes = self._changes(100)
+            self.assertTrue(changes['more'])
+            self.assertEqual(sorted(post['postid'] for post in changes['posts']), [1, 2])
+            self.assertEqual(changes['version'], 151)
+
+            changes = self._changes(changes['version'])
+            self.assertEqual([post['postid'] for post in changes['posts']], [3])
+            self.assertFalse(changes['more'])
+            self.assertEqual(changes['version'], 200)
+
+    def test_compaction(self):
+        jim = self._create_user('jim', 100)
+        post = Posts(post_id=1, message='post', author_username='jim', user=jim)
+        post.save()
+        for message in ('edit one', 'edit two'):
+            post.message = message
+            post.save()
+        before = Changes.objects.count()
+
+        (duplicates, expired) = compact()
+        print('\tcompaction: {} entries, {} superseded, {} expired'.format(before, duplicates, expired))
+        self.assertEqual(duplicates, 2)
+        self.assertEqual(self._changes(0)['posts'][0]['message'], 'edit two')
+
+        # everything is older than 0 days, a client from before the compaction starts over
+        version = self._changes(0)['version']
+        compact(retention_days=0)
+        self.assertFalse(Changes.objects.exists())
+        changes = self._changes(0)
+        self.assertTrue(changes['reset'])
+        self.assertEqual(changes['version'], version)
+        self.assertFalse(self._changes(version)['reset'])
+
+
+@tag('usertest')
+class UserProfileCacheTest(TestCase):
+    """ make sure profile reads come from the cache and writes show up right away """
+    def setUp(self):
+        profiles.clear()
+        self.user = Users(user_id=100, first_name='Billy', last_name='Bobtest', user_name='jim', email='jim@gmail.com',
+                          about='old about', last_login_date=timezone.now(), password_hash='hash100', salt_hash='salt100')
+        self.user.save()
+
+    def test_cache(self):
+        self.client.get('/snaplife/api/user/description/100/')
+        with self.assertNumQueries(0):
+            resp = self.client.get('/snaplife/api/user/description/100/')
+        self.assertEqual(resp.json()['description'], 'old about')
+
+        # the row cached under the user_id also answers for the user_name
+        with self.assertNumQueries(0):
+            self.assertEqual(profiles.resolve_user('jim', profiles.USER_NAME).email, 'jim@gmail.com')
+
+        self.client.post('/snaplife/api/user/description/', json.dumps({'userid': 100, 'description': 'new about'}),
+                         content_type='application/json')
+        resp = self.client.get('/snaplife/api/user/description/100/')
+        print('\tprofile cache: {}'.format(resp.content))
+        self.assertEqual(resp.json()['description'], 'new about')
+
+        with self.assertRaises(Users.DoesNotExist):
+            profiles.resolve_user(999, profiles.USER_ID)
+
+    def test_stale_entry(self):
+        profiles.resolve_user(100, profiles.USER_ID)
+        stale = cache.get('lifesnap.profiles:100')
+
+        self.user.about = 'new about'
+        self.user.save()
+        # a request that read the row before the save stores it afterwards
+        cache.set('lifesnap.profiles:100', stale)
+        profiles.clear()
+
+        self.assertEqual(profiles.resolve_user(100, profiles.USER_ID).about, 'new about')
+
+    def test_local_shared_tier(self):
+        # the test cache is a LocMemCache, per process, so its entries last no longer than the local tier's
+        with self.settings(PROFILE_CACHE_LOCAL_TTL=0):
+            profiles.resolve_user(100, profiles.USER_ID)
+            with self.assertNumQueries(1):
+                profiles.resolve_user(100, profiles.USER_ID)
+        self.assertIsNone(cache.get('lifesnap.profiles:100'))
+
+        profiles.resolve_user(100, profiles.USER_ID)
+        with self.assertNumQueries(0):
+            profiles.resolve_user(100, profiles.USER_ID)
+
+    def test_missing(self):
+        with self.assertRaises(Users.DoesNotExist):
+            profiles.resolve_user('nobody')
+        # a name that was not found is not looked up again for a while
+        with self.assertNumQueries(0):
+            with self.assertRaises(Users.DoesNotExist):
+                profiles.resolve_user('nobody')
+
+        Users(user_id=200, first_name='No', last_name='Body', user_name='nobody', email='nobody@gmail.com',
+              last_login_date=timezone.now(), password_hash='hash200', salt_hash='salt200').save()
+        user = profiles.resolve_user('nobody')
+        print('\tmissing user: {}'.format(user.user_id))
+        self.assertEqual(user.user_id, 200)
+
+        # a number is a user_id before it is a user_name
+        self.assertEqual(profiles.resolve_user('100').user_name, 'jim')
+
+
+@tag('usertest')
+@override_settings(STORAGE={'BACKEND': 'lifesnap.storage.MemoryStorage'}, IMAGE_VARIANT_WIDTHS=[])
+class UserProfileImageUpload(TestCase):
+    """ make sure a queued profile picture is swapped in once it is stored """
+    def setUp(self):
+        self.user = Users.objects.create(user_id=324, first_name='Billy', last_name='Bobtest', user_name='myUsername',
+                                         password_hash='hash', salt_hash='salt', email='billy@snaplife.test',
+                                         last_login_date=timezone.now())
+        post = Posts(post_id=1234, message='some post message', author_username='myUsername', user=self.user)
+        post.save()
+
+    def _upload(self, image: bytes) -> str:
+        key_name = content_key(BytesIO(image), prefix='profilepic/')
+        ProfileImageUpload(self.user, key_name, BytesIO(image)).run()
+        return key_name
+
+    def test_profile_upload(self):
+        key_name = self._upload(b'a profile png')
+        self.user.refresh_from_db()
+
+        print('\tprofile_upload: {}'.format(self.user.profile_url))
+        self.assertEqual(self.user.profile_key, key_name)
+        self.assertEqual(self.user.profile_url, 'memory://{}'.format(key_name))
+        self.assertEqual(Posts.objects.get(post_id=1234).author_profile_url, self.user.profile_url)
+        self.assertEqual(StoredObjects.objects.get(key=key_name).refs, 1)
+
+    def test_profile_upload_deleted_user(self):
+        self.user.delete()
+        key_name = self._upload(b'a profile png')
+
+        print('\tprofile_upload_deleted_user: stored {}'.format(get_storage().exists(key_name)))
+        self.assertFalse(get_storage().exists(key_name))
+        self.assertFalse(StoredObjects.objects.filter(key=key_name).exists())
+
@@ -7,10 +7,14 @@ from user.views import (
     UserFollowRemove,
     UserFollowers,
     UserProfileUpdate,
+    UserProfilePresign,
+    UserProfileFinalize,
     UserOnline,
     UserAccountSnapshot,
     UserFriendSnapshot,
-    UserSearch
+    UserSnapshotBatch,
+    UserSearch,
+    UserChanges
 )
 from django.conf.urls import url
 
@@ -24,11 +28,17 @@ urlpatterns = [
     url(r'^online/(?P<username>[a-zA-Z0-9]+)/$', UserOnline.as_view(), name='online'),
     url(r'^account/snapshot/(?P<user_id>[0-9]+)/$', UserAccountSnapshot.as_view(), name='snapshot'),
     url(r'^friend/snapshot/(?P<username>[a-zA-Z0-9]+)/$', UserFriendSnapshot.as_view(), name='friendsnapshot'),
+    url(r'^account/snapshot/batch/(?P<user_ids>[0-9,]+)/$', UserSnapshotBatch.as_view(), name='snapshotbatch'),
+    url(r'^friend/snapshot/batch/(?P<usernames>[a-zA-Z0-9,]+)/$', UserSnapshotBatch.as_view(), name='friendsnapshotbatch'),
     url(r'^email/$', UserEmail.as_view(), name='set_email'),
     url(r'^description/$', UserDescription.as_view(), name='set_description'),
     url(r'^profile/update/$', UserProfileUpdate.as_view(), name='profileupdate'),
+    url(r'^profile/presign/$', UserProfilePresign.as_view(), name='profilepresign'),
+    url(r'^profile/finalize/$', UserProfileFinalize.as_view(), name='profilefinalize'),
     url(r'^follow/new/$', UserFollowAdd.as_view(), name='newfollower'),
     url(r'^follow/remove/$', UserFollowRemove.as_view(), name='removefollower'),
     url(r'^follow/list/(?P<user_id>[0-9]+)/$', UserFollowers.as_view(), name='listfollower'),
+    url(r'^changes/(?P<user_id>[0-9]+)/$', UserChanges.as_view(), name='changesversion'),
+    url(r'^changes/(?P<user_id>[0-9]+)/(?P<version>[0-9]+)/$', UserChanges.as_view(), name='changes'),
     url(r'^search/user/(?P<user_search>[\W\w]+)/$', UserSearch.as_view(), name='usersearch')
 ]
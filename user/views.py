@@ -1,9 +1,20 @@
 """ handling view requests for user data """
 import json
-from lifesnap.aws import AWS
+from contextlib import ExitStack
+from lifesnap.storage import content_key, get_storage, release_later
+from lifesnap.image_urls import public_url
 from user.models import Users
-from lifesnap.util import JSONResponse
-
+from lifesnap.util import JSONResponse, parse_ids
+from lifesnap.snapshots import user_snapshots
+from lifesnap.upload import read_json_upload
+from lifesnap.versions import content_etag, not_modified, set_etag, touch
+from lifesnap.changelog import changes_since, current_version
+from lifesnap.profiles import USER_ID, USER_NAME, resolve_user
+from lifesnap.serializers import SNAPSHOT_FIELDS, serialize_posts
+from lifesnap.upload_queue import queue_profile_image
+from lifesnap.derivatives import variant_keys, variant_urls
+
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpRequest
 from django.utils import timezone
@@ -19,7 +30,7 @@ class UserCounts(View):
 
     def get(self, request: HttpRequest, user_id: int, count_type: str):
         try:
-            user = Users.objects.get(user_id__exact=user_id)
+            user = resolve_user(user_id, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='bad user id {}, user not found'.format(user_id))
 
@@ -46,14 +57,10 @@ class UserFollowers(View):
     """
     def get(self, request: HttpRequest, user_id: str):
         try:
-            # lets check userID first
-            user = Users.objects.get(user_id__exact=user_id)
+            # a user id or a username, a user id wins when both match
+            user = resolve_user(user_id)
         except ObjectDoesNotExist:
-            try:
-                # userID was not found, lets try username
-                user = Users.objects.get(user_name__exact=user_id)
-            except ObjectDoesNotExist:
-                return JSONResponse.new(code=400, message='user {} is not found'.format(user_id))
+            return JSONResponse.new(code=400, message='user {} is not found'.format(user_id))
 
         follow_users = []
         following = user.following.all()
@@ -67,6 +74,39 @@ class UserFollowers(View):
         return JSONResponse.new(code=200, message='success', following=follow_users)
 
 
+class UserChanges(View):
+    """ what changed since the client last synced, instead of loading the feed, follow list and profile again
+        /apiendpoint/(userid)/ - the version to start from, ask for it before loading everything
+        /apiendpoint/(userid)/(version)/ - the changes since version, the version the last call returned
+
+        returned JSON object {
+            'version': send this next time,
+            'reset': true when version is too old, load everything again and sync from this version,
+            'more': true when there were more than DELTA_MAX_CHANGES changes, ask again with the new version,
+            'posts': new and changed post objects, as search/user/ has them,
+            'deletedposts': ids of the posts that were deleted or hidden,
+            'likes': {postid: like count} posts where only the like count changed,
+            'comments': [{'commentid', 'postid', 'message', 'author', 'likes', 'date'}] new and changed comments,
+            'deletedcomments': ids of the comments that were deleted,
+            'commentlikes': {commentid: like count},
+            'following': {'added': user ids, 'removed': user ids}, load the posts of users added here,
+            'profiles': [{'userid', 'username', 'about', 'avatar', 'avatarvariants', 'followers'}] changed
+                        profiles of the user and who they follow, a new avatar is also the avatar of their posts
+        }
+    """
+    def get(self, request: HttpRequest, user_id: str, version: str = None):
+        try:
+            user = resolve_user(user_id, USER_ID)
+        except ObjectDoesNotExist:
+            return JSONResponse.new(code=400, message='user id {} is not found'.format(user_id))
+
+        if version is None:
+            return JSONResponse.new(code=200, message='success', version=current_version())
+
+        changes = changes_since(user, int(version), settings.DELTA_MAX_CHANGES)
+        return JSONResponse.new(code=200, message='success', **changes)
+
+
 class UserOnline(View):
     """ request if the user is online
         /apiendpoint/(username) - return true or false if this username is currently logged in
@@ -74,7 +114,7 @@ class UserOnline(View):
 
     def get(self, request: HttpRequest, username: str):
         try:
-            user = Users.objects.get(user_name__exact=username)
+            user = resolve_user(username, USER_NAME, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user name {} is not found'.format(username))
 
@@ -104,13 +144,15 @@ class UserFriendSnapshot(View):
 
         returned JSON object: {
             'about': the users account description,
-            'postcount': the number of posts by the user,
+            'postcount': the number of posts by the user, posts hidden after reports are not counted,
             'following': the number of people the ueser is following,
             'followers': the number of people following the user,
             'avatar': the url to the users avatar,
+            'avatarvariants': {width: url} smaller copies of the avatar,
             'posts': a list of the users posts {
                 'message': the post message,
                 'url': the url to the message image if there is one,
+                'variants': {width: url} smaller copies of the image,
                 'date': the date of the post,
                 'likes': the posts like count
             },
@@ -123,19 +165,18 @@ class UserFriendSnapshot(View):
 
     def get(self, request: HttpRequest, username: str):
         try:
-            user = Users.objects.get(user_name__exact=username)
-            posts = user.posts_set.all()
+            user = resolve_user(username, USER_NAME)
+            posts = user.posts_set.filter(visibility='visible')
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user {} was not found'.format(username))
 
-        post_list = []
-        for post in posts:
-            post_list.append({
-                'message': post.message,
-                'url': post.image_url,
-                'date': post.creation_date.isoformat(),
-                'likes': post.like_count
-            })
+        # the following list shows the avatars of the users this user follows
+        etag = content_etag(user, 'friendsnapshot', following=True)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        post_list = serialize_posts(posts, SNAPSHOT_FIELDS, fragments=True)
 
         following_list = []
         for follow_user in user.following.all():
@@ -144,7 +185,7 @@ class UserFriendSnapshot(View):
                 'avatar': follow_user.profile_url
             })
 
-        return JSONResponse.new(
+        response = JSONResponse.new(
             code=200,
             message='success',
             about=user.about,
@@ -152,9 +193,11 @@ class UserFriendSnapshot(View):
             following=user.following.count(),
             followers=user.follower_count,
             avatar=user.profile_url,
+            avatarvariants=variant_urls(user.profile_variants),
             posts=post_list,
             followinglist=following_list
         )
+        return set_etag(response, etag)
 
 
 class UserAccountSnapshot(View):
@@ -171,22 +214,28 @@ class UserAccountSnapshot(View):
             'followers': followers count,
             'description': users description,
             'avatar': url to users profile avatar,
+            'avatarvariants': {width: url} smaller copies of the avatar,
             'startdate': users creation date
         }
     """
 
     def get(self, request: HttpRequest, user_id: int):
         try:
-            user = Users.objects.get(user_id__exact=user_id)
+            user = resolve_user(user_id, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='bad user id {}, user not found'.format(user_id))
 
         if user.is_active is False:
             return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
 
+        etag = content_etag(user, 'accountsnapshot')
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
         post_count = user.posts_set.count()
         following_count = user.following.count()
-        return JSONResponse.new(
+        response = JSONResponse.new(
             code=200,
             message='success',
             username=user.user_name,
@@ -195,11 +244,54 @@ class UserAccountSnapshot(View):
             email=user.email,
             description=user.about,
             avatar=user.profile_url,
+            avatarvariants=variant_urls(user.profile_variants),
             startdate=user.creation_date.isoformat(),
             followers=user.follower_count,
             following=following_count,
             postcount=post_count
         )
+        return set_etag(response, etag)
+
+
+class UserSnapshotBatch(View):
+    """ the snapshots of many users in one call, with the same 3 queries however many users are asked for
+        GET: /account/snapshot/batch/(userids)/ userids: up to BATCH_MAX_IDS user ids separated by commas
+        GET: /friend/snapshot/batch/(usernames)/ usernames: up to BATCH_MAX_IDS usernames separated by commas
+
+        returned JSON object: {
+            'users': {userid or username: {
+                'userid': the users user id,
+                'username': the users username,
+                'about': the users account description,
+                'avatar': the url to the users avatar,
+                'avatarvariants': {width: url} smaller copies of the avatar,
+                'followers': the number of people following the user,
+                'following': the number of people the user is following,
+                'postcount': the number of posts by the user, posts hidden after reports are not counted,
+                'posts': the users latest SNAPSHOT_BATCH_POSTS posts, the same post objects friend/snapshot/ returns
+            }},
+            'missing': the userids or usernames that were not found
+        }
+    """
+
+    def get(self, request: HttpRequest, user_ids: str = None, usernames: str = None):
+        try:
+            if user_ids is not None:
+                keys = parse_ids(user_ids)
+                (users, key) = (Users.objects.filter(user_id__in=keys), 'userid')
+            else:
+                keys = parse_ids(usernames, convert=str)
+                (users, key) = (Users.objects.filter(user_name__in=keys), 'username')
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        snapshots = dict((snapshot[key], snapshot) for snapshot in user_snapshots(users, settings.SNAPSHOT_BATCH_POSTS))
+        return JSONResponse.new(
+            code=200,
+            message='success',
+            users=snapshots,
+            missing=[item for item in keys if item not in snapshots]
+        )
 
 
 class UserDescription(View):
@@ -213,7 +305,7 @@ class UserDescription(View):
 
     def get(self, request: HttpRequest, user_id: int):
         try:
-            user = Users.objects.get(user_id__exact=user_id)
+            user = resolve_user(user_id, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='bad user id {}, user not found'.format(user_id))
 
@@ -227,7 +319,7 @@ class UserDescription(View):
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='bad user id {}, user not found'.format(req_json.get('userid')))
 
@@ -261,7 +353,7 @@ class UserEmail(View):
 
     def get(self, request: HttpRequest, user_id: str):
         try:
-            user = Users.objects.get(user_id__exact=user_id)
+            user = resolve_user(user_id, USER_ID)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user id {} was not found'.format(user_id))
 
@@ -275,9 +367,9 @@ class UserEmail(View):
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
-            return JSONResponse.new(code=400, message='user id {} was not found'.format(user_id))
+            return JSONResponse.new(code=400, message='user id {} was not found'.format(req_json.get('userid')))
 
         new_email = req_json.get('email', None)
         if new_email and len(new_email) < 255 and len(new_email) > 3:
@@ -306,8 +398,8 @@ class UserFollowAdd(View):
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
-            follower = Users.objects.get(user_name__exact=req_json.get('username'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
+            follower = resolve_user(req_json.get('username'), USER_NAME, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} or username {} not found'.format(req_json.get('userid'), req_json.get('username')))
 
@@ -344,7 +436,7 @@ class UserFollowRemove(View):
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
             follower = user.following.get(user_name__exact=req_json.get('username'))
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='userid {} or username {} not found'.format(req_json['userid'], req_json['username']))
@@ -368,34 +460,128 @@ class UserProfileUpdate(View):
         returned json object: {
             'url': the url for the profile picture. can be used inside <image>
         }
+        the picture is uploaded in the background, the profile points at the url once storage has it
+    """
+
+    def post(self, request: HttpRequest):
+        # the image is decoded straight from the request stream, the body is never buffered whole
+        try:
+            (req_json, image) = read_json_upload(
+                request,
+                'profilepic',
+                max_bytes=settings.UPLOAD_MAX_BYTES,
+                spool_max=settings.UPLOAD_SPOOL_MAX_BYTES
+            )
+        except json.JSONDecodeError:
+            return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        if image is None:
+            return JSONResponse.new(code=400, message='profilepic is required')
+
+        # the spooled image is closed on every way out, until the upload queue takes it over
+        with ExitStack() as cleanup:
+            cleanup.callback(image.close)
+            try:
+                user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
+            except ObjectDoesNotExist:
+                return JSONResponse.new(code=400, message='user {} is not found'.format(req_json.get('userid')))
+
+            if user.is_active is False:
+                return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
+
+            # the queue swaps the picture in once it is stored, along with the posts and thumbnails
+            key_name = content_key(image, prefix='profilepic/')
+            cleanup.pop_all()
+            queue_profile_image(user, key_name, image)
+
+        return JSONResponse.new(code=200, message='success', avatar=public_url(key_name), avatarvariants={})
+
+
+class UserProfilePresign(View):
+    """ presigned S3 upload for the users profile picture, the image is sent straight to S3
+        instead of base64 encoded inside the UserProfileUpdate json. Finish with UserProfileFinalize.
+        required json object: {
+            'userid': the userid who wants to update the profile picture,
+            'method': optional, 'post' (default) for a form upload or 'put' to PUT the raw bytes
+        }
+        returned json object: {
+            'url': where to send the upload,
+            'fields': form fields to include with a 'post' upload,
+            'headers': headers to include with a 'put' upload
+        }
     """
 
     def post(self, request: HttpRequest):
-        aws = AWS('snap-life')
+        try:
+            req_json = json.loads(request.body.decode('UTF-8'))
+        except json.JSONDecodeError:
+            return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
+        try:
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
+        except ObjectDoesNotExist:
+            return JSONResponse.new(code=400, message='user {} is not found'.format(req_json.get('userid')))
+
+        if user.is_active is False:
+            return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
+
+        try:
+            upload = get_storage().presign_upload(
+                'profilepic/{}.png'.format(user.user_name),
+                method=req_json.get('method', 'post'),
+                expires=settings.UPLOAD_URL_EXPIRES,
+                max_bytes=settings.UPLOAD_MAX_BYTES
+            )
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        return JSONResponse.new(code=200, message='success', url=upload['url'], fields=upload['fields'], headers=upload['headers'])
+
+
+class UserProfileFinalize(View):
+    """ point the users profile picture at the image uploaded with a UserProfilePresign upload
+        required json object: {
+            'userid': the userid who uploaded the profile picture
+        }
+        returned json object: {
+            'avatar': the url for the profile picture. can be used inside <image>
+        }
+    """
+
+    def post(self, request: HttpRequest):
         try:
             req_json = json.loads(request.body.decode('UTF-8'))
         except json.JSONDecodeError:
             return JSONResponse.new(code=400, message='json decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=req_json.get('userid'))
+            user = resolve_user(req_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user {} is not found'.format(req_json.get('userid')))
 
         if user.is_active is False:
             return JSONResponse.new(code=400, message='user id {} must be logged in'.format(user.user_id))
 
-        # is there a better way?
-        aws.remove_profile_image('{}.png'.format(user.user_name))
-        url = aws.upload_profile_image('{}.png'.format(user.user_name), req_json.get('profilepic'))
+        storage = get_storage()
+        key_name = 'profilepic/{}.png'.format(user.user_name)
+        if not storage.exists(key_name):
+            return JSONResponse.new(code=400, message='image {} has not been uploaded'.format(key_name))
 
-        user.profile_url = url
-        user.save(update_fields=['profile_url'])
+        # a presigned upload is not content addressed, drop the reference to the stored picture
+        old_keys = variant_keys(user.profile_variants)
+        if user.profile_key:
+            old_keys.append(user.profile_key)
 
-        for post in user.posts_set.all():
-            post.author_profile_url = url
-            post.save()
+        url = public_url(key_name)
+        user.profile_url = url
+        user.profile_key = ''
+        user.profile_variants = ''
+        user.save(update_fields=['profile_url', 'profile_key', 'profile_variants'])
+        release_later(old_keys)
+        user.posts_set.update(author_profile_url=url)
+        touch([user.pk])
 
         return JSONResponse.new(code=200, message='success', avatar=url)
 
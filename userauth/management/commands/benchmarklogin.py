@@ -0,0 +1,47 @@
+""" report how many logins per second the password hasher allows at each cost setting """
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from user.models import Users
+from lifesnap.passwords import get_hasher, set_password, verify_password
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure login password verification throughput (logins per second) at each cost setting. '
+        'Verification goes through the same bounded thread pool the login view uses.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', default=None, help='hash algorithm, defaults to PASSWORD_HASH_ALGORITHM')
+        parser.add_argument('--costs', nargs='+', type=int, default=None,
+                            help='cost settings to measure, defaults to PASSWORD_HASH_COST')
+        parser.add_argument('--logins', type=int, default=200, help='number of logins per cost setting')
+        parser.add_argument('--concurrency', type=int, default=8, help='number of simulated request workers')
+
+    def handle(self, **options):
+        hasher = get_hasher(options['algorithm'])
+        costs = options['costs'] or [settings.PASSWORD_HASH_COST]
+        logins = options['logins']
+
+        self.stdout.write('algorithm {}, {} logins, {} request workers, {} hash workers'.format(
+            hasher.algorithm, logins, options['concurrency'], settings.PASSWORD_HASH_WORKERS))
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+            for cost in costs:
+                user = Users(user_name='benchmark')
+                set_password(user, 'benchmark password', algorithm=hasher.algorithm, cost=cost)
+
+                start = time.perf_counter()
+                results = list(clients.map(lambda _: verify_password(user, 'benchmark password'), range(logins)))
+                elapsed = time.perf_counter() - start
+
+                if not all(results):
+                    self.stderr.write('cost {}: password verification failed'.format(cost))
+                    continue
+
+                self.stdout.write('cost {:>10}: {:>10.1f} logins/s, {:>8.2f} ms per login'.format(
+                    cost, logins / elapsed, elapsed / logins * 1000))
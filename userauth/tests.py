@@ -1,10 +1,16 @@
 import json
+from datetime import timedelta
 from base64 import b64encode
 from user.models import Users
+from lifesnap.sessions import SessionStore, write_buffer
+from lifesnap.passwords import verify_password
 
-from django.test import TestCase, Client, tag
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase, Client, tag, override_settings
 from django.core.signing import Signer
 from django.utils import timezone
+from django.contrib.sessions.models import Session
 
 
 @tag('userauth')
@@ -193,3 +199,119 @@ class DeleteUserTestCase(TestCase):
         print('\tdelete_wrong_username: status_code = {}: {}'.format(resp.status_code, resp.json()['message']))
         self.assertEqual(resp.status_code, 400)
         self.assertContains(resp, 'is not found', status_code=400)
+
+
+@tag('userauth')
+class SessionStoreTestCase(TestCase):
+    """ make sure sessions are served from the cache and persisted to the database in batches """
+    def setUp(self):
+        write_buffer.flush()
+        Session.objects.all().delete()
+
+    def test_session_save_is_buffered(self):
+        """ saving a session should not touch django_session until the buffer is flushed """
+        session = SessionStore()
+        session['324'] = True
+        session.save()
+
+        print('\tsession_save_is_buffered: rows before flush {}'.format(Session.objects.count()))
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertTrue(SessionStore(session.session_key).get('324'))
+
+        write_buffer.flush()
+        self.assertEqual(Session.objects.filter(session_key=session.session_key).count(), 1)
+
+    def test_session_load_from_db(self):
+        """ a session missing from the cache should be loaded back from the database """
+        session = SessionStore()
+        session['324'] = True
+        session.save()
+        write_buffer.flush()
+
+        caches[settings.SESSION_CACHE_ALIAS].delete(session.cache_key)
+        self.assertTrue(SessionStore(session.session_key).get('324'))
+
+    def test_session_delete(self):
+        """ a deleted session should not come back from the cache, the buffer or the database """
+        session = SessionStore()
+        session['324'] = True
+        session.save()
+        write_buffer.flush()
+
+        session.delete()
+        self.assertIsNone(SessionStore(session.session_key).get('324'))
+
+        write_buffer.flush()
+        self.assertEqual(Session.objects.filter(session_key=session.session_key).count(), 0)
+
+    def test_clear_expired(self):
+        """ clear_expired should remove expired rows and keep the rest """
+        session = SessionStore()
+        session['324'] = True
+        session.save()
+        Session.objects.create(
+            session_key='expiredsessionkey0123456789',
+            session_data=session.encode({}),
+            expire_date=timezone.now() - timedelta(days=1)
+        )
+
+        SessionStore.clear_expired()
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [session.session_key])
+
+
+@tag('userauth')
+@override_settings(PASSWORD_HASH_ALGORITHM='pbkdf2_sha256', PASSWORD_HASH_COST=1000)
+class PasswordHashTestCase(TestCase):
+    """ make sure users are hashed with the configured algorithm and legacy users are rehashed on login """
+    def _create_json_request(self, url: str, data: json):
+        resp = self.client.post(url, json.dumps(data), content_type='application/json')
+        return resp
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+
+    def test_login_rehash(self):
+        """ a user with the old signer hash should be moved onto the configured algorithm """
+        salt = 'blahfffffj349feiblah123'
+        signer = Signer(salt=salt)
+
+        user = Users()
+        user.user_id = 324
+        user.first_name = 'Billy'
+        user.last_name = 'Bobtest'
+        user.user_name = 'bbobby'
+        user.last_login_date = timezone.now()
+        user.password_hash = signer.signature('password123')
+        user.salt_hash = salt
+        user.save()
+
+        resp = self._create_json_request('/snaplife/api/auth/user/login/', {'username': 'bbobby', 'password': 'password123'})
+        user.refresh_from_db()
+
+        print('\tlogin_rehash: status_code = {}: {} {}'.format(resp.status_code, user.password_algorithm, user.password_cost))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(user.password_algorithm, 'pbkdf2_sha256')
+        self.assertEqual(user.password_cost, 1000)
+        self.assertTrue(verify_password(user, 'password123'))
+        self.assertFalse(verify_password(user, 'password1234'))
+
+    def test_create_duplicate_username(self):
+        """ the second user with the same username should be rejected by the unique constraint """
+        data = {'username': 'bbobby', 'password': 'password123', 'firstname': 'Billy', 'lastname': 'Bob'}
+        resp = self._create_json_request('/snaplife/api/auth/user/create/', data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Users.objects.get(user_name='bbobby').password_algorithm, 'pbkdf2_sha256')
+
+        data['email'] = 'another@email.com'
+        resp = self._create_json_request('/snaplife/api/auth/user/create/', data)
+
+        print('\tcreate_duplicate_username: status_code = {}: {}'.format(resp.status_code, resp.json()['message']))
+        self.assertEqual(resp.status_code, 400)
+        self.assertContains(resp, 'already taken', status_code=400)
+
+        # a taken username is turned away before the password is hashed, no hasher is even looked up
+        with override_settings(PASSWORD_HASH_ALGORITHM='not-a-hasher'):
+            resp = self._create_json_request('/snaplife/api/auth/user/create/', data)
+        self.assertContains(resp, 'already taken', status_code=400)
@@ -1,16 +1,21 @@
 """ handles authenticating a user, or creating/deleting a new user """
 import json
 from uuid import uuid4
-from secrets import token_hex
 from user.models import Users
-from lifesnap.aws import AWS
 from lifesnap.util import JSONResponse
+from contextlib import ExitStack
+from lifesnap.storage import content_key, release_later
+from lifesnap.upload_queue import queue_profile_image
+from lifesnap.upload import read_json_upload
+from lifesnap.derivatives import variant_keys
+from lifesnap.passwords import needs_rehash, set_password, verify_password
+from lifesnap.profiles import USER_ID, USER_NAME, resolve_user
 
 from django.views import View
+from django.conf import settings
 from django.utils import timezone
 from django.http import HttpRequest
-from django.db import IntegrityError
-from django.core.signing import Signer
+from django.db import IntegrityError, transaction
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
@@ -41,14 +46,6 @@ class AuthUserLogin(View):
         }
     """
 
-    def _verify_user_password(self, user: Users, pass_check: str)-> bool:
-        signer = Signer(salt=user.salt_hash)
-        user_pass_hash = user.password_hash
-        challenge_hash = signer.signature(pass_check)
-
-        return user_pass_hash == challenge_hash
-
-
     def post(self, request: HttpRequest):
         try:
             request_json = json.loads(request.body.decode('UTF-8'))
@@ -56,7 +53,7 @@ class AuthUserLogin(View):
             return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_name__exact=request_json.get('username'))
+            user = resolve_user(request_json.get('username'), USER_NAME, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user {} is not found'.format(request_json.get('username')))
 
@@ -69,9 +66,12 @@ class AuthUserLogin(View):
                 lastname=user.last_name
             )
 
-        if self._verify_user_password(user, request_json.get('password')):
+        if verify_password(user, request_json.get('password')):
             user.last_login_date = timezone.now()
             user.is_active = True
+            if needs_rehash(user):
+                # move the user onto the configured algorithm and cost while we have the plain password
+                set_password(user, request_json.get('password'))
             request.session['{}'.format(user.user_id)] = True
             user.save()
         else:
@@ -104,7 +104,7 @@ class AuthUserLogoff(View):
             return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_id__exact=request_json.get('userid'))
+            user = resolve_user(request_json.get('userid'), USER_ID, fresh=True)
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user {} is not found'.format(request_json.get('userid')))
 
@@ -138,11 +138,26 @@ class AuthUserCreate(View):
                 raise ValueError('Item {} doesn\'t meet length requirements.'.format(item))
 
     def post(self, request: HttpRequest):
+        # the profile picture is decoded straight from the request stream, the body is never buffered whole
         try:
-            request_json = json.loads(request.body.decode('UTF-8'))
+            (request_json, profile_pic) = read_json_upload(
+                request,
+                'profilepic',
+                max_bytes=settings.UPLOAD_MAX_BYTES,
+                spool_max=settings.UPLOAD_SPOOL_MAX_BYTES
+            )
         except json.JSONDecodeError:
             return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
+        except ValueError as err:
+            return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
+
+        # the spooled picture is closed on every way out, until the upload queue takes it over
+        with ExitStack() as cleanup:
+            if profile_pic is not None:
+                cleanup.callback(profile_pic.close)
+            return self._create_user(request, request_json, profile_pic, cleanup)
 
+    def _create_user(self, request: HttpRequest, request_json: dict, profile_pic, cleanup: ExitStack):
         # these are required keys
         _user_name = request_json.get('username')
         _first_name = request_json.get('firstname')
@@ -159,46 +174,38 @@ class AuthUserCreate(View):
         except ValueError as err:
             return JSONResponse.new(code=400, message='{}'.format(err.args[0]))
 
-        try:
-            Users.objects.get(user_name__exact=_user_name)
-        except ObjectDoesNotExist:
-            # GOOD, lets create a new user
-            new_user = Users()
-            salt = token_hex(16)
-            signer = Signer(salt=salt)
-
-            new_user.user_id = uuid4().time_mid
-            new_user.first_name = _first_name
-            new_user.last_name = _last_name
-            new_user.user_name = _user_name
-            new_user.salt_hash = salt
-            new_user.password_hash = signer.signature(_password)
-            new_user.email = request_json.get('email', '{}@noemail.set'.format(_user_name))
-            new_user.about = request_json.get('about', '')
-            new_user.last_login_date = timezone.now()
-            new_user.is_active = True
-
-            if request_json.get('profilepic') is not None:
-                aws = AWS('snap-life')
-                key_name = '{}.png'.format(request_json.get('profilepic'))
-                url = aws.upload_profile_image(new_user.user_name, key_name)
-
-                new_user.profile_url = url
-            else:
-                new_user.profile_url = 'static/assets/usericon.png'
-
-            try:
-                new_user.save()
-                request.session['{}'.format(new_user.user_id)] = True
-            except IntegrityError as err:
-                # if this is because we have a collision with our random numbers
-                # hash, userID etc. re-create them
-                del request.session['{}'.format(new_user.user_id)]
-                return JSONResponse.new(code=500, message='username and email need to be unique')
-
-        else:
+        # the password hash is deliberately slow, a taken username is turned away before paying for it
+        if Users.objects.filter(user_name__exact=_user_name).exists():
             return JSONResponse.new(code=400, message='username {} is already taken'.format(_user_name))
 
+        new_user = Users()
+        new_user.user_id = uuid4().time_mid
+        new_user.first_name = _first_name
+        new_user.last_name = _last_name
+        new_user.user_name = _user_name
+        new_user.email = request_json.get('email', '{}@noemail.set'.format(_user_name))
+        new_user.about = request_json.get('about', '')
+        new_user.last_login_date = timezone.now()
+        new_user.is_active = True
+        new_user.profile_url = 'static/assets/usericon.png'
+        set_password(new_user, _password)
+
+        # two signups for the same name can both get past the check above, the unique constraint decides
+        try:
+            with transaction.atomic():
+                new_user.save()
+        except IntegrityError:
+            if Users.objects.filter(user_name__exact=_user_name).exists():
+                return JSONResponse.new(code=400, message='username {} is already taken'.format(_user_name))
+            return JSONResponse.new(code=500, message='username and email need to be unique')
+
+        # upload once the username is ours, a failed signup must not hold a reference to the picture.
+        # the user has the default icon until the queue has stored the picture
+        if profile_pic is not None:
+            cleanup.pop_all()
+            queue_profile_image(new_user, content_key(profile_pic, prefix='profilepic/'), profile_pic)
+
+        request.session['{}'.format(new_user.user_id)] = True
         return JSONResponse.new(code=200, message='success', userid=new_user.user_id)
 
 
@@ -211,41 +218,32 @@ class AuthUserDelete(View):
         }
         sucessfull deletion will return the user_id of the removed user.
     """
-    def _verify_user_password(self, user: Users, pass_check: str)-> bool:
-        signer = Signer(salt=user.salt_hash)
-        user_pass_hash = user.password_hash
-        challenge_hash = signer.signature(pass_check)
-
-        return user_pass_hash == challenge_hash
-
     def post(self, request: HttpRequest):
-        aws = AWS('snap-life')
-
         try:
             resp_json = json.loads(request.body.decode('utf-8'))
         except json.JSONDecodeError:
             return JSONResponse.new(code=400, message='request decode error, bad data sent to the server')
 
         try:
-            user = Users.objects.get(user_name__exact=resp_json.get('username'))
+            user = resolve_user(resp_json.get('username'), USER_NAME, fresh=True)
             user_id = user.user_id
         except ObjectDoesNotExist:
             return JSONResponse.new(code=400, message='user {} is not found'.format(resp_json['username']))
 
-        if self._verify_user_password(user, resp_json.get('password')):
+        if verify_password(user, resp_json.get('password')):
             try:
                 del request.session['{}'.format(user.user_id)]
             except KeyError:
                 pass
 
-            all_post = user.posts_set.all()
-            post_key_names = []
-            for post in all_post:
-                if post.image_name:
-                    post_key_names.append(post.image_name)
+            # images shared with other users are kept until their last reference is released
+            key_names = [user.profile_image_key()] + variant_keys(user.profile_variants)
+            for post in user.posts_set.all():
+                if post.image_name and post.image_status == 'ready':
+                    key_names.append(post.image_name)
+                key_names.extend(variant_keys(post.image_variants))
 
-            aws.remove_images(post_key_names)
-            aws.remove_profile_image(user.user_name)
+            release_later(key_names)
             user.delete()
         else:
             return JSONResponse.new(code=400, message='username {}, or password is incorrect'.format(resp_json.get('username')))